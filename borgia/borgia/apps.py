@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+class BorgiaConfig(AppConfig):
+    name = 'borgia'
+
+    def ready(self):
+        # Register the system checks
+        from borgia.checks import check_shared_cache
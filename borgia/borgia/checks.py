@@ -0,0 +1,26 @@
+"""
+System checks of the deployment settings.
+"""
+from django.conf import settings
+from django.core.checks import Warning, register
+
+# Backends keeping the data in the process, not shared by the workers.
+LOCAL_CACHE_BACKENDS = ('django.core.cache.backends.locmem.LocMemCache',)
+
+
+@register(deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    """
+    The cached fragments, directory and lists are invalidated by bumping
+    versions or deleting keys in the cache: with a cache local to each
+    process, the other workers keep serving stale data.
+    """
+    backend = settings.CACHES['default']['BACKEND']
+    if backend in LOCAL_CACHE_BACKENDS:
+        return [Warning(
+            'The default cache is local to each process, the invalidations '
+            'of a worker are not seen by the others.',
+            hint='Use a cache shared by the workers, see CACHES in contrib/production/settings.py.',
+            id='borgia.W001',
+        )]
+    return []
@@ -0,0 +1,218 @@
+"""
+Benchmark the hot paths of Borgia on the current database.
+
+Every iteration runs in a transaction rolled back afterwards, the database is
+left untouched. Run generate_dataset first to get meaningful figures.
+"""
+import datetime
+import decimal
+import hashlib
+import json
+import time
+
+from django.contrib.auth.models import Group
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from borgia.performance import percentile
+from borgia.utils import INTERNALS_GROUP_NAME
+from configurations.utils import configuration_get
+from events.models import Event
+from modules.models import OperatorSaleModule, SelfSaleModule
+from sales.models import Sale
+from shops.models import Shop
+from stocks.models import Inventory
+from users.models import User
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+class QueryCounter:
+    """
+    Database execute wrapper counting queries, without the query log limit
+    and overhead of CaptureQueriesContext.
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = ("Time the sale, checkup, workboard and payment hot paths and "
+            "output the results as JSON.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20,
+                            help="Number of timed runs of each benchmark.")
+        parser.add_argument('--warmup', type=int, default=2,
+                            help="Number of untimed runs before timing.")
+        parser.add_argument('--only', nargs='+', default=None,
+                            help="Names of the benchmarks to run.")
+        parser.add_argument('--output', default=None,
+                            help="File to write the JSON results in, stdout by default.")
+
+    def handle(self, *args, **options):
+        self.prepare()
+        benchmarks = self.get_benchmarks()
+        if options['only']:
+            unknown = set(options['only']) - set(benchmarks)
+            if unknown:
+                raise CommandError("Unknown benchmarks: " + ', '.join(sorted(unknown)))
+            benchmarks = {name: benchmarks[name] for name in options['only']}
+
+        results = {
+            'date': datetime.datetime.now().isoformat(),
+            'database': connection.vendor,
+            'iterations': options['iterations'],
+            'dataset': {
+                'users': User.objects.count(),
+                'shops': Shop.objects.count(),
+                'sales': Sale.objects.count(),
+            },
+            'benchmarks': {},
+        }
+        # The test client needs its host to be allowed.
+        with override_settings(ALLOWED_HOSTS=['testserver']):
+            for name, run in benchmarks.items():
+                results['benchmarks'][name] = self.measure(
+                    run, options['iterations'], options['warmup'])
+
+        output = json.dumps(results, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as output_file:
+                output_file.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+    def prepare(self):
+        """
+        Pick the objects benchmarked: a shop with both sale modules, one of
+        its chiefs as operator, a member with a positive balance, an ongoing
+        event and the last inventory.
+        """
+        self.selfsalemodule = SelfSaleModule.objects.filter(
+            state=True, categories__isnull=False).select_related('shop').first()
+        if self.selfsalemodule is None:
+            raise CommandError("No active self sale module with categories, run generate_dataset first.")
+        self.shop = self.selfsalemodule.shop
+        self.operatorsalemodule = OperatorSaleModule.objects.filter(
+            shop=self.shop, state=True, categories__isnull=False).first()
+        if self.operatorsalemodule is None:
+            raise CommandError("No active operator sale module for shop " + self.shop.name + ".")
+
+        self.operator = User.objects.filter(
+            is_active=True, groups=Group.objects.get(name='chiefs-' + self.shop.name)).first()
+        self.member = User.objects.filter(
+            is_active=True, groups__name=INTERNALS_GROUP_NAME).exclude(pk=1).order_by('-balance').first()
+        self.event = Event.objects.filter(done=False).annotate(
+            weights=Sum('weightsuser__weights_participation')).filter(weights__gt=0).first()
+        self.inventory = Inventory.objects.filter(shop=self.shop).order_by('-datetime').first()
+        if None in (self.operator, self.member, self.event, self.inventory):
+            raise CommandError("Incomplete dataset, run generate_dataset first.")
+
+        self.member_client = Client()
+        self.member_client.force_login(self.member)
+        self.operator_client = Client()
+        self.operator_client.force_login(self.operator)
+
+    def get_sale_data(self, module):
+        """
+        Order one product, and post the other fields as the browser does.
+        """
+        data = {}
+        ordered = False
+        for category in module.categories.order_by('order'):
+            for category_product in category.categoryproduct_set.filter(
+                    product__is_active=True, product__is_removed=False):
+                field = '%d-%d' % (category_product.pk, category.pk)
+                data[field] = 0
+                if not ordered and category_product.get_price() > 0:
+                    data[field] = 1
+                    ordered = True
+        if not ordered:
+            raise CommandError("No product to sell in module " + str(module) + ".")
+        return data
+
+    def get_lydia_callback_data(self):
+        data = {
+            'currency': 'EUR',
+            'request_id': 'benchmark',
+            'amount': '10.00',
+            'signed': '0',
+            'transaction_identifier': 'benchmark',
+            'vendor_token': configuration_get('VENDOR_TOKEN_LYDIA').get_value(),
+        }
+        token = configuration_get('API_TOKEN_LYDIA').get_value()
+        signature = '&'.join(key + '=' + data[key] for key in sorted(data)) + '&' + token
+        data['sig'] = hashlib.md5(signature.encode()).hexdigest()
+        return data
+
+    def get_benchmarks(self):
+        shop_kwargs = {'shop_pk': self.shop.pk}
+        self_sale_url = reverse('url_shop_module_sale', kwargs={
+            'shop_pk': self.shop.pk, 'module_class': 'self_sales'})
+        operator_sale_url = reverse('url_shop_module_sale', kwargs={
+            'shop_pk': self.shop.pk, 'module_class': 'operator_sales'})
+        self_sale_data = self.get_sale_data(self.selfsalemodule)
+        operator_sale_data = self.get_sale_data(self.operatorsalemodule)
+        operator_sale_data['client'] = self.member.username
+        lydia_callback_url = reverse('url_self_lydia_callback') + '?user_pk=' + str(self.member.pk)
+        lydia_callback_data = self.get_lydia_callback_data()
+        association = User.objects.get(pk=1)
+        event_price = decimal.Decimal(self.event.weights * 2)
+
+        return {
+            'self_sale_get': lambda: self.member_client.get(self_sale_url),
+            'self_sale_post': lambda: self.member_client.post(self_sale_url, self_sale_data),
+            'operator_sale_get': lambda: self.operator_client.get(operator_sale_url),
+            'operator_sale_post': lambda: self.operator_client.post(operator_sale_url, operator_sale_data),
+            'shop_checkup': lambda: self.operator_client.get(
+                reverse('url_shop_checkup', kwargs=shop_kwargs)),
+            'shop_workboard': lambda: self.operator_client.get(
+                reverse('url_shop_workboard', kwargs=shop_kwargs)),
+            'members_workboard': lambda: self.member_client.get(reverse('url_members_workboard')),
+            'self_transaction_list': lambda: self.member_client.get(reverse('url_self_transaction_list')),
+            'username_from_username_part': lambda: self.operator_client.get(
+                reverse('url_ajax_username_from_username_part'), {'keywords': self.member.family}),
+            'self_lydia_callback': lambda: Client().post(lydia_callback_url, lydia_callback_data),
+            'event_pay_by_total': lambda: Event.objects.get(pk=self.event.pk).pay_by_total(
+                self.operator, association, event_price),
+            'inventory_update_correcting_factors': lambda: Inventory.objects.get(
+                pk=self.inventory.pk).update_correcting_factors(),
+        }
+
+    def measure(self, run, iterations, warmup):
+        durations = []
+        queries = []
+        for iteration in range(warmup + iterations):
+            counter = QueryCounter()
+            with transaction.atomic(), connection.execute_wrapper(counter):
+                start = time.perf_counter()
+                response = run()
+                duration = time.perf_counter() - start
+                transaction.set_rollback(True)
+            status_code = getattr(response, 'status_code', None)
+            if status_code is not None and status_code >= 400:
+                raise CommandError("Benchmarked request answered with status " + str(status_code) + ".")
+            if iteration >= warmup:
+                durations.append(duration * 1000)
+                queries.append(counter.count)
+
+        durations.sort()
+        result = {
+            'queries': max(queries),
+            'min_ms': round(durations[0], 3),
+            'mean_ms': round(sum(durations) / len(durations), 3),
+            'max_ms': round(durations[-1], 3),
+        }
+        for rank in PERCENTILES:
+            result['p%d_ms' % rank] = round(percentile(durations, rank), 3)
+        return result
@@ -0,0 +1,476 @@
+"""
+Generate a synthetic dataset, with the volumes of a production database.
+"""
+import datetime
+import decimal
+import random
+import string
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from borgia.utils import INTERNALS_GROUP_NAME
+from events.models import Event, WeightsUser
+from finances.models import (Cash, Cheque, ExceptionnalMovement, Lydia,
+                             Recharging, Transfert)
+from modules.models import (Category, CategoryProduct, OperatorSaleModule,
+                            SelfSaleModule)
+from modules.utils import invalidate_module_directory
+from sales.models import Sale, SaleProduct
+from sales.utils import rebuild_sale_rollups
+from shops.models import Product, Shop
+from shops.utils import record_price_history, update_stock_counters
+from stocks.models import (Inventory, InventoryProduct, StockEntry,
+                           StockEntryProduct)
+from users.models import User, invalidate_list_year
+
+# unit: (quantity of a stock entry line, price of this quantity, quantities
+# sold through the modules)
+PRODUCT_TYPES = {
+    'CL': (3000, (60, 120), (25, 50)),
+    'G': (1000, (8, 20), (100, 250)),
+    None: (24, (6, 18), (0,)),
+}
+
+
+def letters(index):
+    """
+    Return a lowercase name made of letters only, as needed by Shop.name.
+    """
+    name = ''
+    while True:
+        index, remainder = divmod(index, 26)
+        name = string.ascii_lowercase[remainder] + name
+        if index == 0:
+            return name
+        index -= 1
+
+
+def cents(value):
+    return decimal.Decimal(value).quantize(decimal.Decimal('0.01'))
+
+
+class Command(BaseCommand):
+    help = ("Generate a synthetic dataset (users, shops, stocks, sales, "
+            "rechargings, transferts and events) with bulk inserts.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000,
+                            help="Number of users.")
+        parser.add_argument('--shops', type=int, default=4,
+                            help="Number of shops.")
+        parser.add_argument('--products', type=int, default=30,
+                            help="Number of products per shop.")
+        parser.add_argument('--categories', type=int, default=4,
+                            help="Number of categories per sale module.")
+        parser.add_argument('--years', type=int, default=2,
+                            help="Number of years of history.")
+        parser.add_argument('--sales-per-day', type=int, default=100,
+                            help="Number of sales per day, all shops together.")
+        parser.add_argument('--rechargings', type=int, default=6,
+                            help="Number of rechargings per user.")
+        parser.add_argument('--transferts', type=int, default=2,
+                            help="Number of transferts per user.")
+        parser.add_argument('--events', type=int, default=40,
+                            help="Number of events.")
+        parser.add_argument('--password', default='borgia',
+                            help="Password of every generated user.")
+        parser.add_argument('--seed', type=int, default=53,
+                            help="Seed of the random generator.")
+        parser.add_argument('--batch-size', type=int, default=2000,
+                            help="Number of rows per insert query.")
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.verbosity = options['verbosity']
+        self.next_pks = {}
+        self.balances = {}
+
+        try:
+            self.association = User.objects.get(pk=1)
+        except User.DoesNotExist:
+            raise CommandError(
+                "The association user (pk=1) doesn't exist, load the initial fixtures first.")
+        if Shop.objects.filter(name='dataset' + letters(0)).exists():
+            raise CommandError("A dataset has already been generated in this database.")
+
+        # Dates are relative to today only, a given seed generates the same
+        # dataset during the whole day.
+        self.end = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        self.begin = self.end - datetime.timedelta(days=365 * options['years'])
+
+        with transaction.atomic():
+            self.generate_users(options['users'], options['password'])
+            self.generate_shops(options['shops'], options['products'], options['categories'])
+            self.generate_stocks()
+            self.generate_sales(options['sales_per_day'])
+            self.generate_rechargings(options['rechargings'])
+            self.generate_transferts(options['transferts'])
+            self.generate_events(options['events'])
+            self.update_balances()
+            self.reset_sequences()
+            # Bulk creations don't maintain the derived data: stock counters,
+            # price history, sales rollups and cached reference data.
+            update_stock_counters(Product.objects.all())
+            record_price_history(Product.objects.all())
+            rebuild_sale_rollups()
+        invalidate_list_year()
+        invalidate_module_directory()
+
+    def log(self, message):
+        if self.verbosity > 0:
+            self.stdout.write(message)
+
+    def random_datetime(self, begin=None, end=None):
+        begin = begin or self.begin
+        end = end or self.end
+        return begin + datetime.timedelta(
+            seconds=self.random.randint(0, int((end - begin).total_seconds())))
+
+    def allocate_pks(self, model, number):
+        """
+        Return the next free pks of the model.
+
+        Pks are set explicitly so that related rows can be bulk inserted too,
+        whatever the database backend.
+        """
+        if model not in self.next_pks:
+            last_pk = model.objects.aggregate(Max('pk'))['pk__max'] or 0
+            self.next_pks[model] = last_pk + 1
+        first_pk = self.next_pks[model]
+        self.next_pks[model] += number
+        return range(first_pk, first_pk + number)
+
+    def get_batch_size(self, model, objects, fields=None):
+        """
+        Cap the batch size to the limits of the database backend (SQLite).
+        """
+        fields = fields or model._meta.concrete_fields
+        return max(1, min(self.batch_size, connection.ops.bulk_batch_size(fields, objects)))
+
+    def new(self, model, **kwargs):
+        """
+        Instantiate an object with its pk, to be referenced before its insert.
+        """
+        return model(pk=self.allocate_pks(model, 1)[0], **kwargs)
+
+    def bulk_create(self, model, objects):
+        without_pk = [obj for obj in objects if obj.pk is None]
+        for pk, obj in zip(self.allocate_pks(model, len(without_pk)), without_pk):
+            obj.pk = pk
+        model.objects.bulk_create(objects, batch_size=self.get_batch_size(model, objects))
+        self.log("%d %s created." % (len(objects), model._meta.verbose_name_plural))
+        return objects
+
+    def credit(self, user_pk, amount):
+        self.balances[user_pk] = self.balances.get(user_pk, 0) + amount
+
+    def generate_users(self, number, password):
+        password = make_password(password)
+        campuses = [choice[0] for choice in User.CAMPUS_CHOICES]
+        current_year = self.end.year
+        users = []
+        for i in range(number):
+            campus = self.random.choice(campuses)
+            year = self.random.randint(current_year - 4, current_year)
+            users.append(User(
+                username='%d%s%d' % (i, campus.capitalize(), year % 100),
+                password=password,
+                first_name='Prénom%d' % i,
+                last_name='Nom%d' % i,
+                surname='Bucque%d' % i,
+                family=str(i),
+                campus=campus,
+                year=year,
+                email='user%d@borgia.local' % i,
+                is_active=self.random.random() > 0.05,
+                theme=self.random.choice(User.THEME_CHOICES)[0]))
+        self.users = self.bulk_create(User, users)
+        self.user_pks = [user.pk for user in self.users]
+
+        members = Group.objects.get(name=INTERNALS_GROUP_NAME)
+        Membership = User.groups.through
+        memberships = [Membership(user_id=pk, group_id=members.pk) for pk in self.user_pks]
+        Membership.objects.bulk_create(
+            memberships, batch_size=self.get_batch_size(Membership, memberships))
+
+    def generate_shops(self, number, nb_products, nb_categories):
+        self.shops = []
+        self.products = {}
+        self.sale_prices = {}
+        self.category_products = {}
+        Membership = User.groups.through
+        memberships = []
+        for i in range(number):
+            # Created one by one, signals create groups and permissions.
+            shop = Shop.objects.create(
+                name='dataset' + letters(i),
+                description='Magasin généré n°%d' % i,
+                color='#%06X' % self.random.randint(0, 0xFFFFFF))
+            self.shops.append(shop)
+            for group_name in ('chiefs-', 'associates-'):
+                group = Group.objects.get(name=group_name + shop.name)
+                memberships += [Membership(user_id=pk, group_id=group.pk)
+                                for pk in self.random.sample(self.user_pks, min(3, len(self.user_pks)))]
+
+            products = []
+            for j in range(nb_products):
+                unit = self.random.choice(list(PRODUCT_TYPES))
+                is_manual = self.random.random() < 0.2
+                products.append(Product(
+                    name='Produit %d-%d' % (i, j), unit=unit, shop=shop,
+                    is_manual=is_manual,
+                    manual_price=cents(self.random.uniform(1, 10)) if is_manual else 0,
+                    is_active=self.random.random() > 0.1))
+            self.products[shop] = self.bulk_create(Product, products)
+
+            self.category_products[shop] = {}
+            for module_model in (SelfSaleModule, OperatorSaleModule):
+                module = module_model.objects.create(shop=shop, state=True)
+                content_type = ContentType.objects.get_for_model(module_model)
+                categories = self.bulk_create(Category, [
+                    Category(name='Catégorie %d' % k, content_type=content_type,
+                             module_id=module.pk, order=k)
+                    for k in range(nb_categories)])
+                category_products = []
+                for product in self.products[shop]:
+                    if not product.is_active:
+                        continue
+                    for quantity in PRODUCT_TYPES[product.unit][2]:
+                        category_products.append(CategoryProduct(
+                            category=self.random.choice(categories),
+                            product=product, quantity=quantity))
+                self.category_products[shop][module] = self.bulk_create(
+                    CategoryProduct, category_products)
+        Membership.objects.bulk_create(
+            memberships, batch_size=self.get_batch_size(Membership, memberships))
+
+    def generate_stocks(self):
+        """
+        A stock entry per shop every week, and an inventory every month.
+        """
+        operator_pk = self.user_pks[0]
+        for shop in self.shops:
+            stockentries = []
+            inventories = []
+            day = self.begin
+            while day < self.end:
+                stockentries.append(self.new(
+                    StockEntry, datetime=day + datetime.timedelta(hours=10),
+                    operator_id=operator_pk, shop=shop))
+                if day.day <= 7:
+                    inventories.append(Inventory(
+                        datetime=day + datetime.timedelta(hours=9),
+                        operator_id=operator_pk, shop=shop))
+                day += datetime.timedelta(days=7)
+            lines = []
+            for stockentry in stockentries:
+                stockentry_lines = []
+                for product in self.random.sample(self.products[shop], len(self.products[shop]) // 2):
+                    quantity, prices, _ = PRODUCT_TYPES[product.unit]
+                    stockentry_lines.append(StockEntryProduct(
+                        stockentry=stockentry, product=product,
+                        quantity=quantity,
+                        price=cents(self.random.uniform(*prices))))
+                stockentry.summarize(stockentry_lines)
+                lines += stockentry_lines
+            self.bulk_create(StockEntry, stockentries)
+            self.bulk_create(Inventory, inventories)
+            self.bulk_create(StockEntryProduct, lines)
+
+            lines = []
+            for inventory in inventories:
+                for product in self.products[shop]:
+                    lines.append(InventoryProduct(
+                        inventory=inventory, product=product,
+                        quantity=self.random.randint(0, PRODUCT_TYPES[product.unit][0] * 2)))
+            self.bulk_create(InventoryProduct, lines)
+
+            for product in self.products[shop]:
+                quantity, prices, _ = PRODUCT_TYPES[product.unit]
+                unit_price = decimal.Decimal(sum(prices) / 2 / quantity)
+                if product.unit == 'CL':
+                    unit_price *= 100
+                elif product.unit == 'G':
+                    unit_price *= 1000
+                self.sale_prices[product] = unit_price * decimal.Decimal('1.05')
+
+    def get_line_price(self, category_product):
+        price = self.sale_prices[category_product.product]
+        if category_product.product.unit == 'CL':
+            return cents(category_product.quantity * price / 100)
+        if category_product.product.unit == 'G':
+            return cents(category_product.quantity * price / 1000)
+        return cents(price)
+
+    def generate_sales(self, sales_per_day):
+        days = (self.end - self.begin).days
+        modules = [(shop, module) for shop in self.shops
+                   for module in self.category_products[shop]
+                   if self.category_products[shop][module]]
+        if not modules:
+            return
+        content_types = {
+            module: ContentType.objects.get_for_model(module) for _, module in modules}
+        sales = []
+        lines = []
+        # Sales are generated and inserted day by day to bound memory.
+        for day in range(days):
+            begin = self.begin + datetime.timedelta(days=day)
+            for _ in range(sales_per_day):
+                shop, module = self.random.choice(modules)
+                sender_pk = self.random.choice(self.user_pks)
+                operator_pk = sender_pk if isinstance(module, SelfSaleModule) else self.user_pks[0]
+                sale = self.new(
+                    Sale, datetime=self.random_datetime(begin, begin + datetime.timedelta(days=1)),
+                    sender_id=sender_pk, recipient=self.association,
+                    operator_id=operator_pk, content_type=content_types[module],
+                    module_id=module.pk, shop=shop)
+                sales.append(sale)
+                category_products = self.category_products[shop][module]
+                sale_lines = []
+                for category_product in self.random.sample(
+                        category_products, min(len(category_products), self.random.randint(1, 3))):
+                    invoice = self.random.randint(1, 3)
+                    price = self.get_line_price(category_product) * invoice
+                    sale_lines.append(SaleProduct(
+                        sale=sale, product=category_product.product,
+                        quantity=category_product.quantity * invoice,
+                        price=price))
+                    self.credit(sender_pk, -price)
+                sale.summarize(sale_lines)
+                lines += sale_lines
+            if len(sales) >= self.batch_size or day == days - 1:
+                self.bulk_create(Sale, sales)
+                self.bulk_create(SaleProduct, lines)
+                sales = []
+                lines = []
+
+    def generate_rechargings(self, per_user):
+        solution_models = (Cash, Cheque, Lydia)
+        content_types = ContentType.objects.get_for_models(*solution_models)
+        solutions = {model: [] for model in solution_models}
+        for pk in self.user_pks:
+            for _ in range(per_user):
+                model = self.random.choice(solution_models)
+                amount = decimal.Decimal(self.random.choice((10, 20, 30, 50, 100)))
+                datetime_recharging = self.random_datetime()
+                solution = model(sender_id=pk, amount=amount)
+                if model is Cheque:
+                    solution.signature_date = datetime_recharging.date()
+                    solution.cheque_number = '%07d' % self.random.randint(0, 9999999)
+                    solution.is_cashed = self.random.random() > 0.1
+                elif model is Lydia:
+                    solution.date_operation = datetime_recharging.date()
+                    solution.is_online = self.random.random() > 0.3
+                    solution.id_from_lydia = '%d%08d' % (pk, self.random.randint(0, 99999999))
+                    if solution.is_online:
+                        solution.fee = cents(decimal.Decimal('0.10') + amount * decimal.Decimal('0.015'))
+                solution.datetime = datetime_recharging
+                solutions[model].append(solution)
+                self.credit(pk, amount)
+
+        rechargings = []
+        for model, objects in solutions.items():
+            self.bulk_create(model, objects)
+            rechargings += [
+                Recharging(datetime=solution.datetime, sender_id=solution.sender_id,
+                           operator_id=(solution.sender_id
+                                        if model is Lydia and solution.is_online
+                                        else self.user_pks[0]),
+                           content_type=content_types[model], solution_id=solution.pk)
+                for solution in objects]
+        self.bulk_create(Recharging, rechargings)
+
+    def generate_transferts(self, per_user):
+        transferts = []
+        movements = []
+        for pk in self.user_pks:
+            for _ in range(per_user):
+                recipient_pk = self.random.choice(self.user_pks)
+                amount = cents(self.random.uniform(1, 20))
+                transferts.append(Transfert(
+                    datetime=self.random_datetime(), sender_id=pk,
+                    recipient_id=recipient_pk, amount=amount,
+                    justification='Transfert généré'))
+                self.credit(pk, -amount)
+                self.credit(recipient_pk, amount)
+            if self.random.random() < 0.05:
+                amount = cents(self.random.uniform(1, 50))
+                is_credit = self.random.random() > 0.5
+                movements.append(ExceptionnalMovement(
+                    datetime=self.random_datetime(), operator_id=self.user_pks[0],
+                    recipient_id=pk, amount=amount, is_credit=is_credit,
+                    justification='Mouvement généré'))
+                self.credit(pk, amount if is_credit else -amount)
+        self.bulk_create(Transfert, transferts)
+        self.bulk_create(ExceptionnalMovement, movements)
+
+    def generate_events(self, number):
+        events = []
+        weights = []
+        for i in range(number):
+            date = self.random_datetime(self.begin, self.end + datetime.timedelta(days=60))
+            done = date < self.end and self.random.random() > 0.2
+            event = self.new(
+                Event, description='Événement généré n°%d' % i, date=date.date(),
+                datetime=date, manager_id=self.random.choice(self.user_pks),
+                done=done, allow_self_registeration=not done,
+                date_end_registration=(date - datetime.timedelta(days=7)).date())
+            events.append(event)
+            roster = self.random.sample(self.user_pks, min(len(self.user_pks), self.random.randint(20, 150)))
+            event_weights = []
+            for pk in roster:
+                registeration = self.random.randint(1, 3)
+                participation = self.random.randint(0, registeration) if (done or date < self.end) else 0
+                event_weights.append(WeightsUser(
+                    user_id=pk, event=event, weights_registeration=registeration,
+                    weights_participation=participation))
+            weights += event_weights
+
+            if done:
+                # Same computation as Event.pay_by_total
+                total_price = cents(self.random.uniform(100, 2000))
+                total_weights = sum(weight.weights_participation for weight in event_weights)
+                event.price = total_price
+                event.remark = 'Paiement par Borgia (Prix total : ' + str(total_price) + ')'
+                if total_weights > 0:
+                    price_per_weight = round(total_price / total_weights, 2)
+                    for weight in event_weights:
+                        amount = weight.weights_participation * price_per_weight
+                        if amount > 0:
+                            self.credit(weight.user_id, -amount)
+                            self.credit(self.association.pk, amount)
+        self.bulk_create(Event, events)
+        self.bulk_create(WeightsUser, weights)
+
+    def update_balances(self):
+        """
+        Balances are the sum of the generated operations, as if they had been
+        paid one by one.
+        """
+        users = []
+        for pk, amount in self.balances.items():
+            if pk == self.association.pk:
+                self.association.balance += amount
+            else:
+                users.append(User(pk=pk, balance=amount))
+        User.objects.bulk_update(users, ['balance'], batch_size=self.get_batch_size(
+            User, users, [User._meta.get_field('balance')]))
+        self.association.save(update_fields=['balance'])
+
+    def reset_sequences(self):
+        """
+        Pks were set explicitly, sequences (PostgreSQL) must be updated.
+        """
+        statements = connection.ops.sequence_reset_sql(no_style(), list(self.next_pks))
+        with connection.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
@@ -0,0 +1,126 @@
+import collections
+import contextlib
+import threading
+import time
+
+from django.db import connections
+from django.template.base import Template
+from django.utils import timezone
+
+from borgia.performance import (TOP_QUERIES_SIZE, get_performance_store,
+                                get_slow_request_ms, sql_fingerprint)
+from borgia.routers import (REPLICA_STICKY_COOKIE, get_replica_alias,
+                            get_replica_sticky_seconds)
+
+_local = threading.local()
+_original_template_render = Template.render
+
+
+def _instrumented_template_render(self, context):
+    """
+    Time the outermost template rendering of the recorded request.
+
+    Included and extended templates are rendered within it, they're not
+    timed twice.
+    """
+    recorder = getattr(_local, 'recorder', None)
+    if recorder is None or recorder.template_depth > 0:
+        return _original_template_render(self, context)
+    recorder.template_depth += 1
+    start = time.perf_counter()
+    try:
+        return _original_template_render(self, context)
+    finally:
+        recorder.template_time += time.perf_counter() - start
+        recorder.template_depth -= 1
+
+
+class RequestRecorder:
+    """
+    Database execute wrapper recording the queries of a request.
+    """
+
+    def __init__(self):
+        self.queries = []
+        self.db_time = 0
+        self.template_time = 0
+        self.template_depth = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.queries.append((sql, repr(params)))
+
+
+class PerformanceMiddleware:
+    """
+    Record wall time, database time, number of queries, duplicated queries
+    and template rendering time of every request.
+
+    Opt-in: add 'borgia.middleware.PerformanceMiddleware' at the top of
+    MIDDLEWARE. Records are shown to managers on url_performance_dashboard.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if Template.render is _original_template_render:
+            Template.render = _instrumented_template_render
+
+    def __call__(self, request):
+        recorder = RequestRecorder()
+        _local.recorder = recorder
+        start = time.perf_counter()
+        try:
+            with contextlib.ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(recorder))
+                response = self.get_response(request)
+        finally:
+            _local.recorder = None
+        duration_ms = (time.perf_counter() - start) * 1000
+
+        resolver_match = getattr(request, 'resolver_match', None)
+        url_name = resolver_match.url_name if resolver_match and resolver_match.url_name else request.path
+        fingerprints = collections.Counter(sql_fingerprint(sql) for sql, _ in recorder.queries)
+        top_queries = []
+        if duration_ms >= get_slow_request_ms():
+            top_queries = [{'sql': sql, 'count': count}
+                           for sql, count in fingerprints.most_common(TOP_QUERIES_SIZE)]
+
+        get_performance_store().add({
+            'datetime': timezone.now(),
+            'url_name': url_name,
+            'path': request.path,
+            'method': request.method,
+            'status_code': response.status_code,
+            'duration_ms': duration_ms,
+            'db_ms': recorder.db_time * 1000,
+            'template_ms': recorder.template_time * 1000,
+            'queries': len(recorder.queries),
+            'duplicates': len(recorder.queries) - len(set(recorder.queries)),
+            'top_queries': top_queries,
+        })
+        return response
+
+
+class ReplicaStickinessMiddleware:
+    """
+    Keep a client on the primary database for a few seconds after a request
+    which may have written, with a cookie, so that it reads its own writes
+    despite the replication lag, see borgia.routers.
+    """
+    safe_methods = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if (request.method not in self.safe_methods and get_replica_alias() is not None
+                and not getattr(request, 'is_replica_read', False)):
+            response.set_cookie(REPLICA_STICKY_COOKIE, '1', max_age=get_replica_sticky_seconds(),
+                                httponly=True)
+        return response
@@ -2,9 +2,11 @@ from django.core.exceptions import ImproperlyConfigured
 from django.urls import reverse
 from django.views.generic.base import ContextMixin
 
-from borgia.utils import (ACCEPTED_MENU_TYPES, is_association_manager,
-                          managers_lateral_menu, members_lateral_menu,
-                          simple_lateral_link)
+from borgia.routers import dispatch_on_replica
+from borgia.utils import (ACCEPTED_MENU_TYPES, FRAGMENT_CACHE_TIMEOUT,
+                          get_data_version, get_permissions_fingerprint,
+                          is_association_manager, managers_lateral_menu,
+                          members_lateral_menu, simple_lateral_link)
 from shops.utils import get_shops_tree, shops_lateral_menu
 
 
@@ -117,3 +119,58 @@ class LateralMenuMixin(ContextMixin):
         context = super().get_context_data(**kwargs)
         context['nav_tree'] = self.get_menu()
         return context
+
+
+class ReplicaReadMixin:
+    """
+    Send the reads of the view to the replica database, see borgia.routers.
+
+    Only the methods in replica_methods are routed, views whose POST only
+    searches add it.
+    """
+    replica_methods = ('GET', 'HEAD')
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in self.replica_methods:
+            return super().dispatch(request, *args, **kwargs)
+        return dispatch_on_replica(request, super().dispatch, *args, **kwargs)
+
+
+class FragmentCacheMixin(ContextMixin):
+    """
+    Cache the data part of the page, rendered in the template within
+    {% cache fragment_cache_timeout <name> fragment_cache_key %}.
+
+    The key varies with the page (path and query arguments, the search forms
+    included), the permissions of the user and the versions of the data in
+    fragment_data, bumped by signals when it changes. The lateral menu,
+    messages and forms stay out of the fragment, rendered at each request.
+
+    The data must be computed lazily, so that a cached fragment saves its
+    queries.
+    """
+    fragment_data = ()
+    fragment_cache_per_user = False
+    fragment_cache_timeout = FRAGMENT_CACHE_TIMEOUT
+
+    def get_fragment_cache_vary(self):
+        """
+        Return what the fragment depends on, besides its data versions.
+        """
+        request = self.request
+        arguments = sorted(request.GET.lists()) + sorted(
+            (key, values) for key, values in request.POST.lists() if key != 'csrfmiddlewaretoken')
+        vary = [request.path, arguments, get_permissions_fingerprint(request.user)]
+        if self.fragment_cache_per_user:
+            vary.append(request.user.pk)
+        return vary
+
+    def get_fragment_cache_key(self):
+        versions = [get_data_version(name) for name in self.fragment_data]
+        return repr(self.get_fragment_cache_vary() + versions)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['fragment_cache_key'] = self.get_fragment_cache_key()
+        context['fragment_cache_timeout'] = self.fragment_cache_timeout
+        return context
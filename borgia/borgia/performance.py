@@ -0,0 +1,111 @@
+"""
+Per-request performance records, filled by borgia.middleware.PerformanceMiddleware.
+
+Records are kept in memory, in a bounded store: each worker process has its
+own store and records are lost on restart.
+"""
+import collections
+import math
+import re
+import threading
+
+from django.conf import settings
+
+DEFAULT_RECORDS_SIZE = 1000
+DEFAULT_SLOW_REQUEST_MS = 500
+TOP_QUERIES_SIZE = 5
+
+IN_PARAMETERS_REGEX = re.compile(r'IN \((%s, )+%s\)')
+NUMBER_REGEX = re.compile(r'\b\d+\b')
+
+
+def percentile(values, rank):
+    """
+    Nearest-rank percentile of sorted values.
+    """
+    return values[max(0, math.ceil(rank / 100 * len(values)) - 1)]
+
+
+def sql_fingerprint(sql):
+    """
+    Return the SQL without its parameters, to group identical queries.
+
+    Parameters are already placeholders, only lists of placeholders and
+    numbers inlined by the ORM (LIMIT, OFFSET) are collapsed.
+    """
+    sql = IN_PARAMETERS_REGEX.sub('IN (...)', sql)
+    return NUMBER_REGEX.sub('?', sql)
+
+
+def get_slow_request_ms():
+    return getattr(settings, 'PERFORMANCE_SLOW_REQUEST_MS', DEFAULT_SLOW_REQUEST_MS)
+
+
+def is_performance_enabled():
+    return 'borgia.middleware.PerformanceMiddleware' in settings.MIDDLEWARE
+
+
+class PerformanceStore:
+    """
+    Thread-safe store of the last request records.
+    """
+
+    def __init__(self, size):
+        self.records = collections.deque(maxlen=size)
+        self.lock = threading.Lock()
+
+    def add(self, record):
+        with self.lock:
+            self.records.append(record)
+
+    def get_records(self):
+        with self.lock:
+            return list(self.records)
+
+    def clear(self):
+        with self.lock:
+            self.records.clear()
+
+    def url_statistics(self):
+        """
+        Return statistics per url name, slowest p95 first.
+        """
+        records_by_url = collections.defaultdict(list)
+        for record in self.get_records():
+            records_by_url[record['url_name']].append(record)
+
+        statistics = []
+        for url_name, records in records_by_url.items():
+            durations = sorted(record['duration_ms'] for record in records)
+            count = len(records)
+            statistics.append({
+                'url_name': url_name,
+                'count': count,
+                'p50_ms': percentile(durations, 50),
+                'p95_ms': percentile(durations, 95),
+                'db_ms': sum(record['db_ms'] for record in records) / count,
+                'template_ms': sum(record['template_ms'] for record in records) / count,
+                'queries': sum(record['queries'] for record in records) / count,
+                'duplicates': max(record['duplicates'] for record in records),
+            })
+        return sorted(statistics, key=lambda statistic: statistic['p95_ms'], reverse=True)
+
+    def slow_requests(self, limit=50):
+        """
+        Return the last slow requests, newest first.
+        """
+        slow_records = [record for record in self.get_records() if record['top_queries']]
+        return slow_records[::-1][:limit]
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_performance_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = PerformanceStore(
+                getattr(settings, 'PERFORMANCE_RECORDS_SIZE', DEFAULT_RECORDS_SIZE))
+        return _store
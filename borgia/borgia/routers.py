@@ -0,0 +1,104 @@
+"""
+Routing of the reads of the reporting views to a replica database.
+
+Views opt in with borgia.mixins.ReplicaReadMixin or the use_replica decorator:
+their reads go to the alias named by the REPLICA_DATABASE setting when it's
+configured, writes always go to the primary. A client which
+has just written is kept on the primary for REPLICA_STICKY_SECONDS, see
+borgia.middleware.ReplicaStickinessMiddleware, not to miss its own writes
+because of the replication lag.
+"""
+import contextlib
+import functools
+import threading
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+REPLICA_STICKY_COOKIE = 'borgia_primary'
+
+_local = threading.local()
+
+
+def get_replica_alias():
+    """
+    Return the alias of the replica database, None if not configured.
+    """
+    alias = getattr(settings, 'REPLICA_DATABASE', None)
+    return alias if alias in settings.DATABASES else None
+
+
+def get_replica_sticky_seconds():
+    return getattr(settings, 'REPLICA_STICKY_SECONDS', 10)
+
+
+def is_sticky(request):
+    """
+    Return True if the client has written recently, and must read from the
+    primary.
+    """
+    return REPLICA_STICKY_COOKIE in request.COOKIES
+
+
+@contextlib.contextmanager
+def replica_reads(enabled=True):
+    """
+    Send the reads of the block to the replica database.
+    """
+    previous = getattr(_local, 'use_replica', False)
+    _local.use_replica = enabled
+    try:
+        yield
+    finally:
+        _local.use_replica = previous
+
+
+def dispatch_on_replica(request, view, *args, **kwargs):
+    """
+    Call the view with its reads sent to the replica, unless the client is
+    sticky. Template responses are rendered within, their lazy querysets
+    being evaluated by the rendering.
+    """
+    # The request doesn't write, it doesn't make the client sticky.
+    request.is_replica_read = True
+    with replica_reads(not is_sticky(request)):
+        response = view(request, *args, **kwargs)
+        if hasattr(response, 'render') and not response.is_rendered:
+            response.render()
+    return response
+
+
+def use_replica(view):
+    """
+    Decorator of function views, see dispatch_on_replica.
+    """
+    @functools.wraps(view)
+    def wrapped_view(request, *args, **kwargs):
+        return dispatch_on_replica(request, view, *args, **kwargs)
+    return wrapped_view
+
+
+class ReplicaRouter:
+    """
+    Send the reads to the replica within replica_reads, and every write to
+    the primary, even for instances read from the replica.
+    """
+
+    def db_for_read(self, model, **hints):
+        if getattr(_local, 'use_replica', False):
+            return get_replica_alias()
+        return None
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, get_replica_alias()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == get_replica_alias():
+            return False
+        return None
@@ -0,0 +1,15 @@
+from django.test import SimpleTestCase, override_settings
+
+from borgia.checks import check_shared_cache
+
+
+class SharedCacheCheckTestCase(SimpleTestCase):
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_local_cache(self):
+        self.assertEqual([warning.id for warning in check_shared_cache(None)], ['borgia.W001'])
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+                                           'LOCATION': 'borgia_cache'}})
+    def test_shared_cache(self):
+        self.assertEqual(check_shared_cache(None), [])
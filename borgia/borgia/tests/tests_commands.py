@@ -0,0 +1,97 @@
+import json
+import tempfile
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import transaction
+from django.db.models import Sum
+from django.test import TestCase
+
+from events.models import Event
+from finances.models import Cash, Cheque, ExceptionnalMovement, Lydia
+from sales.models import Sale, SaleProduct
+from shops.models import Shop
+from stocks.models import InventoryProduct, StockEntryProduct
+from users.models import User
+
+
+class GenerateDatasetCommandTestCase(TestCase):
+    fixtures = ['initial']
+
+    def generate(self):
+        call_command('generate_dataset', users=30, shops=2, products=5,
+                     years=1, sales_per_day=3, events=3, verbosity=0)
+
+    def test_volumes(self):
+        self.generate()
+        self.assertEqual(User.objects.filter(family__isnull=False).count(), 30)
+        self.assertEqual(Shop.objects.count(), 2)
+        self.assertEqual(Sale.objects.count(), 365 * 3)
+        self.assertTrue(SaleProduct.objects.exists())
+        self.assertTrue(StockEntryProduct.objects.exists())
+        self.assertTrue(InventoryProduct.objects.exists())
+        self.assertEqual(Event.objects.count(), 3)
+        for model in (Cash, Cheque, Lydia):
+            self.assertTrue(model.objects.exists())
+
+    def test_balances_match_operations(self):
+        def total(queryset, field):
+            return queryset.aggregate(total=Sum(field))['total'] or 0
+
+        initial_balances = total(User.objects.all(), 'balance')
+        self.generate()
+
+        expected = (
+            total(Cash.objects.all(), 'amount')
+            + total(Cheque.objects.all(), 'amount')
+            + total(Lydia.objects.all(), 'amount')
+            - total(SaleProduct.objects.all(), 'price')
+            + total(ExceptionnalMovement.objects.filter(is_credit=True), 'amount')
+            - total(ExceptionnalMovement.objects.filter(is_credit=False), 'amount'))
+        # Transferts and events only move money between users.
+        self.assertAlmostEqual(
+            total(User.objects.all(), 'balance') - initial_balances, expected, places=2)
+
+    def test_seed_reproducibility(self):
+        def get_generated():
+            return (list(User.objects.order_by('pk').values_list('username', 'balance')),
+                    list(SaleProduct.objects.order_by('pk').values_list('product__name', 'price')))
+
+        with transaction.atomic():
+            self.generate()
+            generated = get_generated()
+            transaction.set_rollback(True)
+
+        self.generate()
+        self.assertEqual(get_generated(), generated)
+
+    def test_already_generated(self):
+        self.generate()
+        with self.assertRaises(CommandError):
+            self.generate()
+
+
+class BenchmarkCommandTestCase(TestCase):
+    fixtures = ['initial']
+
+    def test_json_results(self):
+        call_command('generate_dataset', users=30, shops=1, products=5,
+                     years=1, sales_per_day=2, events=10, verbosity=0)
+        sales = Sale.objects.count()
+        with tempfile.NamedTemporaryFile('r', suffix='.json') as output:
+            call_command('benchmark', iterations=2, warmup=0, output=output.name)
+            results = json.load(output)
+
+        self.assertEqual(results['dataset']['sales'], sales)
+        self.assertIn('self_sale_post', results['benchmarks'])
+        self.assertIn('inventory_update_correcting_factors', results['benchmarks'])
+        for result in results['benchmarks'].values():
+            self.assertLessEqual(result['p50_ms'], result['p95_ms'])
+        # Benchmarks are rolled back.
+        self.assertEqual(Sale.objects.count(), sales)
+
+    def test_unknown_benchmark(self):
+        call_command('generate_dataset', users=30, shops=1, products=5,
+                     years=1, sales_per_day=2, events=10, verbosity=0)
+        with self.assertRaises(CommandError):
+            call_command('benchmark', only=['unknown'])
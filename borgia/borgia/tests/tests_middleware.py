@@ -0,0 +1,107 @@
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+
+from borgia.performance import (PerformanceStore, get_performance_store,
+                                percentile, sql_fingerprint)
+from users.models import User
+
+PERFORMANCE_MIDDLEWARE = 'borgia.middleware.PerformanceMiddleware'
+
+
+class PerformanceStoreTestCase(TestCase):
+
+    def get_record(self, url_name, duration_ms, top_queries=()):
+        return {
+            'url_name': url_name,
+            'duration_ms': duration_ms,
+            'db_ms': 1,
+            'template_ms': 2,
+            'queries': 3,
+            'duplicates': 1,
+            'top_queries': list(top_queries),
+        }
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 95), 95)
+        self.assertEqual(percentile([7], 95), 7)
+
+    def test_sql_fingerprint(self):
+        self.assertEqual(
+            sql_fingerprint('SELECT "id" FROM "users_user" WHERE "id" IN (%s, %s, %s) LIMIT 21'),
+            'SELECT "id" FROM "users_user" WHERE "id" IN (...) LIMIT ?')
+        self.assertEqual(
+            sql_fingerprint('SELECT "id" FROM "users_user" WHERE "id" IN (%s, %s)'),
+            sql_fingerprint('SELECT "id" FROM "users_user" WHERE "id" IN (%s, %s, %s, %s)'))
+
+    def test_bounded(self):
+        store = PerformanceStore(3)
+        for duration_ms in range(5):
+            store.add(self.get_record('url_a', duration_ms))
+        self.assertEqual([record['duration_ms'] for record in store.get_records()], [2, 3, 4])
+
+    def test_url_statistics(self):
+        store = PerformanceStore(100)
+        for duration_ms in range(1, 21):
+            store.add(self.get_record('url_a', duration_ms))
+        store.add(self.get_record('url_b', 100))
+        statistics = store.url_statistics()
+        self.assertEqual([statistic['url_name'] for statistic in statistics], ['url_b', 'url_a'])
+        self.assertEqual(statistics[1]['count'], 20)
+        self.assertEqual(statistics[1]['p50_ms'], 10)
+        self.assertEqual(statistics[1]['p95_ms'], 19)
+        self.assertEqual(statistics[1]['queries'], 3)
+
+    def test_slow_requests(self):
+        store = PerformanceStore(100)
+        store.add(self.get_record('url_a', 1))
+        store.add(self.get_record('url_b', 600, [{'sql': 'SELECT 1', 'count': 2}]))
+        store.add(self.get_record('url_c', 700, [{'sql': 'SELECT 1', 'count': 2}]))
+        self.assertEqual([record['url_name'] for record in store.slow_requests()], ['url_c', 'url_b'])
+
+
+class PerformanceMiddlewareTestCase(TestCase):
+    fixtures = ['initial']
+
+    def setUp(self):
+        get_performance_store().clear()
+        self.client = Client()
+        self.client.force_login(User.objects.get(pk=1))
+
+    def tearDown(self):
+        get_performance_store().clear()
+
+    def test_disabled(self):
+        self.client.get(reverse('url_members_workboard'))
+        self.assertEqual(get_performance_store().get_records(), [])
+
+    def test_record(self):
+        with self.modify_settings(MIDDLEWARE={'prepend': PERFORMANCE_MIDDLEWARE}):
+            self.client.get(reverse('url_members_workboard'))
+        records = get_performance_store().get_records()
+        self.assertEqual(len(records), 1)
+        record = records[0]
+        self.assertEqual(record['url_name'], 'url_members_workboard')
+        self.assertEqual(record['status_code'], 200)
+        self.assertGreater(record['queries'], 0)
+        self.assertGreater(record['template_ms'], 0)
+        self.assertLessEqual(record['db_ms'], record['duration_ms'])
+        self.assertLessEqual(record['template_ms'], record['duration_ms'])
+        self.assertEqual(record['top_queries'], [])
+
+    @override_settings(PERFORMANCE_SLOW_REQUEST_MS=0)
+    def test_slow_request(self):
+        with self.modify_settings(MIDDLEWARE={'prepend': PERFORMANCE_MIDDLEWARE}):
+            self.client.get(reverse('url_members_workboard'))
+        record = get_performance_store().get_records()[0]
+        self.assertTrue(record['top_queries'])
+        self.assertLessEqual(sum(query['count'] for query in record['top_queries']), record['queries'])
+
+    def test_dashboard(self):
+        with self.modify_settings(MIDDLEWARE={'prepend': PERFORMANCE_MIDDLEWARE}):
+            self.client.get(reverse('url_members_workboard'))
+            response = self.client.get(reverse('url_performance_dashboard'))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'url_members_workboard')
+        self.assertContains(response, reverse('url_performance_dashboard'))
@@ -0,0 +1,412 @@
+"""
+Query-count and wall-time budgets for every named URL.
+
+Each named URL of borgia.urls is requested as the role declared in
+URL_BUDGETS, against a dataset big enough to reveal N+1 queries. A view
+exceeding its budget fails with the SQL it executed.
+"""
+import decimal
+import io
+import json
+import time
+from functools import partial
+from urllib.parse import urlencode
+
+from django.contrib.auth.models import Group, Permission
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, transaction
+from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import get_resolver, reverse
+from django.urls.resolvers import URLResolver
+from django.utils import timezone
+from openpyxl import Workbook
+
+from borgia.utils import INTERNALS_GROUP_NAME, PRESIDENTS_GROUP_NAME
+from configurations.utils import configuration_get
+from events.models import Event, WeightsUser
+from finances.models import (Cash, Cheque, ExceptionnalMovement, Lydia,
+                             Recharging, Transfert)
+from finances.utils import sign_lydia_params
+from modules.models import (Category, CategoryProduct, OperatorSaleModule,
+                            SelfSaleModule)
+from sales.models import Sale, SaleProduct
+from shops.models import Product, Shop
+from shops.utils import record_price_history
+from stocks.models import (Inventory, InventoryProduct, StockEntry,
+                           StockEntryProduct)
+from users.models import User
+
+NB_MEMBERS = 60
+NB_PRODUCTS = 20
+NB_SALES = 300
+
+DEFAULT_MAX_SECONDS = 2
+
+# name: role, maximum number of queries and optionally:
+# - seconds: maximum wall time, DEFAULT_MAX_SECONDS if not given,
+# - kwargs: overriding the defaults of get_url_kwargs,
+# - params: GET parameters,
+# - method and data: 'post' and the name of the method returning the query
+#   string parameters and the data to post.
+URL_BUDGETS = {
+    'url_login': {'role': 'anonymous', 'queries': 5},
+    'url_logout': {'role': 'member', 'queries': 4},
+    'password_change': {'role': 'member', 'queries': 4},
+    'password_change_done': {'role': 'member', 'queries': 4},
+    'password_reset': {'role': 'anonymous', 'queries': 2},
+    'password_reset_done': {'role': 'anonymous', 'queries': 2},
+    'password_reset_confirm': {'role': 'anonymous', 'queries': 3},
+    'password_reset_complete': {'role': 'anonymous', 'queries': 2},
+    'url_members_workboard': {'role': 'member', 'queries': 78},
+    'url_managers_workboard': {'role': 'president', 'queries': 60},
+    'url_performance_dashboard': {'role': 'president', 'queries': 14},
+    'url_index_config': {'role': 'president', 'queries': 23},
+    'url_center_config': {'role': 'president', 'queries': 12},
+    'url_price_config': {'role': 'president', 'queries': 12},
+    'url_lydia_config': {'role': 'president', 'queries': 20},
+    'url_balance_config': {'role': 'president', 'queries': 12},
+    'url_event_list': {'role': 'president', 'queries': 50},
+    'url_event_create': {'role': 'president', 'queries': 13},
+    'url_event_update': {'role': 'president', 'queries': 20},
+    'url_event_finish': {'role': 'president', 'queries': 8},
+    'url_event_delete': {'role': 'president', 'queries': 14},
+    'url_event_self_registration': {'role': 'member', 'queries': 7},
+    'url_event_manage_users': {'role': 'president', 'queries': 75},
+    'url_event_remove_user': {
+        'role': 'president', 'queries': 9,
+        'params': {'state': 'participants', 'order_by': 'username'}},
+    'url_event_change_weight': {
+        'role': 'president', 'queries': 9,
+        'params': {'pond': 2, 'is_participant': 1}},
+    'url_event_download_xlsx': {'role': 'president', 'queries': 5},
+    'url_event_upload_xlsx': {
+        'role': 'president', 'queries': 305, 'method': 'post',
+        'data': 'get_event_upload_xlsx_data'},
+    'url_self_transaction_list': {'role': 'member', 'queries': 84},
+    'url_user_exceptionnalmovement_create': {'role': 'president', 'queries': 14},
+    'url_recharging_create': {'role': 'president', 'queries': 14},
+    'url_recharging_list': {'role': 'president', 'queries': 237},
+    'url_recharging_retrieve': {'role': 'president', 'queries': 16},
+    'url_transfert_list': {'role': 'president', 'queries': 134},
+    'url_transfert_create': {'role': 'member', 'queries': 23},
+    'url_transfert_retrieve': {'role': 'president', 'queries': 14},
+    'url_exceptionnalmovement_list': {'role': 'president', 'queries': 132},
+    'url_exceptionnalmovement_retrieve': {'role': 'president', 'queries': 14},
+    'url_self_lydia_callback': {
+        'role': 'anonymous', 'queries': 4, 'method': 'post',
+        'data': 'get_self_lydia_callback_data'},
+    'url_self_lydia_create': {'role': 'member', 'queries': 27},
+    'url_lydia_reconciliation': {'role': 'president', 'queries': 11},
+    'url_treasury_report': {'role': 'president', 'queries': 21},
+    'url_self_lydia_confirm': {'role': 'member', 'queries': 24},
+    'url_shop_module_sale': {'role': 'member', 'queries': 31},
+    'url_shop_module_catalog': {'role': 'member', 'queries': 12},
+    'url_shop_module_sale_api': {'role': 'member', 'queries': 30, 'method': 'post',
+                                 'data': 'get_shop_module_sale_api_data',
+                                 'content_type': 'application/json'},
+    'url_shop_module_round_sale': {'role': 'president', 'queries': 23,
+                                   'kwargs': {'module_class': 'operator_sales'}},
+    'url_shop_module_config': {'role': 'president', 'queries': 44},
+    'url_shop_module_config_update': {'role': 'president', 'queries': 21},
+    'url_shop_module_category_create': {'role': 'president', 'queries': 23},
+    'url_shop_module_category_update': {'role': 'president', 'queries': 26},
+    'url_shop_module_category_delete': {'role': 'president', 'queries': 24},
+    'url_sale_list': {'role': 'president', 'queries': 471},
+    'url_sale_retrieve': {'role': 'president', 'queries': 30},
+    'url_shop_list': {'role': 'president', 'queries': 12},
+    'url_shop_create': {'role': 'president', 'queries': 11},
+    'url_shop_update': {'role': 'president', 'queries': 18},
+    'url_shop_checkup': {'role': 'president', 'queries': 22},
+    'url_shop_delete': {'role': 'president', 'queries': 15},
+    'url_shop_workboard': {'role': 'president', 'queries': 62},
+    'url_product_list': {'role': 'president', 'queries': 20},
+    'url_product_list_download_xlsx': {'role': 'president', 'queries': 10},
+    'url_product_create': {'role': 'president', 'queries': 18},
+    'url_product_retrieve': {'role': 'president', 'queries': 21},
+    'url_product_update': {'role': 'president', 'queries': 20},
+    'url_product_update_price': {'role': 'president', 'queries': 21},
+    'url_product_deactivate': {'role': 'president', 'queries': 20},
+    'url_product_remove': {'role': 'president', 'queries': 20},
+    'url_stockentry_list': {'role': 'president', 'queries': 42},
+    'url_stockentry_create': {'role': 'president', 'queries': 19},
+    'url_stockentry_retrieve': {'role': 'president', 'queries': 43},
+    'url_inventory_list': {'role': 'president', 'queries': 20},
+    'url_inventory_create': {'role': 'president', 'queries': 19},
+    'url_inventory_retrieve': {'role': 'president', 'queries': 42},
+    'url_user_list': {'role': 'president', 'queries': 13},
+    'url_user_lifecycle': {'role': 'president', 'queries': 15},
+    'url_user_create': {'role': 'president', 'queries': 11},
+    'url_user_retrieve': {'role': 'president', 'queries': 57},
+    'url_user_update': {'role': 'president', 'queries': 14},
+    'url_user_deactivate': {'role': 'president', 'queries': 14},
+    'url_add_by_list_xlsx': {'role': 'president', 'queries': 11},
+    'url_add_by_list_xlsx_download': {'role': 'president', 'queries': 5},
+    'url_group_update': {'role': 'president', 'queries': 18},
+    'url_ajax_username_from_username_part': {
+        'role': 'president', 'queries': 1, 'params': {'keywords': 'member'}},
+    'url_balance_from_username': {
+        'role': 'president', 'queries': 5, 'params': {'username': 'member1'}},
+    'url_token_obtain': {
+        'role': 'anonymous', 'queries': 1, 'method': 'post',
+        'data': 'get_token_obtain_data'},
+    'url_token_revoke': {
+        'role': 'member', 'queries': 3, 'method': 'post',
+        'data': 'get_empty_data'},
+}
+
+
+def get_named_url_patterns(patterns=None, prefix=''):
+    """
+    Return a dict {name: route} of every named url pattern, included ones too.
+    """
+    if patterns is None:
+        patterns = get_resolver().url_patterns
+    named_patterns = {}
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            named_patterns.update(get_named_url_patterns(
+                pattern.url_patterns, prefix + str(pattern.pattern)))
+        elif pattern.name is not None:
+            named_patterns[pattern.name] = prefix + str(pattern.pattern)
+    return named_patterns
+
+
+class BaseQueryBudgetTestCase(TestCase):
+    """
+    Build once a dataset with enough rows to make N+1 queries visible.
+    """
+    fixtures = ['initial', 'tests_data']
+
+    @classmethod
+    def setUpTestData(cls):
+        members_group = Group.objects.get(name=INTERNALS_GROUP_NAME)
+        presidents_group = Group.objects.get(name=PRESIDENTS_GROUP_NAME)
+        presidents_group.permissions.set(Permission.objects.all())
+        association = User.objects.get(pk=1)
+
+        cls.president = User.objects.create(
+            username='president', balance=100)
+        cls.president.groups.add(members_group, presidents_group)
+
+        User.objects.bulk_create([
+            User(username='member' + str(i), first_name='Member',
+                 last_name=str(i), surname='Member' + str(i), family=str(i),
+                 campus='ME', year=2015 + i % 5, balance=50)
+            for i in range(NB_MEMBERS)
+        ])
+        cls.members = list(User.objects.filter(username__startswith='member'))
+        members_group.user_set.add(*cls.members)
+        cls.member = cls.members[0]
+
+        cls.shop = Shop.objects.create(
+            name='budget', description='Shop for query budgets',
+            color='#F4FA58')
+        Product.objects.bulk_create([
+            Product(name='product' + str(i), shop=cls.shop,
+                    unit=('CL', 'G', None)[i % 3],
+                    is_manual=(i % 4 == 0), manual_price=2)
+            for i in range(NB_PRODUCTS)
+        ])
+        cls.products = list(cls.shop.product_set.all())
+        cls.product = cls.products[0]
+
+        self_module = SelfSaleModule.objects.create(shop=cls.shop, state=True)
+        OperatorSaleModule.objects.create(shop=cls.shop, state=True)
+        module_type = ContentType.objects.get_for_model(SelfSaleModule)
+        for order in range(2):
+            category = Category.objects.create(
+                name='category' + str(order), content_type=module_type,
+                module_id=self_module.pk, order=order)
+            CategoryProduct.objects.bulk_create([
+                CategoryProduct(category=category, product=product,
+                                quantity=(0 if product.unit is None else 25))
+                for product in cls.products[order::2]
+            ])
+        cls.category = category
+
+        cls.stockentry = StockEntry.objects.create(
+            operator=cls.president, shop=cls.shop)
+        StockEntryProduct.objects.bulk_create([
+            StockEntryProduct(stockentry=cls.stockentry, product=product,
+                              quantity=(1 if product.unit is None else 1000),
+                              price=decimal.Decimal('10.00'))
+            for product in cls.products
+        ])
+        cls.inventory = Inventory.objects.create(
+            operator=cls.president, shop=cls.shop)
+        InventoryProduct.objects.bulk_create([
+            InventoryProduct(inventory=cls.inventory, product=product,
+                             quantity=10)
+            for product in cls.products
+        ])
+        record_price_history(cls.products)
+
+        for i in range(NB_SALES):
+            sale = Sale.objects.create(
+                sender=cls.members[i % NB_MEMBERS], recipient=association,
+                operator=cls.members[i % NB_MEMBERS], module=self_module,
+                shop=cls.shop)
+            SaleProduct.objects.bulk_create([
+                SaleProduct(sale=sale, product=product, quantity=1,
+                            price=decimal.Decimal('1.50'))
+                for product in cls.products[i % 5:i % 5 + 3]
+            ])
+        cls.sale = sale
+
+        for i, member in enumerate(cls.members):
+            if i % 3 == 0:
+                solution = Cash.objects.create(sender=member, amount=10)
+            elif i % 3 == 1:
+                solution = Cheque.objects.create(
+                    sender=member, amount=20, cheque_number='1234567')
+            else:
+                solution = Lydia.objects.create(
+                    sender=member, amount=15, id_from_lydia=str(i))
+            cls.recharging = Recharging.objects.create(
+                sender=member, operator=cls.president,
+                content_solution=solution)
+            cls.transfert = Transfert.objects.create(
+                sender=member, recipient=cls.members[i - 1],
+                justification='Budget', amount=1)
+            cls.exceptionnalmovement = ExceptionnalMovement.objects.create(
+                operator=cls.president, recipient=member,
+                justification='Budget', amount=1, is_credit=bool(i % 2))
+
+        for i in range(3):
+            cls.event = Event.objects.create(
+                description='event' + str(i), manager=cls.president,
+                date=timezone.now().date())
+            WeightsUser.objects.bulk_create([
+                WeightsUser(user=member, event=cls.event,
+                            weights_registeration=1,
+                            weights_participation=i % 2)
+                for member in cls.members
+            ])
+
+    def get_url_kwargs(self, name, route):
+        """
+        Default kwargs for the converters found in the route.
+        """
+        values = {
+            'pk': self.event.pk,
+            'user_pk': self.member.pk,
+            'group_pk': Group.objects.get(name=INTERNALS_GROUP_NAME).pk,
+            'shop_pk': self.shop.pk,
+            'product_pk': self.product.pk,
+            'module_class': 'self_sales',
+            'category_pk': self.category.pk,
+            'sale_pk': self.sale.pk,
+            'stockentry_pk': self.stockentry.pk,
+            'inventory_pk': self.inventory.pk,
+            'recharging_pk': self.recharging.pk,
+            'transfert_pk': self.transfert.pk,
+            'exceptionnalmovement_pk': self.exceptionnalmovement.pk,
+            'uidb64': 'MQ',
+            'token': '1111-aaaaa',
+        }
+        return {key: value for key, value in values.items()
+                if '<' + key + '>' in route or ':' + key + '>' in route}
+
+    def get_event_upload_xlsx_data(self):
+        workbook = Workbook()
+        sheet = workbook.active
+        sheet.append(['Username', 'Pondération'])
+        for member in self.members:
+            sheet.append([member.username, 1])
+        content = io.BytesIO()
+        workbook.save(content)
+        return {}, {
+            'state': 'registrants',
+            'list_user': SimpleUploadedFile('list_user.xlsx', content.getvalue())
+        }
+
+    def get_shop_module_sale_api_data(self):
+        category_product = self.category.categoryproduct_set.first()
+        return {}, json.dumps({
+            'products': {str(category_product.pk) + '-' + str(self.category.pk): 1}})
+
+    def get_token_obtain_data(self):
+        self.member.set_password('budget')
+        self.member.save()
+        return {}, {'username': self.member.username, 'password': 'budget'}
+
+    def get_empty_data(self):
+        return {}, {}
+
+    def get_self_lydia_callback_data(self):
+        data = {
+            'currency': 'EUR',
+            'request_id': '53',
+            'amount': '10.00',
+            'signed': '0',
+            'transaction_identifier': 'budget',
+            'vendor_token': 'vendor',
+        }
+        data['sig'] = sign_lydia_params(
+            data, configuration_get('API_TOKEN_LYDIA').get_value())
+        return {'user_pk': self.member.pk}, data
+
+    def get_client(self, role):
+        client = Client()
+        if role == 'president':
+            client.force_login(self.president)
+        elif role == 'member':
+            client.force_login(self.member)
+        return client
+
+
+class NamedURLQueryBudgetTests(BaseQueryBudgetTestCase):
+    """
+    Every named url must have a budget, and stay within it.
+    """
+
+    def test_every_named_url_has_a_budget(self):
+        named_patterns = get_named_url_patterns()
+        self.assertEqual(set(named_patterns), set(URL_BUDGETS))
+
+    def test_query_budgets(self):
+        named_patterns = get_named_url_patterns()
+        for name, budget in URL_BUDGETS.items():
+            with self.subTest(name=name):
+                kwargs = self.get_url_kwargs(name, named_patterns[name])
+                kwargs.update(budget.get('kwargs', {}))
+                url = reverse(name, kwargs=kwargs)
+                params = budget.get('params', {})
+                client = self.get_client(budget['role'])
+                # Counts must not depend on the tests run before.
+                ContentType.objects.clear_cache()
+                cache.clear()
+
+                if budget.get('method', 'get') == 'post':
+                    params, data = getattr(self, budget['data'])()
+                    if params:
+                        url += '?' + urlencode(params)
+                    request = (partial(client.post, content_type=budget['content_type'])
+                               if 'content_type' in budget else client.post, url, data)
+                else:
+                    request = (client.get, url, params)
+
+                # Changes of a POST are rolled back, not to be counted by
+                # the next urls.
+                with transaction.atomic():
+                    with CaptureQueriesContext(connection) as context:
+                        start = time.perf_counter()
+                        response = request[0](*request[1:])
+                        duration = time.perf_counter() - start
+                    transaction.set_rollback(True)
+
+                self.assertLess(response.status_code, 500)
+                executed = len(context.captured_queries)
+                self.assertLessEqual(
+                    executed, budget['queries'],
+                    "%s executed %d queries, budget is %d:\n%s" % (
+                        name, executed, budget['queries'],
+                        '\n'.join(query['sql']
+                                  for query in context.captured_queries)))
+                max_seconds = budget.get('seconds', DEFAULT_MAX_SECONDS)
+                self.assertLessEqual(
+                    duration, max_seconds,
+                    "%s took %.3fs, budget is %ss" % (name, duration, max_seconds))
@@ -0,0 +1,77 @@
+from django.contrib.auth.models import Group, Permission
+from django.core.cache import cache
+from django.db import connections
+from django.test import Client, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from borgia.routers import REPLICA_STICKY_COOKIE, ReplicaRouter, replica_reads
+from borgia.utils import INTERNALS_GROUP_NAME, PRESIDENTS_GROUP_NAME
+from shops.models import Shop
+from users.models import User
+
+
+@override_settings(REPLICA_DATABASE='replica')
+class ReplicaRouterTestCase(TransactionTestCase):
+    """
+    The replica is a mirror of the default test database. Data must be
+    committed to be seen by its connection, hence TransactionTestCase.
+    """
+    databases = {'default', 'replica'}
+    fixtures = ['initial']
+
+    def setUp(self):
+        cache.clear()
+        presidents_group = Group.objects.get(name=PRESIDENTS_GROUP_NAME)
+        presidents_group.permissions.set(Permission.objects.all())
+        self.user1 = User.objects.create(username='user1')
+        self.user1.groups.add(Group.objects.get(name=INTERNALS_GROUP_NAME), presidents_group)
+        self.client1 = Client()
+        self.client1.force_login(self.user1)
+
+    def get_replica_queries(self, method, url, data=None):
+        with CaptureQueriesContext(connections['replica']) as context:
+            response = getattr(self.client1, method)(url, data)
+        return response, len(context.captured_queries)
+
+    def test_router(self):
+        self.assertEqual(User.objects.all().db, 'default')
+        with replica_reads():
+            self.assertEqual(User.objects.all().db, 'replica')
+            self.assertEqual(ReplicaRouter().db_for_write(User), 'default')
+            user = User.objects.get(pk=self.user1.pk)
+            user.first_name = 'Name'
+            user.save()
+        self.assertEqual(User.objects.get(pk=self.user1.pk).first_name, 'Name')
+
+    def test_reporting_view(self):
+        response, replica_queries = self.get_replica_queries('get', reverse('url_managers_workboard'))
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(replica_queries, 0)
+
+        # Views not opted in read from the primary.
+        response, replica_queries = self.get_replica_queries('get', reverse('url_user_list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(replica_queries, 0)
+
+    def test_search_post(self):
+        response, replica_queries = self.get_replica_queries(
+            'post', reverse('url_recharging_list'), {'search': 'user1'})
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(replica_queries, 0)
+        self.assertNotIn(REPLICA_STICKY_COOKIE, response.cookies)
+
+    def test_sticky_after_write(self):
+        response = self.client1.post(reverse('url_shop_create'),
+                                     {'name': 'shop', 'description': 'Shop', 'color': '#FFFFFF'})
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(Shop.objects.filter(name='shop').exists())
+        self.assertIn(REPLICA_STICKY_COOKIE, response.cookies)
+
+        response, replica_queries = self.get_replica_queries('get', reverse('url_managers_workboard'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(replica_queries, 0)
+
+        del self.client1.cookies[REPLICA_STICKY_COOKIE]
+        response, replica_queries = self.get_replica_queries('get', reverse('url_managers_workboard'))
+        self.assertGreater(replica_queries, 0)
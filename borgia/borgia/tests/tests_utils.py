@@ -0,0 +1,34 @@
+from django.db import transaction
+from django.test import TransactionTestCase
+
+from borgia.utils import bump_data_version_on_commit, get_data_version
+
+TEST_VERSION = 'tests'
+
+
+class BumpDataVersionOnCommitTestCase(TransactionTestCase):
+
+    def test_once_per_transaction(self):
+        version = get_data_version(TEST_VERSION)
+        with transaction.atomic():
+            bump_data_version_on_commit(TEST_VERSION)
+            bump_data_version_on_commit(TEST_VERSION)
+            self.assertEqual(get_data_version(TEST_VERSION), version)
+        self.assertEqual(get_data_version(TEST_VERSION), version + 1)
+
+        bump_data_version_on_commit(TEST_VERSION)
+        self.assertEqual(get_data_version(TEST_VERSION), version + 2)
+
+    def test_rolled_back(self):
+        version = get_data_version(TEST_VERSION)
+        try:
+            with transaction.atomic():
+                bump_data_version_on_commit(TEST_VERSION)
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertEqual(get_data_version(TEST_VERSION), version)
+
+        with transaction.atomic():
+            bump_data_version_on_commit(TEST_VERSION)
+        self.assertEqual(get_data_version(TEST_VERSION), version + 1)
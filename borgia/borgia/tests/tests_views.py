@@ -1,11 +1,16 @@
 from django.contrib.auth import get_user
 from django.contrib.auth.models import Group, Permission
+from django.core.cache import cache
+from django.db import connection
 from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import NoReverseMatch, reverse
 
 from borgia.settings import LOGIN_REDIRECT_URL, LOGIN_URL
 from borgia.tests.utils import get_login_url_redirected
 from borgia.utils import EXTERNALS_GROUP_NAME, INTERNALS_GROUP_NAME, PRESIDENTS_GROUP_NAME
+from modules.models import SelfSaleModule
+from shops.models import Shop
 from users.models import User
 
 
@@ -13,6 +18,8 @@ class BaseBorgiaViewsTestCase(TestCase):
     fixtures = ['initial', 'tests_data']
 
     def setUp(self):
+        # Cached data may refer to objects of rolled back tests.
+        cache.clear()
         members_group = Group.objects.get(name=INTERNALS_GROUP_NAME)
         externals_group = Group.objects.get(name=EXTERNALS_GROUP_NAME)
         presidents_group = Group.objects.get(name=PRESIDENTS_GROUP_NAME)
@@ -83,6 +90,12 @@ class LoginViewTests(BaseAuthViewsTestCase):
     url_view = 'url_login'
     template_name = 'registration/login.html'
 
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.shop = Shop.objects.create(name='kiosk', color='#F4FA58')
+        self.module = SelfSaleModule.objects.create(shop=self.shop, state=True)
+
     def test_get(self):
         response = Client().get(reverse(self.url_view))
         self.assertEqual(response.status_code, 200)
@@ -93,6 +106,32 @@ class LoginViewTests(BaseAuthViewsTestCase):
         self.assertEqual(response.status_code, 200)
         self.assertTemplateUsed(response, self.template_name)
 
+    def test_directory_cached(self):
+        Client().get(reverse(self.url_view))
+        with CaptureQueriesContext(connection) as context:
+            response = Client().get(reverse(self.url_view))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([query for query in context.captured_queries
+                          if 'shops_shop' in query['sql'] or 'modules_' in query['sql']])
+
+    def test_directory_invalidated(self):
+        entry = Client().get(reverse(self.url_view)).context['shop_list'][-1]
+        self.assertEqual(entry['shop']['name'], 'kiosk')
+        self.assertTrue(entry['self_module']['state'])
+        self.assertIsNone(entry['operator_module'])
+
+        self.module.state = False
+        self.module.save()
+        Shop.objects.create(name='newshop', color='#F4FA58')
+        shop_list = Client().get(reverse(self.url_view)).context['shop_list']
+        self.assertFalse(shop_list[-2]['self_module']['state'])
+        self.assertEqual(shop_list[-1]['shop']['name'], 'newshop')
+
+    def test_humanized_next(self):
+        next_url = reverse('url_shop_module_sale', kwargs={'shop_pk': self.shop.pk, 'module_class': 'self_sales'})
+        response = Client().get(reverse(self.url_view) + '?next=' + next_url)
+        self.assertEqual(response.context['humanized_next'], 'Vente directe - Kiosk')
+
     def test_login(self):
         client = Client()
         response = client.post(
@@ -262,3 +301,22 @@ class ManagersWorkboardTests(BaseWorkboardsTestCase):
 
     def test_offline_user_redirection(self):
         super().offline_user_redirection()
+
+
+class PerformanceDashboardViewTests(BaseBorgiaViewsTestCase):
+    url_view = 'url_performance_dashboard'
+    template_name = 'workboards/performance_dashboard.html'
+
+    def test_get(self):
+        response = self.client1.get(reverse(self.url_view))
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, self.template_name)
+
+    def test_not_manager(self):
+        response = self.client2.get(reverse(self.url_view))
+        self.assertEqual(response.status_code, 403)
+
+    def test_offline_user_redirection(self):
+        response = Client().get(reverse(self.url_view))
+        self.assertEqual(response.status_code, 302)
+        self.assertRedirects(response, get_login_url_redirected(reverse(self.url_view)))
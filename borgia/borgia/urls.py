@@ -8,7 +8,8 @@ from django.contrib.auth.views import (LogoutView, PasswordChangeDoneView,
                                        PasswordResetView)
 from django.urls import include, path
 
-from borgia.views import ManagersWorkboard, MembersWorkboard, ModulesLoginView
+from borgia.views import (ManagersWorkboard, MembersWorkboard,
+                          ModulesLoginView, PerformanceDashboard)
 from configurations.urls import configurations_patterns
 from events.urls import events_patterns
 from finances.urls import finances_patterns
@@ -44,6 +45,8 @@ urlpatterns = [
     path('members/', MembersWorkboard.as_view(), name='url_members_workboard'),
     path('managers/', ManagersWorkboard.as_view(),
          name='url_managers_workboard'),
+    path('managers/performances/', PerformanceDashboard.as_view(),
+         name='url_performance_dashboard'),
 
     ### APPS ###
     path('', include(configurations_patterns)),
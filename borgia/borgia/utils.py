@@ -1,8 +1,12 @@
+import hashlib
+import threading
+
 from django.contrib.auth.models import Group, Permission
-from django.contrib.contenttypes.models import ContentType
-from django.core.exceptions import ObjectDoesNotExist
+from django.core.cache import cache
+from django.db import transaction
 from django.urls import reverse
 
+from borgia.performance import is_performance_enabled
 from modules.models import SelfSaleModule
 from shops.models import Shop
 
@@ -13,6 +17,19 @@ PRESIDENTS_GROUP_NAME = 'presidents'
 VICE_PRESIDENTS_GROUP_NAME = 'vice_presidents'
 TREASURERS_GROUP_NAME = 'treasurers'
 ACCEPTED_MENU_TYPES = ['members', 'managers', 'shops']
+PERMISSIONS_VERSION = 'permissions'
+# Data versions of the cached page fragments, see borgia.mixins.FragmentCacheMixin
+CONFIGURATIONS_VERSION = 'configurations'
+EVENTS_VERSION = 'events'
+MODULES_VERSION = 'modules'
+PRODUCTS_VERSION = 'products'
+SHOPS_VERSION = 'shops'
+STOCKS_VERSION = 'stocks'
+FRAGMENT_CACHE_TIMEOUT = 300
+UNUSED_PERMISSIONS_CACHE_KEY = 'borgia:unused_permissions'
+# The permissions are created after the migrations, the timeout bounds the
+# staleness after a deployment.
+UNUSED_PERMISSIONS_CACHE_TIMEOUT = 3600
 
 
 def simple_lateral_link(label, fa_icon, id_link, url):
@@ -151,6 +168,24 @@ def managers_lateral_menu(nav_tree, user):
             url=reverse('url_recharging_list')
         ))
 
+    # Lydia reconciliation
+    if user.has_perm('finances.view_recharging'):
+        nav_tree.append(simple_lateral_link(
+            label='Rapprochement Lydia',
+            fa_icon='check-square-o',
+            id_link='lm_lydia_reconciliation',
+            url=reverse('url_lydia_reconciliation')
+        ))
+
+    # Treasury
+    if user.has_perm('finances.view_treasuryperiod'):
+        nav_tree.append(simple_lateral_link(
+            label='Trésorerie',
+            fa_icon='bank',
+            id_link='lm_treasury_report',
+            url=reverse('url_treasury_report')
+        ))
+
     # Transferts
     if user.has_perm('finances.view_transfert'):
         nav_tree.append(simple_lateral_link(
@@ -200,6 +235,15 @@ def managers_lateral_menu(nav_tree, user):
             url=reverse('url_index_config')
         ))
 
+    # Performances, recorded by the opt-in PerformanceMiddleware
+    if is_performance_enabled() and is_association_manager(user):
+        nav_tree.append(simple_lateral_link(
+            label='Performances',
+            fa_icon='tachometer',
+            id_link='lm_performance_dashboard',
+            url=reverse('url_performance_dashboard')
+        ))
+
     return nav_tree
 
 
@@ -322,27 +366,24 @@ def human_permission_name(name):
 
 
 def human_unused_permissions():
-    unused_models = [
-        'group',
-        'permission',
-        'contenttype',
-        'session',
-        'dependency'
-    ]
-
-    perms = []
-    for string_model in unused_models:
-        try:
-            contenttype = ContentType.objects.filter(
-                model=string_model).first()
-        except ObjectDoesNotExist:
-            pass
-        if contenttype is not None:
-            perm_query = Permission.objects.filter(
-                content_type=contenttype.pk)
-            for perm in perm_query:
-                perms.append(perm.pk)
+    """
+    Return the pks of the permissions of internal models, not to be granted
+    to groups, in a single query.
 
+    They only change with migrations, the list is cached for an hour.
+    """
+    perms = cache.get(UNUSED_PERMISSIONS_CACHE_KEY)
+    if perms is None:
+        unused_models = [
+            'group',
+            'permission',
+            'contenttype',
+            'session',
+            'dependency'
+        ]
+        perms = list(Permission.objects.filter(
+            content_type__model__in=unused_models).values_list('pk', flat=True))
+        cache.set(UNUSED_PERMISSIONS_CACHE_KEY, perms, UNUSED_PERMISSIONS_CACHE_TIMEOUT)
     return perms
 
 
@@ -378,6 +419,32 @@ def get_members_group(is_externals=False):
     return Group.objects.get(name=group_name)
 
 
+def update_group(group, member_pks, permission_pks):
+    """
+    Set the members and permissions of the group, by difference with the
+    current ones: only the missing links are inserted and the extra ones
+    deleted, with bulk queries in a single transaction.
+
+    The permissions version is bumped, for the caches depending on the
+    permissions of the users.
+
+    :param member_pks: pks of the users to be members of the group.
+    :param permission_pks: pks of the permissions of the group.
+    """
+    with transaction.atomic():
+        for through, field, new_pks in ((group.user_set.through, 'user_id', member_pks),
+                                        (group.permissions.through, 'permission_id', permission_pks)):
+            links = through.objects.filter(group=group)
+            old_pks = set(links.values_list(field, flat=True))
+            new_pks = set(new_pks)
+            if old_pks - new_pks:
+                links.filter(**{field + '__in': old_pks - new_pks}).delete()
+            if new_pks - old_pks:
+                through.objects.bulk_create(
+                    through(group_id=group.pk, **{field: pk}) for pk in new_pks - old_pks)
+    bump_data_version(PERMISSIONS_VERSION)
+
+
 def get_managers_group_from_user(user):
     if user.groups.count() == 1:
         return None
@@ -402,3 +469,82 @@ def is_association_manager(user):
         return True
     else:
         return False
+
+
+#####################
+### CACHE RELATED ###
+#####################
+
+
+def get_data_version(name):
+    """
+    Return the version of the data named, to be part of the cache keys
+    depending on it.
+    """
+    key = 'version:' + name
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, 1, None)
+        version = cache.get(key, 1)
+    return version
+
+
+def bump_data_version(name):
+    """
+    Increment the version of the data named, the cache keys depending on it
+    are no longer used.
+    """
+    key = 'version:' + name
+    cache.add(key, 1, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Evicted in between
+        cache.add(key, 2, None)
+
+
+class PendingBump:
+    """
+    Bump of a data version waiting for the commit, see
+    bump_data_version_on_commit.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.done = False
+
+    def __call__(self):
+        if not self.done:
+            self.done = True
+            bump_data_version(self.name)
+
+
+_pending_bumps = threading.local()
+
+
+def bump_data_version_on_commit(name):
+    """
+    Bump the version of the data named once the current transaction is
+    committed (at once outside of a transaction), a single time whatever the
+    number of calls in the transaction, e.g. once per line saved.
+
+    The bump of a rolled back transaction is never done, it's reused by the
+    next one.
+    """
+    pending = _pending_bumps.__dict__.setdefault('bumps', {})
+    bump = pending.get(name)
+    if bump is None or bump.done:
+        bump = pending[name] = PendingBump(name)
+    transaction.on_commit(bump)
+
+
+def get_permissions_fingerprint(user):
+    """
+    Return a digest of the permissions of the user, for the cache keys of the
+    pages depending on them.
+
+    The permissions are those cached on the user by the auth backends, shared
+    with the permission checks of the request.
+    """
+    permissions = ','.join(sorted(user.get_all_permissions()))
+    return hashlib.md5(permissions.encode()).hexdigest()
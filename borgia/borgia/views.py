@@ -1,10 +1,8 @@
 import datetime
 import functools
 import json
-from urllib.parse import urlparse, urlunparse
 
 from django.conf import settings
-from django.contrib.auth import REDIRECT_FIELD_NAME
 from django.contrib.auth.mixins import (LoginRequiredMixin,
                                         PermissionRequiredMixin)
 from django.contrib.auth.models import Group
@@ -13,19 +11,21 @@ from django.contrib.messages.views import SuccessMessageMixin
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.serializers import serialize
 from django.db.models import Q
-from django.http import HttpResponse, QueryDict
-from django.shortcuts import render, resolve_url
-from django.urls import reverse
+from django.http import HttpResponse
+from django.shortcuts import render
 from django.views.generic.base import View
 from django.views.generic.edit import FormView
 
-from borgia.mixins import LateralMenuMixin
+from borgia.mixins import LateralMenuMixin, ReplicaReadMixin
+from borgia.performance import (get_performance_store, get_slow_request_ms,
+                                is_performance_enabled)
 from borgia.utils import (INTERNALS_GROUP_NAME, get_managers_group_from_user,
                           is_association_manager)
 from events.models import Event
 from finances.models import ExceptionnalMovement, Recharging, Transfert
 from modules.models import SelfSaleModule
-from sales.models import Sale
+from modules.utils import get_module_directory
+from sales.models import Sale, UserMonthlySpend
 from shops.utils import get_shops_managed
 from shops.models import Shop
 from users.forms import UserQuickSearchForm
@@ -48,60 +48,18 @@ class ModulesLoginView(LoginView):
     """ Override of auth login view, to include direct login to sales modules """
     redirect_authenticated_user = True
 
-    def add_next_to_login(self, path_next, redirect_field_name=REDIRECT_FIELD_NAME, login_url=None):
-        """
-        Add the given 'path_next' path to the 'login_url' path.
-        """
-        resolved_url = resolve_url(login_url or settings.LOGIN_URL)
-
-        login_url_parts = list(urlparse(resolved_url))
-        if redirect_field_name:
-            querystring = QueryDict(login_url_parts[4], mutable=True)
-            querystring[redirect_field_name] = path_next
-            login_url_parts[4] = querystring.urlencode(safe='/')
-
-        return urlunparse(login_url_parts)
-
     def readable_shop_url(self, next, shop_list):
-        readable_url = ""
-        operator_urls = [l['operator_module_rev_link'] for l in shop_list]
-        self_urls = [l['self_module_rev_link'] for l in shop_list]
-        shop_urls = operator_urls + self_urls
-        if next in shop_urls:
-           url_parts = [i for i in next.split("/") if i]
-           if "self_sales" in url_parts:
-               readable_url = "Vente directe - "
-           elif "operator_sales" in url_parts:
-               readable_url = "Vente par opérateur - "
-           if "shops" in url_parts:
-               shop = Shop.objects.get(pk=int(url_parts[1]))
-               if shop:
-                  readable_url += shop.name.capitalize()
-        if readable_url == "":
-           readable_url = next
-        return readable_url
+        for entry in shop_list:
+            for module_class in ('self', 'operator'):
+                if next == entry[module_class + '_module_rev_link']:
+                    return entry[module_class + '_module_label']
+        return next
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['default_theme'] = settings.DEFAULT_TEMPLATE
 
-        context['shop_list'] = []
-        for shop in Shop.objects.all():
-            operator_module = shop.modules_operatorsalemodule_shop.first()
-            operator_module_rev_link = reverse('url_shop_module_sale', kwargs={'shop_pk': shop.pk, 'module_class': 'operator_sales'})
-            operator_module_link = self.add_next_to_login(operator_module_rev_link)
-            self_module = shop.modules_selfsalemodule_shop.first()
-            self_module_rev_link = reverse('url_shop_module_sale', kwargs={'shop_pk': shop.pk, 'module_class': 'self_sales'})
-            self_module_link = self.add_next_to_login(self_module_rev_link)
-            context['shop_list'].append({
-                'shop': shop,
-                'operator_module': operator_module,
-                'operator_module_link': operator_module_link,
-                'operator_module_rev_link': operator_module_rev_link,
-                'self_module': self_module,
-                'self_module_link': self_module_link,
-                'self_module_rev_link': self_module_rev_link
-            })
+        context['shop_list'] = get_module_directory()
         if context['next']:
            context['humanized_next'] = self.readable_shop_url(context['next'], context['shop_list'])
         return context
@@ -122,20 +80,18 @@ class MembersWorkboard(LoginRequiredMixin, BorgiaView):
             datetime.datetime.now() - datetime.timedelta(days=365),
             datetime.datetime.now()), 'all': self.request.user.list_transaction()[:5]}
 
-        # Shops sales
+        # Shops sales, totals from the monthly spendings
         sale_list = Sale.objects.filter(
             sender=self.request.user).order_by('-datetime')
+        monthly_spends = UserMonthlySpend.objects.filter(user=self.request.user)
         transactions['shops'] = []
         for shop in Shop.objects.all():
-            list_filtered = sale_list.filter(shop=shop)
-            total = 0
-            for sale in list_filtered:
-                total += sale.amount()
+            spends = [spend for spend in monthly_spends if spend.shop_id == shop.pk]
             transactions['shops'].append({
                 'shop': shop,
-                'total': total,
-                'sale_list_short': list_filtered[:5],
-                'data_months': self.data_months(list_filtered, transactions['months'])
+                'total': sum(spend.amount for spend in spends),
+                'sale_list_short': sale_list.filter(shop=shop)[:5],
+                'data_months': self.data_months(spends, transactions['months'])
             })
 
         # Transferts
@@ -173,13 +129,13 @@ class MembersWorkboard(LoginRequiredMixin, BorgiaView):
         return transactions
 
     @staticmethod
-    def data_months(mlist, months):
+    def data_months(spends, months):
         amounts = [0 for _ in range(0, len(months))]
-        for obj in mlist:
-            if obj.datetime.strftime("%b-%y") in months:
+        for spend in spends:
+            if spend.month.strftime("%b-%y") in months:
                 amounts[
-                    months.index(obj.datetime.strftime("%b-%y"))] +=\
-                    abs(obj.amount())
+                    months.index(spend.month.strftime("%b-%y"))] +=\
+                    abs(spend.amount)
         return amounts
 
     @staticmethod
@@ -194,7 +150,7 @@ class MembersWorkboard(LoginRequiredMixin, BorgiaView):
         return mlist
 
 
-class ManagersWorkboard(LoginRequiredMixin, PermissionRequiredMixin, BorgiaView):
+class ManagersWorkboard(ReplicaReadMixin, LoginRequiredMixin, PermissionRequiredMixin, BorgiaView):
     menu_type = 'managers'
     template_name = 'workboards/managers_workboard.html'
     lm_active = 'lm_workboard'
@@ -223,3 +179,25 @@ class ManagersWorkboard(LoginRequiredMixin, PermissionRequiredMixin, BorgiaView)
         # Form Quick user search
         context['quick_user_search_form'] = UserQuickSearchForm()
         return render(request, self.template_name, context=context)
+
+
+class PerformanceDashboard(LoginRequiredMixin, PermissionRequiredMixin, BorgiaView):
+    """
+    Show the requests recorded by PerformanceMiddleware: percentiles per url
+    name and the last slow requests with their most repeated queries.
+    """
+    menu_type = 'managers'
+    template_name = 'workboards/performance_dashboard.html'
+    lm_active = 'lm_performance_dashboard'
+
+    def has_permission(self):
+        return is_association_manager(self.request.user)
+
+    def get(self, request, **kwargs):
+        store = get_performance_store()
+        context = self.get_context_data(**kwargs)
+        context['url_statistics'] = store.url_statistics()
+        context['slow_requests'] = store.slow_requests()
+        context['slow_request_ms'] = get_slow_request_ms()
+        context['is_enabled'] = is_performance_enabled()
+        return render(request, self.template_name, context=context)
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class ConfigurationsConfig(AppConfig):
     name = 'configurations'
+
+    def ready(self):
+        # Import configuration signals
+        from configurations.signals import bump_configurations_version
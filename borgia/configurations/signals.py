@@ -0,0 +1,11 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from borgia.utils import CONFIGURATIONS_VERSION, bump_data_version
+from configurations.models import Configuration
+
+
+@receiver(post_save, sender=Configuration)
+@receiver(post_delete, sender=Configuration)
+def bump_configurations_version(**kwargs):
+    bump_data_version(CONFIGURATIONS_VERSION)
@@ -3,6 +3,7 @@ from django.urls import reverse
 
 from borgia.tests.tests_views import BaseBorgiaViewsTestCase
 from borgia.tests.utils import get_login_url_redirected
+from configurations.utils import configuration_get
 
 
 class BaseConfigurationsViewsTest(BaseBorgiaViewsTestCase):
@@ -38,6 +39,13 @@ class GlobalConfigTest(BaseConfigurationsViewsTest):
     def test_offline_user_redirection(self):
         super().offline_user_redirection()
 
+    def test_fragment_invalidated(self):
+        self.client1.get(self.get_url())
+        center_name = configuration_get('CENTER_NAME')
+        center_name.value = 'Renamed center'
+        center_name.save()
+        self.assertContains(self.client1.get(self.get_url()), 'Renamed center')
+
 
 class CenterConfigTest(BaseConfigurationsViewsTest):
     url_view = 'url_center_config'
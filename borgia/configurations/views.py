@@ -1,18 +1,25 @@
+from functools import partial
+
 from django.contrib.auth.mixins import (LoginRequiredMixin,
                                         PermissionRequiredMixin)
 from django.urls import reverse
+from django.utils.functional import SimpleLazyObject
 from django.views.generic.base import TemplateView
 
-from borgia.mixins import LateralMenuMixin
+from borgia.mixins import FragmentCacheMixin, LateralMenuMixin
+from borgia.utils import CONFIGURATIONS_VERSION
 from borgia.views import BorgiaFormView
 from configurations.forms import (ConfigurationBalanceForm,
                                   ConfigurationCenterForm,
                                   ConfigurationLydiaForm,
                                   ConfigurationProfitForm)
 from configurations.utils import configuration_get
+from shops.models import Product
+from shops.utils import record_price_history
 
 
-class ConfigurationIndexView(LoginRequiredMixin, PermissionRequiredMixin, LateralMenuMixin, TemplateView):
+class ConfigurationIndexView(FragmentCacheMixin, LoginRequiredMixin, PermissionRequiredMixin, LateralMenuMixin,
+                             TemplateView):
     """
     View to manage config of the application.
 
@@ -25,22 +32,24 @@ class ConfigurationIndexView(LoginRequiredMixin, PermissionRequiredMixin, Latera
     menu_type = 'managers'
     template_name = 'configurations/global_config.html'
     lm_active = 'lm_index_config'
+    fragment_data = (CONFIGURATIONS_VERSION,)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['center_name'] = configuration_get('CENTER_NAME')
-        context['margin_profit'] = configuration_get('MARGIN_PROFIT')
-        context['enable_self_lydia'] = configuration_get('ENABLE_SELF_LYDIA')
-        context['min_price_lydia'] = configuration_get('MIN_PRICE_LYDIA')
-        context['max_price_lydia'] = configuration_get('MAX_PRICE_LYDIA')
-        context['api_token_lydia'] = configuration_get('API_TOKEN_LYDIA')
-        context['vendor_token_lydia'] = configuration_get('VENDOR_TOKEN_LYDIA')
-        context['enable_fee_lydia'] = configuration_get('ENABLE_FEE_LYDIA')
-        context['base_fee_lydia'] = configuration_get('BASE_FEE_LYDIA')
-        context['ratio_fee_lydia'] = configuration_get('RATIO_FEE_LYDIA')
-        context['tax_fee_lydia'] = configuration_get('TAX_FEE_LYDIA')
-        context['balance_threshold_purchase'] = configuration_get(
-            "BALANCE_THRESHOLD_PURCHASE")
+        # Read when rendered, not if the fragment is cached.
+        for key, name in (('center_name', 'CENTER_NAME'),
+                          ('margin_profit', 'MARGIN_PROFIT'),
+                          ('enable_self_lydia', 'ENABLE_SELF_LYDIA'),
+                          ('min_price_lydia', 'MIN_PRICE_LYDIA'),
+                          ('max_price_lydia', 'MAX_PRICE_LYDIA'),
+                          ('api_token_lydia', 'API_TOKEN_LYDIA'),
+                          ('vendor_token_lydia', 'VENDOR_TOKEN_LYDIA'),
+                          ('enable_fee_lydia', 'ENABLE_FEE_LYDIA'),
+                          ('base_fee_lydia', 'BASE_FEE_LYDIA'),
+                          ('ratio_fee_lydia', 'RATIO_FEE_LYDIA'),
+                          ('tax_fee_lydia', 'TAX_FEE_LYDIA'),
+                          ('balance_threshold_purchase', 'BALANCE_THRESHOLD_PURCHASE')):
+            context[key] = SimpleLazyObject(partial(configuration_get, name))
         #context['balance_threshold_mail_alert'] = configuration_get("BALANCE_THRESHOLD_MAIL_ALERT")
         #context['balance_frequency_mail_alert'] = configuration_get("BALANCE_FREQUENCY_MAIL_ALERT")
         return context
@@ -103,6 +112,8 @@ class ConfigurationProfitView(ConfigurationChangeBaseView):
         margin_profit = configuration_get('MARGIN_PROFIT')
         margin_profit.value = form.cleaned_data['margin_profit']
         margin_profit.save()
+        # Automatic prices depend on the margin profit.
+        record_price_history(Product.objects.filter(is_removed=False))
         return super().form_valid(form)
 
 
@@ -229,9 +229,10 @@ class Event(models.Model):
             return
 
         for e in self.weightsuser_set.all():
-            user_price = final_price_per_weight * e.weights_participation
-            e.user.debit(user_price)
-            recipient.credit(user_price)
+            if e.weights_participation != 0:
+                user_price = final_price_per_weight * e.weights_participation
+                e.user.debit(user_price)
+                recipient.credit(user_price)
 
         self.price = total_price
         self.datetime = now()
@@ -0,0 +1,13 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from borgia.utils import EVENTS_VERSION, bump_data_version
+from events.models import Event, WeightsUser
+
+
+@receiver(post_save, sender=Event)
+@receiver(post_delete, sender=Event)
+@receiver(post_save, sender=WeightsUser)
+@receiver(post_delete, sender=WeightsUser)
+def bump_events_version(**kwargs):
+    bump_data_version(EVENTS_VERSION)
@@ -188,6 +188,24 @@ class EventModelTestCase(TestCase):
         self.assertEqual(self.user1.balance, user1_initial_balance - 20)
         self.assertEqual(self.user2.balance, user2_initial_balance - 80)
 
+    def test_pay_by_total_with_registrant_only(self):
+        event_total_price = Event.objects.create(
+            description='Test_payment',
+            date=datetime.date(2053, 1, 1),
+            manager=self.manager,
+            price=decimal.Decimal(1000.00)
+        )
+        user3_initial_balance = self.user3.balance
+
+        event_total_price.change_weight(self.user1, 10, is_participant=True)
+        event_total_price.change_weight(self.user3, 2, is_participant=False)
+        event_total_price.pay_by_total(self.manager, self.banker, decimal.Decimal(100.00))
+
+        self.user1 = User.objects.get(pk=self.user1.pk)
+        self.user3 = User.objects.get(pk=self.user3.pk)
+        self.assertEqual(self.user3.balance, user3_initial_balance)
+        self.assertEqual(self.banker.balance, 100)
+
     def test_pay_by_ponderation(self):
         # INIT
         event_pond_price = Event.objects.create(
@@ -9,10 +9,12 @@ from django.core.exceptions import ObjectDoesNotExist, PermissionDenied
 from django.http import Http404
 from django.shortcuts import HttpResponse, redirect
 from django.urls import reverse
+from django.utils.functional import SimpleLazyObject
 from openpyxl import Workbook, load_workbook
 from openpyxl.writer.excel import save_virtual_workbook
 
-from borgia.utils import get_members_group
+from borgia.mixins import FragmentCacheMixin
+from borgia.utils import EVENTS_VERSION, get_members_group
 from borgia.views import BorgiaFormView, BorgiaView
 from events.forms import (EventAddWeightForm, EventCreateForm, EventDeleteForm,
                           EventDownloadXlsxForm, EventFinishForm,
@@ -24,32 +26,42 @@ from events.models import Event
 from users.models import User
 
 
-class EventList(LoginRequiredMixin, PermissionRequiredMixin, BorgiaFormView):
+class EventList(FragmentCacheMixin, LoginRequiredMixin, PermissionRequiredMixin, BorgiaFormView):
     permission_required = 'events.view_event'
     menu_type = 'members'
     template_name = 'events/event_list.html'
     lm_active = 'lm_event_list'
     form_class = EventListForm
+    fragment_data = (EVENTS_VERSION,)
+    # The weights of the user are shown.
+    fragment_cache_per_user = True
+
+    def get_events(self, events):
+        """
+        Return the events with their registrants, participants and weights,
+        evaluated when rendered.
+        """
+        def annotate_events():
+            for event in events:
+                # Si fini, on recupere la participation, sinon la preinscription
+                event.weight_of_user = event.get_weight_of_user(
+                    self.request.user, event.done)
+                event.number_registrants = event.get_number_registrants()
+                event.number_participants = event.get_number_participants()
+                event.total_weights_registrants = event.get_total_weights_registrants()
+                event.total_weights_participants = event.get_total_weights_participants()
+                try:
+                    event.has_perm_manage = (self.request.user == event.manager or
+                                             self.request.user.has_perm('events.change_event'))
+                except ObjectDoesNotExist:
+                    event.has_perm_manage = False
+            return events
+        return SimpleLazyObject(annotate_events)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        events = Event.objects.filter(
-            date__gte=datetime.date.today().replace(day=1), done=False).order_by('-date')
-
-        for event in events:  # Duplicate
-            # Si fini, on recupere la participation, sinon la preinscription
-            event.weight_of_user = event.get_weight_of_user(
-                self.request.user, event.done)
-            event.number_registrants = event.get_number_registrants()
-            event.number_participants = event.get_number_participants()
-            event.total_weights_registrants = event.get_total_weights_registrants()
-            event.total_weights_participants = event.get_total_weights_participants()
-            try:
-                event.has_perm_manage = (self.request.user == event.manager or
-                                         self.request.user.has_perm('events.change_event'))
-            except ObjectDoesNotExist:
-                event.has_perm_manage = False
-        context['events'] = events
+        context['events'] = self.get_events(Event.objects.filter(
+            date__gte=datetime.date.today().replace(day=1), done=False).order_by('-date'))
         # Permission SelfRegistration
         if self.request.user.has_perm('events.self_register_event'):
             context['has_perm_self_register_event'] = True
@@ -85,21 +97,7 @@ class EventList(LoginRequiredMixin, PermissionRequiredMixin, BorgiaFormView):
         else:
             events = events.order_by('-date')
 
-        for event in events:  # Duplicate
-            # Si fini, on recupere la participation, sinon la preinscription
-            event.weight_of_user = event.get_weight_of_user(
-                self.request.user, event.done)
-            event.number_registrants = event.get_number_registrants()
-            event.number_participants = event.get_number_participants()
-            event.total_weights_registrants = event.get_total_weights_registrants()
-            event.total_weights_participants = event.get_total_weights_participants()
-            try:
-                event.has_perm_manage = (self.request.user == event.manager or
-                                         self.request.user.has_perm('events.change_event'))
-            except ObjectDoesNotExist:
-                event.has_perm_manage = False
-
-        context['events'] = events
+        context['events'] = self.get_events(events)
 
         return self.render_to_response(context)
 
@@ -1,3 +1,4 @@
+import datetime
 import re
 
 from django import forms
@@ -205,3 +206,34 @@ class SetPriceProductBaseForm(forms.Form):
         label='Gestion manuelle du prix', required=False)
     manual_price = forms.DecimalField(
         label='Prix manuel', decimal_places=2, max_digits=9, min_value=0, required=False)
+
+
+class LydiaReconciliationForm(forms.Form):
+    statement = forms.FileField(label='Relevé Lydia (CSV ou XLSX)',
+                                widget=forms.ClearableFileInput(attrs={'class': 'btn btn-default btn-file'}))
+    date_begin = forms.DateField(
+        label='Date de début',
+        input_formats=['%d/%m/%Y'],
+        widget=forms.DateInput(attrs={'class': 'datepicker'}))
+    date_end = forms.DateField(
+        label='Date de fin',
+        input_formats=['%d/%m/%Y'],
+        widget=forms.DateInput(attrs={'class': 'datepicker'}))
+
+    def clean(self):
+        cleaned_data = super().clean()
+        date_begin = cleaned_data.get('date_begin')
+        date_end = cleaned_data.get('date_end')
+        if date_begin and date_end and date_begin > date_end:
+            raise forms.ValidationError('La date de fin doit être après la date de début.')
+        return cleaned_data
+
+
+class TreasuryPeriodCloseForm(forms.Form):
+    def __init__(self, *args, **kwargs):
+        months = kwargs.pop('months')
+        super().__init__(*args, **kwargs)
+        self.fields['month'] = forms.TypedChoiceField(
+            label='Mois à clôturer',
+            choices=[(month.isoformat(), month.strftime('%m/%Y')) for month in months],
+            coerce=lambda value: datetime.datetime.strptime(value, '%Y-%m-%d').date())
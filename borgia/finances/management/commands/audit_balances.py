@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from finances.utils import (ASSOCIATION_USER_PK, audit_balances,
+                            correct_balance_discrepancies)
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = ("Compare the balance of every user with the balance computed from "
+            "the history of sales, rechargings, transferts, exceptionnal "
+            "movements and events. Operations made during the audit may show "
+            "as discrepancies.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true',
+                            help="Record an exceptionnal movement for each discrepancy, so that "
+                                 "the history matches the balances. Balances are unchanged.")
+        parser.add_argument('--operator',
+                            help="Username of the operator of the movements, the association by default.")
+
+    def handle(self, *args, **options):
+        try:
+            if options['operator']:
+                operator = User.objects.get(username=options['operator'])
+            else:
+                operator = User.objects.get(pk=ASSOCIATION_USER_PK)
+        except User.DoesNotExist:
+            raise CommandError("The operator doesn't exist.")
+
+        discrepancies = audit_balances()
+        for discrepancy in discrepancies:
+            self.stdout.write(
+                "%(pk)s %(username)s: balance %(balance)s, expected %(expected)s, "
+                "difference %(difference)s" % discrepancy)
+        if options['verbosity'] > 0:
+            self.stdout.write("%d discrepancies." % len(discrepancies))
+
+        if options['fix'] and discrepancies:
+            movements = correct_balance_discrepancies(discrepancies, operator)
+            if options['verbosity'] > 0:
+                self.stdout.write("%d exceptionnal movements recorded." % len(movements))
@@ -0,0 +1,30 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.timezone import localdate
+
+from finances.utils import close_treasury_period
+
+
+class Command(BaseCommand):
+    help = ("Freeze the treasury figures of an ended month, the previous month "
+            "by default.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--month', help="Month to close, as YYYY-MM.")
+
+    def handle(self, *args, **options):
+        if options['month']:
+            try:
+                month = datetime.datetime.strptime(options['month'], '%Y-%m').date()
+            except ValueError:
+                raise CommandError("The month must be given as YYYY-MM.")
+        else:
+            month = (localdate().replace(day=1) - datetime.timedelta(days=1)).replace(day=1)
+
+        try:
+            period = close_treasury_period(month)
+        except ValueError as error:
+            raise CommandError(str(error))
+        if options['verbosity'] > 0:
+            self.stdout.write("%s: balances total %s." % (period, period.balances_total))
@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from finances.utils import LYDIA_CALLBACKS_BATCH_SIZE, process_lydia_callbacks
+
+
+class Command(BaseCommand):
+    help = ("Apply the pending callbacks from Lydia: create the rechargings "
+            "and credit the users, by batches.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=LYDIA_CALLBACKS_BATCH_SIZE,
+                            help="Maximum number of callbacks per batch.")
+        parser.add_argument('--loop', action='store_true',
+                            help="Keep processing the callbacks as they arrive, as a worker.")
+        parser.add_argument('--interval', type=float, default=1,
+                            help="Seconds to wait when no callback is pending, with --loop.")
+
+    def handle(self, *args, **options):
+        while True:
+            processed = 0
+            while True:
+                batch = process_lydia_callbacks(batch_size=options['batch_size'])
+                processed += batch
+                if batch < options['batch_size']:
+                    break
+            if processed and options['verbosity'] > 0:
+                self.stdout.write("%d callbacks processed." % processed)
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
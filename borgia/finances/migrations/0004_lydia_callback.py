@@ -0,0 +1,36 @@
+# Generated by Django 2.2.28 on 2026-10-19 00:50
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finances', '0003_lydia_fee'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LydiaCallback',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('transaction_identifier', models.CharField(max_length=255, unique=True, verbose_name='Numéro unique')),
+                ('user_pk', models.CharField(blank=True, max_length=255, verbose_name='Utilisateur')),
+                ('amount', models.CharField(blank=True, max_length=255, verbose_name='Montant')),
+                ('params', models.TextField(verbose_name='Paramètres')),
+                ('date_received', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Date de réception')),
+                ('date_processed', models.DateTimeField(blank=True, null=True, verbose_name='Date de traitement')),
+                ('error', models.CharField(blank=True, max_length=255, verbose_name='Erreur')),
+                ('lydia', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='finances.Lydia')),
+            ],
+            options={
+                'default_permissions': (),
+            },
+        ),
+        migrations.AddIndex(
+            model_name='lydiacallback',
+            index=models.Index(fields=['date_processed', 'date_received'], name='finances_ly_date_pr_c10655_idx'),
+        ),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 2.2.28 on 2026-10-19 01:14
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shops', '0003_product_price_history'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('finances', '0004_lydia_callback'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TreasuryPeriod',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(unique=True, verbose_name='Mois')),
+                ('datetime', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Date de clôture')),
+                ('transferts_amount', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Montant des transferts')),
+                ('transferts_count', models.PositiveIntegerField(default=0, verbose_name='Nombre de transferts')),
+                ('exceptionnal_credits', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Crédits exceptionnels')),
+                ('exceptionnal_debits', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Débits exceptionnels')),
+                ('exceptionnal_count', models.PositiveIntegerField(default=0, verbose_name='Nombre de mouvements exceptionnels')),
+                ('events_amount', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Montant des événements')),
+                ('events_count', models.PositiveIntegerField(default=0, verbose_name="Nombre d'événements")),
+                ('balances_total', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Somme des soldes')),
+                ('operator', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='operator_treasury_period', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'default_permissions': ('add', 'view'),
+            },
+        ),
+        migrations.CreateModel(
+            name='TreasuryShopSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shop_name', models.CharField(max_length=255, verbose_name='Magasin')),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Montant')),
+                ('sale_count', models.PositiveIntegerField(default=0, verbose_name='Nombre de ventes')),
+                ('period', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shops', to='finances.TreasuryPeriod')),
+                ('shop', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='shops.Shop')),
+            ],
+            options={
+                'default_permissions': (),
+            },
+        ),
+        migrations.CreateModel(
+            name='TreasuryRechargingSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('solution', models.CharField(max_length=255, verbose_name='Solution')),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Montant')),
+                ('fee', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Frais')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='Nombre')),
+                ('period', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rechargings', to='finances.TreasuryPeriod')),
+            ],
+            options={
+                'default_permissions': (),
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='treasuryrechargingsnapshot',
+            constraint=models.UniqueConstraint(fields=('period', 'solution'), name='unique_treasury_recharging_snapshot'),
+        ),
+    ]
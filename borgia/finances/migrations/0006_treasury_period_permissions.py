@@ -0,0 +1,38 @@
+from django.contrib.auth.management import create_permissions
+from django.db import migrations
+
+TREASURY_PERIOD_GROUPS = ('presidents', 'vice_presidents', 'treasurers')
+
+
+def grant_treasury_period_permissions(apps, schema_editor):
+    """
+    Grant the permissions to view and close the treasury periods to the
+    groups viewing the rechargings.
+
+    The permissions are created here, they are otherwise only created after
+    all the migrations.
+    """
+    app_config = apps.get_app_config('finances')
+    app_config.models_module = True
+    create_permissions(app_config, apps=apps, verbosity=0)
+    app_config.models_module = None
+
+    Group = apps.get_model('auth', 'Group')
+    Permission = apps.get_model('auth', 'Permission')
+    permissions = Permission.objects.filter(content_type__app_label='finances',
+                                            codename__in=['add_treasuryperiod', 'view_treasuryperiod'])
+    for group in Group.objects.filter(name__in=TREASURY_PERIOD_GROUPS):
+        group.permissions.add(*permissions)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0011_update_proxy_permissions'),
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('finances', '0005_treasury_period'),
+    ]
+
+    operations = [
+        migrations.RunPython(grant_treasury_period_permissions, migrations.RunPython.noop),
+    ]
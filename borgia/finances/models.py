@@ -186,3 +186,177 @@ class Lydia(BaseRechargingSolution):
 
     def __str__(self):
         return 'Lydia de ' + str(self.amount) + '€, n°' + self.id_from_lydia
+
+
+class LydiaCallback(models.Model):
+    """
+    Define a payment notified by Lydia, as received.
+
+    Callbacks are recorded by self_lydia_callback and applied later by
+    finances.utils.process_lydia_callbacks, creating the Lydia and Recharging
+    and crediting the user.
+
+    :param transaction_identifier: transaction id from Lydia, unique, so that
+    a callback sent again is recorded once.
+    :param user_pk: pk of the user to credit, as given in the callback url.
+    :param amount: total amount paid, fee included.
+    :param params: parameters of the callback.
+    :param date_received: date of reception.
+    :param date_processed: date of processing, null while pending.
+    :param lydia: Lydia created by the processing.
+    :param error: reason why the callback wasn't applied.
+    :type transaction_identifier: string
+    :type user_pk: string
+    :type amount: string
+    :type params: string, json
+    :type date_received: datetime string, default now
+    :type date_processed: datetime string
+    :type lydia: Lydia
+    :type error: string
+    """
+    transaction_identifier = models.CharField('Numéro unique', max_length=255, unique=True)
+    user_pk = models.CharField('Utilisateur', max_length=255, blank=True)
+    amount = models.CharField('Montant', max_length=255, blank=True)
+    params = models.TextField('Paramètres')
+    date_received = models.DateTimeField('Date de réception', default=now)
+    date_processed = models.DateTimeField('Date de traitement', blank=True, null=True)
+    lydia = models.OneToOneField(Lydia, on_delete=models.SET_NULL, blank=True, null=True)
+    error = models.CharField('Erreur', max_length=255, blank=True)
+
+    class Meta:
+        """
+        Remove default permissions for LydiaCallback
+        """
+        default_permissions = ()
+        indexes = [models.Index(fields=['date_processed', 'date_received'])]
+
+    def __str__(self):
+        return 'Notification Lydia n°' + self.transaction_identifier
+
+
+class TreasuryPeriod(models.Model):
+    """
+    Define the figures of a closed month, frozen by
+    finances.utils.close_treasury_period.
+
+    Reports read the closed months from these small tables instead of the
+    operations, the figures by recharging solution and by shop are in
+    TreasuryRechargingSnapshot and TreasuryShopSnapshot.
+
+    :param month: first day of the month, in local time, mandatory.
+    :param datetime: date of closing.
+    :param operator: user who closed the month.
+    :param transferts_amount: amount of the transferts between users.
+    :param transferts_count: number of transferts.
+    :param exceptionnal_credits: amount of the exceptionnal credits.
+    :param exceptionnal_debits: amount of the exceptionnal debits.
+    :param exceptionnal_count: number of exceptionnal movements.
+    :param events_amount: amount paid by the participants of the events.
+    :param events_count: number of events paid.
+    :param balances_total: sum of the balances of the users at the end of the
+    month, owed by the association.
+    :type month: date string
+    :type datetime: date string, default now
+    :type operator: User object
+    :type transferts_amount: decimal
+    :type transferts_count: integer
+    :type exceptionnal_credits: decimal
+    :type exceptionnal_debits: decimal
+    :type exceptionnal_count: integer
+    :type events_amount: decimal
+    :type events_count: integer
+    :type balances_total: decimal
+    """
+    month = models.DateField('Mois', unique=True)
+    datetime = models.DateTimeField('Date de clôture', default=now)
+    operator = models.ForeignKey(User, related_name='operator_treasury_period',
+                                 on_delete=models.SET_NULL, blank=True, null=True)
+    transferts_amount = models.DecimalField('Montant des transferts', default=0,
+                                            decimal_places=2, max_digits=12)
+    transferts_count = models.PositiveIntegerField('Nombre de transferts', default=0)
+    exceptionnal_credits = models.DecimalField('Crédits exceptionnels', default=0,
+                                               decimal_places=2, max_digits=12)
+    exceptionnal_debits = models.DecimalField('Débits exceptionnels', default=0,
+                                              decimal_places=2, max_digits=12)
+    exceptionnal_count = models.PositiveIntegerField('Nombre de mouvements exceptionnels', default=0)
+    events_amount = models.DecimalField('Montant des événements', default=0,
+                                        decimal_places=2, max_digits=12)
+    events_count = models.PositiveIntegerField('Nombre d\'événements', default=0)
+    balances_total = models.DecimalField('Somme des soldes', default=0,
+                                         decimal_places=2, max_digits=12)
+
+    class Meta:
+        """
+        Define Permissions for TreasuryPeriod.
+
+        :note:: Initial Django Permission (add, view) are added.
+        """
+        default_permissions = ('add', 'view',)
+
+    def __str__(self):
+        return 'Clôture de ' + self.month.strftime('%m/%Y')
+
+
+class TreasuryRechargingSnapshot(models.Model):
+    """
+    Define the rechargings of a closed month by solution.
+
+    :param period: Related period, mandatory.
+    :param solution: model name of the solution (cash, cheque or lydia).
+    :param amount: amount credited.
+    :param fee: fee of the solution (Lydia only).
+    :param count: number of rechargings.
+    :type period: TreasuryPeriod object
+    :type solution: string
+    :type amount: decimal
+    :type fee: decimal
+    :type count: integer
+    """
+    period = models.ForeignKey(TreasuryPeriod, related_name='rechargings',
+                               on_delete=models.CASCADE)
+    solution = models.CharField('Solution', max_length=255)
+    amount = models.DecimalField('Montant', default=0, decimal_places=2, max_digits=12)
+    fee = models.DecimalField('Frais', default=0, decimal_places=2, max_digits=12)
+    count = models.PositiveIntegerField('Nombre', default=0)
+
+    class Meta:
+        """
+        Remove default permissions for TreasuryRechargingSnapshot
+        """
+        default_permissions = ()
+        constraints = [
+            models.UniqueConstraint(fields=['period', 'solution'],
+                                    name='unique_treasury_recharging_snapshot'),
+        ]
+
+
+class TreasuryShopSnapshot(models.Model):
+    """
+    Define the sales of a shop during a closed month.
+
+    The name of the shop is kept, the snapshot staying if the shop is deleted.
+
+    :param period: Related period, mandatory.
+    :param shop: Related shop.
+    :param shop_name: name of the shop at the closing.
+    :param revenue: amount of the sales.
+    :param sale_count: number of sales.
+    :type period: TreasuryPeriod object
+    :type shop: Shop object
+    :type shop_name: string
+    :type revenue: decimal
+    :type sale_count: integer
+    """
+    period = models.ForeignKey(TreasuryPeriod, related_name='shops',
+                               on_delete=models.CASCADE)
+    shop = models.ForeignKey('shops.Shop', on_delete=models.SET_NULL,
+                             blank=True, null=True)
+    shop_name = models.CharField('Magasin', max_length=255)
+    revenue = models.DecimalField('Montant', default=0, decimal_places=2, max_digits=12)
+    sale_count = models.PositiveIntegerField('Nombre de ventes', default=0)
+
+    class Meta:
+        """
+        Remove default permissions for TreasuryShopSnapshot
+        """
+        default_permissions = ()
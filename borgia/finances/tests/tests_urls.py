@@ -20,7 +20,8 @@ class FinancesNamedURLTests(TestCase):
              [], {'exceptionnalmovement_pk': 53}),
             ('url_self_lydia_create', [], {}),
             ('url_self_lydia_confirm', [], {}),
-            ('url_self_lydia_callback', [], {})
+            ('url_self_lydia_callback', [], {}),
+            ('url_lydia_reconciliation', [], {})
         ]
         for name, args, kwargs in expected_named_urls:
             with self.subTest(name=name):
@@ -1,8 +1,30 @@
+import datetime
 import decimal
+import io
 
+import openpyxl
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db.models import F
 from django.test import TestCase
-from finances.utils import (calculate_lydia_fee_from_total,
-                            calculate_total_amount_lydia)
+from django.utils.timezone import localdate, make_aware
+
+from configurations.models import Configuration
+from events.models import Event, WeightsUser
+from finances.models import (Cash, ExceptionnalMovement, Lydia, LydiaCallback,
+                             Recharging, Transfert, TreasuryPeriod)
+from finances.utils import (audit_balances, calculate_lydia_fee_from_total,
+                            calculate_total_amount_lydia,
+                            close_treasury_period, compute_treasury_figures,
+                            correct_balance_discrepancies,
+                            get_treasury_report, process_lydia_callbacks,
+                            read_lydia_statement, reconcile_lydia_statement,
+                            record_lydia_callback)
+from modules.models import SelfSaleModule
+from sales.models import Sale, SaleProduct
+from sales.utils import rollup_sale
+from shops.models import Product, Shop
+from users.models import User
 
 
 class CalculationsLydiaTestCase(TestCase):
@@ -85,3 +107,354 @@ class CalculationsLydiaTestCase(TestCase):
             recharging_amount, base_fee, ratio_fee, tax_fee)
         expected = decimal.Decimal('53.00')
         self.assertEqual(expected, total)
+
+
+class ProcessLydiaCallbacksTestCase(TestCase):
+    fixtures = ['initial']
+
+    def setUp(self):
+        self.user1 = User.objects.create(username='user1', balance=10)
+        self.user2 = User.objects.create(username='user2', balance=20)
+
+    def record(self, user_pk, amount, transaction_identifier):
+        return record_lydia_callback({'amount': amount, 'transaction_identifier': transaction_identifier},
+                                     str(user_pk))
+
+    def test_record_once(self):
+        self.assertTrue(self.record(self.user1.pk, '5.00', 'transaction1'))
+        self.assertFalse(self.record(self.user1.pk, '5.00', 'transaction1'))
+        self.assertEqual(LydiaCallback.objects.count(), 1)
+
+    def test_process(self):
+        self.record(self.user1.pk, '5.00', 'transaction1')
+        self.record(self.user1.pk, '2.50', 'transaction2')
+        self.record(self.user2.pk, '1.00', 'transaction3')
+        self.assertEqual(process_lydia_callbacks(), 3)
+
+        self.user1.refresh_from_db()
+        self.user2.refresh_from_db()
+        self.assertEqual(self.user1.balance, decimal.Decimal('17.50'))
+        self.assertEqual(self.user2.balance, decimal.Decimal('21.00'))
+        callback = LydiaCallback.objects.get(transaction_identifier='transaction1')
+        self.assertEqual(callback.lydia.amount, decimal.Decimal('5.00'))
+        self.assertEqual(callback.lydia.id_from_lydia, 'transaction1')
+        self.assertTrue(Recharging.objects.filter(solution_id=callback.lydia.pk, sender=self.user1).exists())
+
+        # Already processed.
+        self.assertEqual(process_lydia_callbacks(), 0)
+        self.user1.refresh_from_db()
+        self.assertEqual(self.user1.balance, decimal.Decimal('17.50'))
+
+    def test_fee(self):
+        Configuration.objects.filter(name='ENABLE_FEE_LYDIA').update(value='True')
+        Configuration.objects.filter(name='BASE_FEE_LYDIA').update(value='0.10')
+        Configuration.objects.filter(name='RATIO_FEE_LYDIA').update(value='1.0')
+        Configuration.objects.filter(name='TAX_FEE_LYDIA').update(value='1')
+        self.record(self.user1.pk, '10.00', 'transaction1')
+        process_lydia_callbacks()
+        lydia = Lydia.objects.get()
+        self.assertEqual((lydia.amount, lydia.fee), (decimal.Decimal('9.80'), decimal.Decimal('0.20')))
+
+    def test_errors(self):
+        self.record(53000, '5.00', 'transaction1')
+        self.record(self.user1.pk, 'abc', 'transaction2')
+        self.record(self.user1.pk, '-5', 'transaction3')
+        self.assertEqual(process_lydia_callbacks(), 3)
+        self.assertEqual(
+            dict(LydiaCallback.objects.values_list('transaction_identifier', 'error')),
+            {'transaction1': 'Utilisateur inconnu', 'transaction2': 'Montant invalide',
+             'transaction3': 'Montant invalide'})
+        self.assertFalse(Lydia.objects.exists())
+
+    def test_batch(self):
+        for i in range(5):
+            self.record(self.user1.pk if i % 2 else self.user2.pk, '1.00', 'transaction' + str(i))
+        self.assertEqual(process_lydia_callbacks(user_pk=self.user1.pk), 2)
+        self.assertEqual(process_lydia_callbacks(batch_size=2), 2)
+        self.assertEqual(process_lydia_callbacks(batch_size=2), 1)
+
+    def test_queries(self):
+        for i in range(10):
+            self.record(self.user1.pk if i % 2 else self.user2.pk, '1.00', 'transaction' + str(i))
+        # Callbacks, configuration, users, savepoint and release, then per
+        # callback: claim, lydia and recharging; then bulk update of the
+        # callbacks and a credit per user.
+        with self.assertNumQueries(3 + 2 + 10 * 3 + 1 + 2):
+            process_lydia_callbacks()
+
+    def test_command(self):
+        for i in range(3):
+            self.record(self.user1.pk, '1.00', 'transaction' + str(i))
+        out = io.StringIO()
+        call_command('process_lydia_callbacks', batch_size=2, stdout=out)
+        self.assertEqual(out.getvalue(), '3 callbacks processed.\n')
+        self.user1.refresh_from_db()
+        self.assertEqual(self.user1.balance, decimal.Decimal('13.00'))
+
+
+class LydiaReconciliationTestCase(TestCase):
+    fixtures = ['initial']
+
+    def setUp(self):
+        self.user = User.objects.create(username='user1')
+        self.date_begin = datetime.date(2026, 1, 1)
+        self.date_end = datetime.date(2026, 1, 31)
+        for transaction_identifier, amount, fee, day in (
+                ('t1', '10.00', '0.20', 5), ('t2', '20.00', '0.00', 6), ('t3', '5.00', '0.00', 7),
+                ('t4', '8.00', '0.00', 8), ('t5', '3.00', '0.00', 1)):
+            Lydia.objects.create(sender=self.user, amount=decimal.Decimal(amount), fee=decimal.Decimal(fee),
+                                 id_from_lydia=transaction_identifier,
+                                 date_operation=datetime.date(2026, 1, day))
+        # Credited the day after the end of the period.
+        Lydia.objects.create(sender=self.user, amount=7, id_from_lydia='t6',
+                             date_operation=datetime.date(2026, 2, 1))
+        # Manual Lydia, not reconciled.
+        Lydia.objects.create(sender=self.user, amount=7, id_from_lydia='t1', is_online=False,
+                             date_operation=datetime.date(2026, 1, 5))
+        record_lydia_callback({'transaction_identifier': 't7', 'amount': '4.00'}, '53000')
+        process_lydia_callbacks()
+        record_lydia_callback({'transaction_identifier': 't8', 'amount': '2.00'}, str(self.user.pk))
+        LydiaCallback.objects.update(date_received=datetime.datetime(2026, 1, 10, 12, tzinfo=datetime.timezone.utc))
+
+    def get_csv(self, content, name='statement.csv'):
+        return SimpleUploadedFile(name, content.encode())
+
+    def reconcile(self, statement):
+        return reconcile_lydia_statement(read_lydia_statement(statement), self.date_begin, self.date_end)
+
+    def test_read_csv(self):
+        rows = list(read_lydia_statement(self.get_csv(
+            'Date;Identifiant;Montant;Frais\n05/01/2026;t1;10,20 €;0,20\n;;;\n06/01/2026;t2;abc;\n')))
+        self.assertEqual(rows, [(2, 't1', decimal.Decimal('10.20'), decimal.Decimal('0.20')),
+                                (4, 't2', None, None)])
+        rows = list(read_lydia_statement(self.get_csv('transaction_identifier,amount\nt1,10.2\n')))
+        self.assertEqual(rows, [(2, 't1', decimal.Decimal('10.20'), None)])
+
+    def test_read_xlsx(self):
+        workbook = openpyxl.Workbook()
+        workbook.active.append(['Identifiant', 'Montant'])
+        workbook.active.append([123456, 10.2])
+        content = io.BytesIO()
+        workbook.save(content)
+        rows = list(read_lydia_statement(SimpleUploadedFile('statement.xlsx', content.getvalue())))
+        self.assertEqual(rows, [(2, '123456', decimal.Decimal('10.20'), None)])
+
+    def test_missing_columns(self):
+        with self.assertRaises(ValueError):
+            list(read_lydia_statement(self.get_csv('date;frais\n05/01/2026;0\n')))
+
+    def test_report(self):
+        report = self.reconcile(self.get_csv(
+            'identifiant;montant;frais\n'
+            't1;10,20;0,20\n'
+            't2;20,00;0,00\n'
+            't2;20,00;0,00\n'
+            't3;6,00;0,00\n'
+            't6;7,00;0,00\n'
+            't8;2,00;0,00\n'
+            't9;1,00;0,00\n'
+            't10;;\n'))
+        # t1 and t2 in the period, t6 credited the day after.
+        self.assertEqual(report['matched'], 3)
+        self.assertEqual([(missing['transaction_identifier'], missing['callback'] is not None)
+                          for missing in report['missing_credits']], [('t8', True), ('t9', False)])
+        self.assertEqual([(duplicate['transaction_identifier'], duplicate['source'])
+                          for duplicate in report['duplicates']], [('t2', 'Relevé')])
+        self.assertEqual([(mismatch['transaction_identifier'], mismatch['statement_amount'], mismatch['amount'])
+                          for mismatch in report['mismatches']],
+                         [('t3', decimal.Decimal('6.00'), decimal.Decimal('5.00'))])
+        self.assertEqual([lydia['id_from_lydia'] for lydia in report['not_in_statement']], ['t5', 't4'])
+        # t7 of an unknown user, t8 already listed as missing.
+        self.assertEqual([callback.transaction_identifier for callback in report['orphan_callbacks']], ['t7'])
+        self.assertEqual(report['invalid_rows'], [9])
+        self.assertEqual(report['statement_total'], decimal.Decimal('46.20'))
+
+    def test_fee_mismatch(self):
+        report = self.reconcile(self.get_csv('identifiant;montant;frais\nt1;10,20;0,10\n'))
+        self.assertEqual(report['matched'], 0)
+        self.assertEqual(report['mismatches'][0]['fee'], decimal.Decimal('0.20'))
+
+    def test_duplicates_in_borgia(self):
+        Lydia.objects.create(sender=self.user, amount=10, id_from_lydia='t2',
+                             date_operation=datetime.date(2026, 1, 9))
+        report = self.reconcile(self.get_csv('identifiant;montant\nt2;20,00\n'))
+        self.assertEqual([(duplicate['transaction_identifier'], duplicate['source'])
+                          for duplicate in report['duplicates']], [('t2', 'Borgia')])
+
+    def test_queries(self):
+        statement = 'identifiant;montant\n' + ''.join('x%d;1,00\n' % i for i in range(2000))
+        # Lydia of the period, then by chunk of 500 the Lydia and callbacks
+        # of the missing transactions, and the orphan callbacks.
+        with self.assertNumQueries(1 + 4 + 4 + 1):
+            report = self.reconcile(self.get_csv(statement))
+        self.assertEqual(len(report['missing_credits']), 2000)
+
+
+class AuditBalancesTestCase(TestCase):
+    fixtures = ['initial']
+
+    def setUp(self):
+        self.association = User.objects.get(pk=1)
+        self.user1 = User.objects.create(username='user1')
+        self.user2 = User.objects.create(username='user2')
+        self.user3 = User.objects.create(username='user3')
+
+        for user, amount in ((self.user1, 50), (self.user2, 30)):
+            Recharging.objects.create(sender=user, operator=self.association,
+                                      content_solution=Cash.objects.create(sender=user, amount=amount)).pay()
+        Transfert.objects.create(sender=self.user1, recipient=self.user3, amount=5, justification='').pay()
+        ExceptionnalMovement.objects.create(operator=self.association, recipient=self.user2,
+                                            amount=2, is_credit=False, justification='').pay()
+        ExceptionnalMovement.objects.create(operator=self.association, recipient=self.user2,
+                                            amount=1, is_credit=True, justification='').pay()
+
+        shop = Shop.objects.create(name='shop1', color='#F4FA58')
+        product = Product.objects.create(name='beer', unit='CL', shop=shop, is_manual=True, manual_price=2)
+        sale = Sale.objects.create(sender=self.user1, recipient=self.association, operator=self.user1,
+                                   shop=shop, module=SelfSaleModule.objects.create(shop=shop))
+        SaleProduct.objects.create(sale=sale, product=product, quantity=50, price=decimal.Decimal('1.50'))
+        SaleProduct.objects.create(sale=sale, product=product, quantity=25, price=decimal.Decimal('0.75'))
+        sale.pay()
+
+        event = Event.objects.create(description='event', manager=self.user1)
+        WeightsUser.objects.create(user=self.user1, event=event, weights_participation=1)
+        WeightsUser.objects.create(user=self.user2, event=event, weights_participation=2)
+        event.pay_by_total(self.association, self.association, decimal.Decimal(10))
+
+    def test_consistent(self):
+        self.assertEqual(audit_balances(), [])
+
+    def test_discrepancy(self):
+        User.objects.filter(pk=self.user2.pk).update(balance=F('balance') + decimal.Decimal('4.20'))
+        self.user2.refresh_from_db()
+        self.assertEqual(audit_balances(), [{
+            'pk': self.user2.pk, 'username': 'user2', 'balance': self.user2.balance,
+            'expected': self.user2.balance - decimal.Decimal('4.20'), 'difference': decimal.Decimal('4.20')}])
+
+        movement, = correct_balance_discrepancies(audit_balances(), self.association)
+        self.assertEqual((movement.recipient, movement.amount, movement.is_credit),
+                         (self.user2, decimal.Decimal('4.20'), True))
+        self.assertEqual(audit_balances(), [])
+
+    def test_queries_independent_of_users(self):
+        # Sales, 3 solutions, 2 transferts, movements, events, shares and
+        # users, the content types being cached.
+        audit_balances()
+        with self.assertNumQueries(10):
+            audit_balances()
+        User.objects.bulk_create(User(username='other' + str(i)) for i in range(20))
+        with self.assertNumQueries(10):
+            audit_balances()
+
+    def test_command(self):
+        User.objects.filter(pk=self.user3.pk).update(balance=0)
+        out = io.StringIO()
+        call_command('audit_balances', '--fix', stdout=out)
+        self.assertIn('user3', out.getvalue())
+        self.assertEqual(audit_balances(), [])
+
+
+class TreasuryPeriodTestCase(TestCase):
+    fixtures = ['initial']
+
+    def setUp(self):
+        self.association = User.objects.get(pk=1)
+        self.user1 = User.objects.create(username='user1')
+        self.user2 = User.objects.create(username='user2')
+        self.month = (localdate().replace(day=1) - datetime.timedelta(days=1)).replace(day=1)
+        shop = Shop.objects.create(name='shop1', color='#F4FA58')
+        self.product = Product.objects.create(name='beer', unit='CL', shop=shop, is_manual=True, manual_price=2)
+        self.module = SelfSaleModule.objects.create(shop=shop)
+
+        date = make_aware(datetime.datetime.combine(self.month, datetime.time(12)))
+        self.recharge(self.user1, Cash.objects.create(sender=self.user1, amount=50), date)
+        self.recharge(self.user2, Lydia.objects.create(sender=self.user2, amount=20, fee=decimal.Decimal('0.40'),
+                                                       id_from_lydia='1'), date)
+        self.sell(self.user1, '12.50', date)
+        Transfert.objects.create(sender=self.user1, recipient=self.user2, amount=5, justification='',
+                                 datetime=date).pay()
+        ExceptionnalMovement.objects.create(operator=self.association, recipient=self.user2, amount=3,
+                                            is_credit=False, justification='', datetime=date).pay()
+        event = Event.objects.create(description='event', manager=self.user1)
+        WeightsUser.objects.create(user=self.user1, event=event, weights_participation=1)
+        WeightsUser.objects.create(user=self.user2, event=event, weights_participation=2)
+        event.pay_by_total(self.association, self.association, decimal.Decimal(9))
+        Event.objects.filter(pk=event.pk).update(datetime=date)
+        self.user1.refresh_from_db()
+        self.user2.refresh_from_db()
+        self.balances_total = sum(User.objects.values_list('balance', flat=True))
+
+        # Operations after the month
+        self.recharge(self.user1, Cash.objects.create(sender=self.user1, amount=7), None)
+        self.sell(self.user2, '4.00', None)
+
+    def recharge(self, user, solution, date):
+        recharging = Recharging.objects.create(sender=user, operator=self.association, content_solution=solution)
+        if date is not None:
+            Recharging.objects.filter(pk=recharging.pk).update(datetime=date)
+        recharging.pay()
+
+    def sell(self, user, price, date):
+        sale = Sale.objects.create(sender=user, recipient=self.association, operator=user,
+                                   shop=self.product.shop, module=self.module)
+        if date is not None:
+            sale.datetime = date
+            sale.save()
+        sale_product = SaleProduct.objects.create(sale=sale, product=self.product, quantity=25,
+                                                  price=decimal.Decimal(price))
+        rollup_sale(sale, [sale_product])
+        sale.pay()
+
+    def test_compute(self):
+        figures = compute_treasury_figures([self.month])[self.month]
+        self.assertEqual([(solution['solution'], solution['amount'], solution['count'])
+                          for solution in figures['rechargings']],
+                         [('cash', 50, 1), ('cheque', 0, 0), ('lydia', 20, 1)])
+        self.assertEqual(figures['fees_total'], decimal.Decimal('0.40'))
+        self.assertEqual(figures['sales_total'], decimal.Decimal('12.50'))
+        self.assertEqual((figures['transferts_amount'], figures['exceptionnal_debits'], figures['events_amount']),
+                         (5, 3, 9))
+        # The balances at the end of the month, without the later operations.
+        self.assertEqual(figures['balances_total'], self.balances_total)
+
+    def test_report_open_months(self):
+        current_month = localdate().replace(day=1)
+        previous, current = get_treasury_report([self.month, current_month])
+        self.assertEqual(previous['balances_total'], self.balances_total)
+        self.assertEqual(current['balances_total'], sum(User.objects.values_list('balance', flat=True)))
+        self.assertEqual((previous['sales_total'], current['sales_total']), (decimal.Decimal('12.50'), 4))
+
+    def test_close(self):
+        figures = compute_treasury_figures([self.month])[self.month]
+        period = close_treasury_period(self.month, self.user1)
+        self.assertEqual(period.balances_total, self.balances_total)
+        with self.assertRaises(ValueError):
+            close_treasury_period(self.month)
+        with self.assertRaises(ValueError):
+            close_treasury_period(localdate())
+
+        # Operations added afterwards don't change the closed month.
+        self.sell(self.user1, '1.00', make_aware(datetime.datetime.combine(self.month, datetime.time(13))))
+        # Periods, rechargings and shops of the snapshots.
+        with self.assertNumQueries(3):
+            closed, = get_treasury_report([self.month])
+        self.assertEqual(closed['period'], period)
+        for key in ('rechargings', 'shops', 'rechargings_total', 'fees_total', 'sales_total', 'transferts_amount',
+                    'exceptionnal_debits', 'events_amount', 'balances_total'):
+            self.assertEqual(closed[key], figures[key])
+
+    def test_balance_audit_corrections_ignored(self):
+        User.objects.filter(pk=self.user1.pk).update(balance=F('balance') + 10)
+        correct_balance_discrepancies(audit_balances(), self.association)
+        current_month = localdate().replace(day=1)
+        previous, current = get_treasury_report([self.month, current_month])
+        self.assertEqual(previous['balances_total'], self.balances_total + 10)
+        self.assertEqual(current['balances_total'], sum(User.objects.values_list('balance', flat=True)))
+        self.assertEqual(current['exceptionnal_credits'], 0)
+        self.assertEqual(compute_treasury_figures([self.month])[self.month]['balances_total'],
+                         self.balances_total + 10)
+
+    def test_command(self):
+        out = io.StringIO()
+        call_command('close_treasury_period', '--month', self.month.strftime('%Y-%m'), stdout=out)
+        self.assertTrue(TreasuryPeriod.objects.filter(month=self.month, operator__isnull=True).exists())
@@ -1,9 +1,21 @@
+import datetime
+import decimal
+import random
+
+from django.contrib.auth.models import Group
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import Client
 from django.urls import reverse
+from django.utils.timezone import localdate
 
 from borgia.tests.tests_views import BaseBorgiaViewsTestCase
 from borgia.tests.utils import get_login_url_redirected
-from finances.models import Cash, ExceptionnalMovement, Recharging, Transfert
+from borgia.utils import INTERNALS_GROUP_NAME, TREASURERS_GROUP_NAME
+from configurations.utils import configuration_get
+from finances.models import (Cash, ExceptionnalMovement, Lydia, LydiaCallback,
+                             Recharging, Transfert, TreasuryPeriod)
+from finances.utils import process_lydia_callbacks, sign_lydia_params
+from users.models import User
 from users.tests.tests_views import BaseFocusUserViewsTestCase
 
 
@@ -36,6 +48,44 @@ class GeneralFinancesViewsTests(BaseFinancesViewsTestCase):
                              get_login_url_redirected(self.get_url()))
 
 
+class TreasuryReportTests(GeneralFinancesViewsTests):
+    url_view = 'url_treasury_report'
+
+    def test_allowed_user_get(self):
+        super().allowed_user_get()
+
+    def test_not_allowed_user_get(self):
+        super().not_allowed_user_get()
+
+    def test_offline_user_redirection(self):
+        super().offline_user_redirection()
+
+    def test_treasurer(self):
+        # The permissions of the initial fixture, not all of them.
+        treasurer = User.objects.create(username='treasurer')
+        treasurer.groups.add(Group.objects.get(name=INTERNALS_GROUP_NAME),
+                             Group.objects.get(name=TREASURERS_GROUP_NAME))
+        client = Client()
+        client.force_login(treasurer)
+        self.assertEqual(client.get(self.get_url()).status_code, 200)
+
+        month = (localdate().replace(day=1) - datetime.timedelta(days=1)).replace(day=1)
+        response = client.post(self.get_url(), {'month': month.isoformat()})
+        self.assertRedirects(response, self.get_url())
+        self.assertTrue(TreasuryPeriod.objects.filter(month=month, operator=treasurer).exists())
+
+    def test_post(self):
+        month = (localdate().replace(day=1) - datetime.timedelta(days=1)).replace(day=1)
+        response = self.client1.post(self.get_url(), {'month': month.isoformat()})
+        self.assertRedirects(response, self.get_url())
+        self.assertTrue(TreasuryPeriod.objects.filter(month=month, operator=self.user1).exists())
+
+        # The current month can't be closed.
+        response = self.client1.post(self.get_url(), {'month': localdate().replace(day=1).isoformat()})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(TreasuryPeriod.objects.filter(month=localdate().replace(day=1)).exists())
+
+
 class UserExceptionnalMovementCreateTests(BaseFocusUserViewsTestCase):
     url_view = 'url_user_exceptionnalmovement_create'
 
@@ -106,6 +156,39 @@ class RechargingRetrieveTests(BaseFinancesViewsTestCase):
             self.get_url(self.recharging1.pk)))
 
 
+class LydiaReconciliationTests(GeneralFinancesViewsTests):
+    url_view = 'url_lydia_reconciliation'
+
+    def test_allowed_user_get(self):
+        super().allowed_user_get()
+
+    def test_not_allowed_user_get(self):
+        super().not_allowed_user_get()
+
+    def test_offline_user_redirection(self):
+        super().offline_user_redirection()
+
+    def test_post(self):
+        Lydia.objects.create(sender=self.user2, amount=10, id_from_lydia='transaction1',
+                             date_operation=datetime.date(2026, 1, 5))
+        statement = SimpleUploadedFile(
+            'statement.csv', 'identifiant;montant\ntransaction1;10,00\ntransaction2;5,00\n'.encode())
+        response = self.client1.post(self.get_url(), {
+            'statement': statement, 'date_begin': '01/01/2026', 'date_end': '31/01/2026'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['report']['matched'], 1)
+        self.assertEqual([missing['transaction_identifier'] for missing in response.context['report']['missing_credits']],
+                         ['transaction2'])
+
+    def test_post_invalid_statement(self):
+        statement = SimpleUploadedFile('statement.csv', 'date;montant\n01/01/2026;10\n'.encode())
+        response = self.client1.post(self.get_url(), {
+            'statement': statement, 'date_begin': '01/01/2026', 'date_end': '31/01/2026'})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('report', response.context)
+        self.assertTrue(response.context['form'].errors['statement'])
+
+
 class TransfertCreateTests(GeneralFinancesViewsTests):
     url_view = 'url_transfert_create'
 
@@ -219,3 +302,82 @@ class ExceptionnalMovementRetrieveTests(BaseFinancesViewsTestCase):
         self.assertEqual(response_offline_user.status_code, 302)
         self.assertRedirects(response_offline_user, get_login_url_redirected(
             self.get_url(self.movement1.pk)))
+
+
+class FakeLydiaServer:
+    """
+    Stand-in for Lydia, sending signed callbacks of payments to Borgia.
+    """
+
+    def __init__(self, token, client=None):
+        self.token = token
+        self.client = client or Client()
+
+    def send(self, user_pk, amount, transaction_identifier, token=None):
+        data = {
+            'currency': 'EUR',
+            'request_id': transaction_identifier,
+            'amount': amount,
+            'signed': '0',
+            'transaction_identifier': transaction_identifier,
+            'vendor_token': 'vendor',
+        }
+        data['sig'] = sign_lydia_params(data, token or self.token)
+        return self.client.post(
+            reverse('url_self_lydia_callback') + '?user_pk=' + str(user_pk), data)
+
+    def replay(self, payments, times):
+        """
+        Send each payment several times, shuffled, as a provider retrying
+        its callbacks.
+
+        :param payments: list of (user_pk, amount, transaction_identifier).
+        """
+        callbacks = list(payments) * times
+        random.Random(53).shuffle(callbacks)
+        return [self.send(*callback) for callback in callbacks]
+
+
+class SelfLydiaCallbackTests(BaseFinancesViewsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.lydia_server = FakeLydiaServer(configuration_get('API_TOKEN_LYDIA').get_value())
+
+    def test_recorded(self):
+        response = self.lydia_server.send(self.user1.pk, '10.00', 'transaction1')
+        self.assertEqual(response.status_code, 200)
+        callback = LydiaCallback.objects.get(transaction_identifier='transaction1')
+        self.assertEqual((callback.user_pk, callback.amount), (str(self.user1.pk), '10.00'))
+        self.assertIsNone(callback.date_processed)
+        # Credited by the processing only.
+        self.user1.refresh_from_db()
+        self.assertEqual(self.user1.balance, 53)
+
+    def test_wrong_signature(self):
+        response = self.lydia_server.send(self.user1.pk, '10.00', 'transaction1', token='wrong')
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(LydiaCallback.objects.exists())
+
+    def test_replayed(self):
+        payments = [(self.user1.pk if i % 2 else self.user2.pk, '%d.00' % (i + 1), 'transaction' + str(i))
+                    for i in range(50)]
+        responses = self.lydia_server.replay(payments, 3)
+        self.assertEqual({response.status_code for response in responses}, {200})
+        self.assertEqual(LydiaCallback.objects.count(), 50)
+
+        while process_lydia_callbacks(batch_size=20):
+            pass
+        self.user1.refresh_from_db()
+        self.user2.refresh_from_db()
+        self.assertEqual(self.user1.balance, 53 + sum(range(2, 51, 2)))
+        self.assertEqual(self.user2.balance, 144 + sum(range(1, 51, 2)))
+        self.assertEqual(Lydia.objects.count(), 50)
+
+    def test_confirm_credits_user(self):
+        self.lydia_server.send(self.user1.pk, '10.00', 'transaction1')
+        self.lydia_server.send(self.user2.pk, '10.00', 'transaction2')
+        response = self.client1.get(reverse('url_self_lydia_confirm'))
+        self.assertEqual(response.status_code, 200)
+        self.user1.refresh_from_db()
+        self.assertEqual(self.user1.balance, decimal.Decimal('63.00'))
+        self.assertTrue(LydiaCallback.objects.get(transaction_identifier='transaction2').date_processed is None)
@@ -1,12 +1,13 @@
 from django.urls import include, path
 
 from finances.views import (ExceptionnalMovementList,
-                            ExceptionnalMovementRetrieve, RechargingCreate,
-                            RechargingList, RechargingRetrieve,
+                            ExceptionnalMovementRetrieve, LydiaReconciliation,
+                            RechargingCreate, RechargingList,
+                            RechargingRetrieve,
                             SelfLydiaConfirm, SelfLydiaCreate,
                             SelfTransactionList, TransfertCreate,
                             TransfertList, TransfertRetrieve,
-                            UserExceptionnalMovementCreate,
+                            TreasuryReport, UserExceptionnalMovementCreate,
                             self_lydia_callback)
 
 finances_patterns = [
@@ -48,7 +49,12 @@ finances_patterns = [
             path('create/', SelfLydiaCreate.as_view(),
                  name='url_self_lydia_create'),
             path('confirm/', SelfLydiaConfirm.as_view(),
-                 name='url_self_lydia_confirm')
-        ]))
+                 name='url_self_lydia_confirm'),
+            path('reconciliation/', LydiaReconciliation.as_view(),
+                 name='url_lydia_reconciliation')
+        ])),
+        # Treasury
+        path('treasury/', TreasuryReport.as_view(),
+             name='url_treasury_report')
     ]))
 ]
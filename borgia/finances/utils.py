@@ -1,7 +1,65 @@
+import collections
+import csv
+import datetime
 import decimal
 import hashlib
+import io
+import itertools
+import json
 import operator
 
+import openpyxl
+from django.contrib.contenttypes.models import ContentType
+from django.db import IntegrityError, transaction
+from django.db.models import (Count, DateField, DecimalField, F, OuterRef,
+                              Prefetch, Q, Subquery, Sum, Value)
+from django.db.models.functions import TruncMonth
+from django.utils.timezone import localdate, make_aware, now
+
+from configurations.utils import configuration_get
+from events.models import Event, WeightsUser
+from finances.models import (Cash, Cheque, ExceptionnalMovement, Lydia,
+                             LydiaCallback, Recharging, Transfert,
+                             TreasuryPeriod, TreasuryRechargingSnapshot,
+                             TreasuryShopSnapshot)
+from sales.models import SaleDailyRollup, SaleProduct
+from users.models import User
+
+LYDIA_CALLBACKS_BATCH_SIZE = 100
+
+# Accepted headers of the columns of a Lydia statement, lowercase.
+LYDIA_STATEMENT_COLUMNS = {
+    'transaction_identifier': ('transaction_identifier', 'identifiant', 'transaction', 'numéro', 'id'),
+    'amount': ('amount', 'montant'),
+    'fee': ('fee', 'frais'),
+}
+# Number of transaction ids per query when looking up outside the period.
+LYDIA_RECONCILIATION_CHUNK_SIZE = 500
+
+# Recipient of the event payments, see events.views.EventFinishView
+ASSOCIATION_USER_PK = 1
+TREASURY_SOLUTIONS = (('cash', Cash, 'Espèces'), ('cheque', Cheque, 'Chèques'), ('lydia', Lydia, 'Lydia'))
+BALANCE_AUDIT_JUSTIFICATION = 'Régularisation suite à l\'audit des soldes'
+
+
+def sign_lydia_params(params, token):
+    """
+    Return the signatory of parameters according to Lydia's algorithm.
+
+    :param params: all parameters, without sig, mandatory.
+    :type params: python dictionary
+    :param token: private token of the association, mandatory.
+    :type token: string
+    :rtype: string
+    """
+    h_sig_table = []
+    sorted_params = sorted(params.items(), key=operator.itemgetter(0))
+    for param in sorted_params:
+        h_sig_table.append(param[0] + '=' + param[1])
+    h_sig = '&'.join(h_sig_table)
+    h_sig += '&' + token
+    return hashlib.md5(h_sig.encode()).hexdigest()
+
 
 def verify_token_lydia(params, token):
     """
@@ -24,14 +82,7 @@ def verify_token_lydia(params, token):
     try:
         sig = params['sig']
         del params['sig']
-        h_sig_table = []
-        sorted_params = sorted(params.items(), key=operator.itemgetter(0))
-        for param in sorted_params:
-            h_sig_table.append(param[0] + '=' + param[1])
-        h_sig = '&'.join(h_sig_table)
-        h_sig += '&' + token
-        h_sig_hash = hashlib.md5(h_sig.encode())
-        return h_sig_hash.hexdigest() == sig
+        return sign_lydia_params(params, token) == sig
 
     except KeyError:
         return False
@@ -56,3 +107,633 @@ def calculate_lydia_fee_from_total(total_amount, base_fee, ratio_fee, tax_fee=1)
         tax_fee * (base_fee + ratio_fee / 100 * total_amount)
     ).quantize(decimal.Decimal('0.0001')).quantize(decimal.Decimal('.01'), decimal.ROUND_UP)
     # rounded to up. First round to 0.0001 is to remove float imprecision error, which lead 0.200000000001 to round to 0.21 instead of 0.20
+
+
+def record_lydia_callback(params, user_pk):
+    """
+    Record a callback from Lydia, to be processed by process_lydia_callbacks.
+
+    :param params: parameters of the callback, already verified.
+    :param user_pk: pk of the user to credit.
+    :returns: True if recorded, False if the transaction was already.
+    :rtype: Boolean
+    """
+    try:
+        with transaction.atomic():
+            LydiaCallback.objects.create(
+                transaction_identifier=params['transaction_identifier'],
+                user_pk=user_pk or '',
+                amount=params['amount'] or '',
+                params=json.dumps(params)
+            )
+    except IntegrityError:
+        return False
+    return True
+
+
+def get_lydia_fee_configuration():
+    """
+    Return the fee configuration of Lydia: base fee, ratio fee and tax fee,
+    None if fees are disabled.
+    """
+    if not configuration_get('ENABLE_FEE_LYDIA').get_value():
+        return None
+    return tuple(
+        decimal.Decimal(configuration_get(name).get_value()).quantize(decimal.Decimal('.01'))
+        for name in ('BASE_FEE_LYDIA', 'RATIO_FEE_LYDIA', 'TAX_FEE_LYDIA'))
+
+
+def process_lydia_callbacks(user_pk=None, batch_size=LYDIA_CALLBACKS_BATCH_SIZE):
+    """
+    Apply a batch of pending Lydia callbacks, oldest first: create the Lydia
+    and Recharging, and credit the users.
+
+    The configuration is read once per batch, and each user is credited with a
+    single update. Callbacks with an unknown user or an invalid amount are
+    marked as processed, with an error.
+
+    :param user_pk: process only the callbacks of this user.
+    :param batch_size: maximum number of callbacks processed.
+    :returns: number of callbacks processed.
+    :rtype: integer
+    """
+    pending = LydiaCallback.objects.filter(date_processed__isnull=True).order_by('date_received', 'pk')
+    if user_pk is not None:
+        pending = pending.filter(user_pk=str(user_pk))
+    callbacks = list(pending[:batch_size])
+    if not callbacks:
+        return 0
+
+    fee_configuration = get_lydia_fee_configuration()
+    users = User.objects.in_bulk([int(callback.user_pk) for callback in callbacks
+                                  if callback.user_pk.isdigit()])
+
+    processed = []
+    credits = collections.defaultdict(decimal.Decimal)
+    with transaction.atomic():
+        for callback in callbacks:
+            # Claimed one by one, a callback is applied once even if processed
+            # concurrently by the worker and a request.
+            date_processed = now()
+            if not LydiaCallback.objects.filter(pk=callback.pk, date_processed__isnull=True).update(
+                    date_processed=date_processed):
+                continue
+            callback.date_processed = date_processed
+            processed.append(callback)
+
+            user = users.get(int(callback.user_pk)) if callback.user_pk.isdigit() else None
+            if user is None:
+                callback.error = 'Utilisateur inconnu'
+                continue
+            try:
+                total_amount = decimal.Decimal(callback.amount)
+            except decimal.InvalidOperation:
+                total_amount = None
+            if total_amount is None or not total_amount.is_finite() or total_amount <= 0:
+                callback.error = 'Montant invalide'
+                continue
+
+            if fee_configuration is None:
+                fee = 0
+            else:
+                fee = calculate_lydia_fee_from_total(total_amount, *fee_configuration)
+            callback.lydia = Lydia.objects.create(
+                sender=user,
+                amount=total_amount - fee,
+                id_from_lydia=callback.transaction_identifier,
+                date_operation=localdate(callback.date_received),
+                fee=fee
+            )
+            Recharging.objects.create(
+                datetime=callback.date_received,
+                sender=user,
+                operator=user,
+                content_solution=callback.lydia
+            )
+            credits[user.pk] += callback.lydia.amount
+
+        LydiaCallback.objects.bulk_update(processed, ['lydia', 'error'])
+        for pk, amount in credits.items():
+            User.objects.filter(pk=pk).update(balance=F('balance') + amount)
+    return len(processed)
+
+
+def parse_statement_amount(value):
+    """
+    Return the amount of a cell of a statement, None if empty or invalid.
+    """
+    if value is None:
+        return None
+    if not isinstance(value, (int, float, decimal.Decimal)):
+        value = str(value).replace('€', '').replace(' ', '').replace('\xa0', '').replace(',', '.')
+        if not value:
+            return None
+    try:
+        amount = decimal.Decimal(str(value)).quantize(decimal.Decimal('.01'))
+    except decimal.InvalidOperation:
+        return None
+    return amount if amount.is_finite() else None
+
+
+def read_lydia_statement(statement):
+    """
+    Read a statement exported from Lydia, CSV (separated by ; or ,) or XLSX,
+    row by row without loading it whole.
+
+    The first row gives the columns, see LYDIA_STATEMENT_COLUMNS. The
+    transaction identifier and the amount are mandatory, the fee optional.
+
+    :param statement: uploaded file.
+    :returns: generator of (line, transaction identifier, amount, fee), amount
+    and fee are None if invalid.
+    :raises: ValueError if the file or its columns can't be read.
+    """
+    if statement.name.lower().endswith('.xlsx'):
+        try:
+            sheet = openpyxl.load_workbook(statement, read_only=True).active
+        except Exception:
+            raise ValueError('Le fichier XLSX ne peut pas être lu.')
+        rows = ([cell.value for cell in row] for row in sheet.iter_rows())
+    else:
+        lines = io.TextIOWrapper(statement, encoding='utf-8-sig', errors='replace', newline='')
+        header = next(lines, '')
+        delimiter = ';' if header.count(';') >= header.count(',') else ','
+        rows = csv.reader(itertools.chain([header], lines), delimiter=delimiter)
+
+    header = [str(cell or '').strip().lower() for cell in next(rows, ())]
+    columns = {}
+    for column, names in LYDIA_STATEMENT_COLUMNS.items():
+        for name in names:
+            if name in header:
+                columns[column] = header.index(name)
+                break
+    if 'transaction_identifier' not in columns or 'amount' not in columns:
+        raise ValueError("Les colonnes de l'identifiant et du montant de la transaction sont obligatoires.")
+
+    for line, row in enumerate(rows, 2):
+        def cell(column):
+            index = columns.get(column)
+            return row[index] if index is not None and index < len(row) else None
+
+        transaction_identifier = str(cell('transaction_identifier') or '').strip()
+        if not transaction_identifier:
+            continue
+        if isinstance(cell('transaction_identifier'), float) and cell('transaction_identifier').is_integer():
+            # Numbers read as floats from XLSX.
+            transaction_identifier = str(int(cell('transaction_identifier')))
+        amount = parse_statement_amount(cell('amount'))
+        fee = parse_statement_amount(cell('fee')) if 'fee' in columns else None
+        yield line, transaction_identifier, amount, fee
+
+
+def reconcile_lydia_statement(rows, date_begin, date_end):
+    """
+    Reconcile a Lydia statement against the online Lydia of the period.
+
+    The Lydia of the period are loaded in a single query, keyed by
+    transaction id, and the statement rows are joined one by one against
+    them. Transactions of the statement not found in the period are looked up
+    by chunks, in case they were credited the day before or after.
+
+    :param rows: rows of the statement, see read_lydia_statement.
+    :param date_begin: first day of the period.
+    :param date_end: last day of the period.
+    :returns: report, dict with:
+    - matched: number of transactions of the statement credited as expected,
+    - missing_credits: paid but not credited, with the callback if recorded,
+    - duplicates: transactions present several times,
+    - mismatches: amount or fee different,
+    - not_in_statement: credited but absent from the statement,
+    - orphan_callbacks: callbacks of the period never applied,
+    - invalid_rows: lines of the statement without a valid amount,
+    - statement_total and credited_total: total paid, fee included.
+    """
+    lydias = {}
+    duplicates = []
+    for lydia in Lydia.objects.filter(
+            is_online=True, date_operation__range=(date_begin, date_end)
+    ).values('pk', 'id_from_lydia', 'amount', 'fee', 'date_operation', 'sender__username').iterator():
+        if lydia['id_from_lydia'] in lydias:
+            duplicates.append({'transaction_identifier': lydia['id_from_lydia'], 'source': 'Borgia'})
+        else:
+            lydias[lydia['id_from_lydia']] = lydia
+
+    report = {
+        'matched': 0,
+        'missing_credits': [],
+        'duplicates': duplicates,
+        'mismatches': [],
+        'not_in_statement': [],
+        'orphan_callbacks': [],
+        'invalid_rows': [],
+        'statement_total': decimal.Decimal('0.00'),
+        'credited_total': sum((lydia['amount'] + lydia['fee'] for lydia in lydias.values()),
+                              decimal.Decimal('0.00')),
+    }
+    seen = set()
+    not_found = {}
+
+    def compare(statement_row, lydia):
+        line, transaction_identifier, amount, fee = statement_row
+        if amount != lydia['amount'] + lydia['fee'] or (fee is not None and fee != lydia['fee']):
+            report['mismatches'].append({
+                'transaction_identifier': transaction_identifier, 'line': line,
+                'statement_amount': amount, 'statement_fee': fee,
+                'amount': lydia['amount'] + lydia['fee'], 'fee': lydia['fee'], 'lydia_pk': lydia['pk']})
+        else:
+            report['matched'] += 1
+
+    for statement_row in rows:
+        line, transaction_identifier, amount, fee = statement_row
+        if amount is None:
+            report['invalid_rows'].append(line)
+            continue
+        if transaction_identifier in seen:
+            report['duplicates'].append({'transaction_identifier': transaction_identifier,
+                                         'source': 'Relevé', 'line': line})
+            continue
+        seen.add(transaction_identifier)
+        report['statement_total'] += amount
+
+        lydia = lydias.pop(transaction_identifier, None)
+        if lydia is None:
+            not_found[transaction_identifier] = statement_row
+        else:
+            compare(statement_row, lydia)
+
+    not_found_ids = list(not_found)
+    for i in range(0, len(not_found_ids), LYDIA_RECONCILIATION_CHUNK_SIZE):
+        chunk = not_found_ids[i:i + LYDIA_RECONCILIATION_CHUNK_SIZE]
+        for lydia in Lydia.objects.filter(is_online=True, id_from_lydia__in=chunk).values(
+                'pk', 'id_from_lydia', 'amount', 'fee'):
+            statement_row = not_found.pop(lydia['id_from_lydia'], None)
+            if statement_row is not None:
+                compare(statement_row, lydia)
+
+    # Callbacks recorded but never applied, for the statement or the period.
+    callbacks = LydiaCallback.objects.filter(lydia__isnull=True)
+    missing_ids = list(not_found)
+    missing_callbacks = {}
+    for i in range(0, len(missing_ids), LYDIA_RECONCILIATION_CHUNK_SIZE):
+        missing_callbacks.update(
+            (callback.transaction_identifier, callback) for callback in
+            callbacks.filter(transaction_identifier__in=missing_ids[i:i + LYDIA_RECONCILIATION_CHUNK_SIZE]))
+    for transaction_identifier, (line, _, amount, fee) in not_found.items():
+        report['missing_credits'].append({
+            'transaction_identifier': transaction_identifier, 'line': line, 'amount': amount,
+            'fee': fee, 'callback': missing_callbacks.get(transaction_identifier)})
+
+    report['orphan_callbacks'] = [
+        callback for callback in callbacks.filter(
+            date_received__date__range=(date_begin, date_end)).order_by('date_received')
+        if callback.transaction_identifier not in missing_callbacks]
+    report['not_in_statement'] = sorted(lydias.values(), key=operator.itemgetter('date_operation', 'pk'))
+    return report
+
+
+def get_expected_balances():
+    """
+    Return the balance of every user as computed from the history: sales,
+    rechargings, transferts, exceptionnal movements and paid events.
+
+    Each kind of operation is summed by user with a grouped query, the shares
+    of the events are computed from their weights, as in Event.pay_by_total
+    and Event.pay_by_ponderation.
+
+    :returns: dict of expected balances, by pk of user, for the users with
+    operations only.
+    """
+    expected = collections.defaultdict(decimal.Decimal)
+
+    def add(rows, sign=1):
+        for pk, total in rows:
+            expected[pk] += sign * (total or 0)
+
+    add(SaleProduct.objects.order_by().values_list('sale__sender').annotate(Sum('price')), -1)
+    # The solution of a recharging has the same sender.
+    content_types = ContentType.objects.get_for_models(Cash, Cheque, Lydia)
+    for model, content_type in content_types.items():
+        add(model.objects.filter(pk__in=Recharging.objects.filter(
+            content_type=content_type).values('solution_id')).order_by().values_list(
+                'sender').annotate(Sum('amount')))
+    add(Transfert.objects.order_by().values_list('sender').annotate(Sum('amount')), -1)
+    add(Transfert.objects.order_by().values_list('recipient').annotate(Sum('amount')))
+    for pk, is_credit, total in ExceptionnalMovement.objects.order_by().values_list(
+            'recipient', 'is_credit').annotate(Sum('amount')):
+        expected[pk] += total if is_credit else -total
+
+    events = Event.objects.filter(done=True, price__gt=0).annotate(
+        total_weights=Sum('weightsuser__weights_participation'))
+    prices_per_weight = {}
+    for pk, price, payment_by_ponderation, total_weights in events.values_list(
+            'pk', 'price', 'payment_by_ponderation', 'total_weights'):
+        if payment_by_ponderation:
+            prices_per_weight[pk] = price
+        elif total_weights:
+            prices_per_weight[pk] = round(price / total_weights, 2)
+    shares = WeightsUser.objects.filter(
+        event__in=list(prices_per_weight), weights_participation__gt=0).values_list(
+            'user', 'event', 'weights_participation')
+    for user_pk, event_pk, weight in shares.iterator():
+        share = prices_per_weight[event_pk] * weight
+        expected[user_pk] -= share
+        expected[ASSOCIATION_USER_PK] += share
+    return expected
+
+
+def audit_balances():
+    """
+    Compare the stored balance of every user with the balance expected from
+    the history, see get_expected_balances.
+
+    :returns: list of dicts, for the users with a difference: pk, username,
+    balance (stored), expected and difference (stored - expected), by pk.
+    """
+    expected = get_expected_balances()
+    discrepancies = []
+    for pk, username, balance in User.objects.order_by('pk').values_list(
+            'pk', 'username', 'balance').iterator():
+        expected_balance = round(expected.get(pk, decimal.Decimal(0)), 2)
+        if balance != expected_balance:
+            discrepancies.append({
+                'pk': pk,
+                'username': username,
+                'balance': balance,
+                'expected': expected_balance,
+                'difference': balance - expected_balance
+            })
+    return discrepancies
+
+
+def correct_balance_discrepancies(discrepancies, operator):
+    """
+    Record an exceptionnal movement for each discrepancy, so that the history
+    matches the stored balances, in a single transaction.
+
+    The balances aren't changed, the movements aren't paid.
+
+    :param discrepancies: see audit_balances.
+    :param operator: User, operator of the movements.
+    :returns: the movements created.
+    """
+    date = now()
+    with transaction.atomic():
+        return ExceptionnalMovement.objects.bulk_create(
+            ExceptionnalMovement(
+                datetime=date,
+                justification=BALANCE_AUDIT_JUSTIFICATION,
+                operator=operator,
+                recipient_id=discrepancy['pk'],
+                amount=abs(discrepancy['difference']),
+                is_credit=discrepancy['difference'] > 0)
+            for discrepancy in discrepancies)
+
+
+def get_paid_exceptionnal_movements():
+    """
+    Return the exceptionnal movements which changed the balances: all but
+    those of correct_balance_discrepancies, which aren't paid.
+    """
+    return ExceptionnalMovement.objects.exclude(justification=BALANCE_AUDIT_JUSTIFICATION)
+
+
+def get_month_bounds(month):
+    """
+    Return the beginning of the month and of the next month, in local time.
+
+    :param month: date, of any day of the month.
+    :returns: (first day, first day of the next month, beginning datetime,
+    end datetime excluded).
+    """
+    month = month.replace(day=1)
+    next_month = (month + datetime.timedelta(days=31)).replace(day=1)
+    return (month, next_month,
+            make_aware(datetime.datetime.combine(month, datetime.time.min)),
+            make_aware(datetime.datetime.combine(next_month, datetime.time.min)))
+
+
+def get_rechargings_by_month(datetime_begin, datetime_end=None):
+    """
+    Return the rechargings since datetime_begin, and before datetime_end, by
+    month and solution, with a grouped query per solution.
+
+    :returns: dict, by first day of month, of lists of dicts: solution,
+    label, amount, fee and count, for every solution.
+    """
+    content_types = ContentType.objects.get_for_models(*[model for _, model, _ in TREASURY_SOLUTIONS])
+    rechargings = Recharging.objects.filter(datetime__gte=datetime_begin)
+    if datetime_end is not None:
+        rechargings = rechargings.filter(datetime__lt=datetime_end)
+
+    by_month = collections.defaultdict(lambda: [
+        {'solution': solution, 'label': label, 'amount': 0, 'fee': 0, 'count': 0}
+        for solution, _, label in TREASURY_SOLUTIONS])
+    for i, (solution, model, label) in enumerate(TREASURY_SOLUTIONS):
+        solutions = model.objects.filter(pk=OuterRef('solution_id'))
+        rows = rechargings.filter(content_type=content_types[model]).annotate(
+            solution_amount=Subquery(solutions.values('amount')[:1]),
+            solution_fee=(Subquery(solutions.values('fee')[:1]) if model is Lydia else Value(0, DecimalField())),
+            month=TruncMonth('datetime', output_field=DateField())
+        ).order_by().values('month').annotate(
+            amount=Sum('solution_amount'), fee=Sum('solution_fee'), count=Count('pk'))
+        for row in rows:
+            by_month[row['month']][i].update(amount=row['amount'] or 0, fee=row['fee'] or 0, count=row['count'])
+    return by_month
+
+
+def get_balances_total_at(datetime_end):
+    """
+    Return the sum of the balances of the users at the given date, from the
+    current sum and the operations since.
+
+    Transferts and events move money between users, only the rechargings,
+    paid exceptionnal movements and sales change the sum. The sales are read
+    from the daily rollups, datetime_end must be a local midnight.
+    """
+    balances_total = User.objects.aggregate(total=Sum('balance'))['total'] or 0
+    if datetime_end > now():
+        return balances_total
+
+    rechargings = sum(solution['amount'] for solutions in get_rechargings_by_month(datetime_end).values()
+                      for solution in solutions)
+    movements = get_paid_exceptionnal_movements().filter(datetime__gte=datetime_end).aggregate(
+        credits=Sum('amount', filter=Q(is_credit=True)), debits=Sum('amount', filter=Q(is_credit=False)))
+    sales = SaleDailyRollup.objects.filter(
+        product__isnull=True, date__gte=localdate(datetime_end)).aggregate(total=Sum('revenue'))['total']
+    return (balances_total - rechargings - (movements['credits'] or 0) + (movements['debits'] or 0)
+            + (sales or 0))
+
+
+def compute_treasury_figures(months):
+    """
+    Return the figures of the months, computed from the operations: the
+    rechargings by solution, the sales by shop (from the daily rollups), the
+    transferts, exceptionnal movements and events paid, and the sum of the
+    balances at the end of the month.
+
+    The corrections of the balance audit aren't paid, they are left out of
+    the exceptionnal movements.
+
+    Each kind of operation is read with a single query grouped by month,
+    whatever the number of months.
+
+    :param months: list of dates, first days of the months.
+    :returns: dict of figures by month, as returned by get_treasury_report.
+    """
+    months = sorted(months)
+    datetime_begin = get_month_bounds(months[0])[2]
+    datetime_end = get_month_bounds(months[-1])[3]
+    in_range = {'datetime__gte': datetime_begin, 'datetime__lt': datetime_end}
+    by_month = TruncMonth('datetime', output_field=DateField())
+
+    figures = {month: {
+        'month': month,
+        'period': None,
+        'shops': [],
+        'transferts_amount': 0,
+        'transferts_count': 0,
+        'exceptionnal_credits': 0,
+        'exceptionnal_debits': 0,
+        'exceptionnal_count': 0,
+        'events_amount': 0,
+        'events_count': 0
+    } for month in months}
+    rechargings = get_rechargings_by_month(datetime_begin, datetime_end)
+    for month in months:
+        figures[month]['rechargings'] = rechargings[month]
+
+    for row in SaleDailyRollup.objects.filter(
+            product__isnull=True, date__gte=months[0], date__lt=localdate(datetime_end)
+    ).annotate(month=TruncMonth('date')).order_by('shop__name').values('month', 'shop', 'shop__name').annotate(
+            total_revenue=Sum('revenue'), total_sale_count=Sum('sale_count')):
+        if row['month'] in figures:
+            figures[row['month']]['shops'].append({
+                'shop': row['shop'], 'shop_name': row['shop__name'],
+                'revenue': row['total_revenue'], 'sale_count': row['total_sale_count']})
+    for row in Transfert.objects.filter(**in_range).annotate(month=by_month).order_by().values(
+            'month').annotate(amount=Sum('amount'), count=Count('pk')):
+        if row['month'] in figures:
+            figures[row['month']].update(transferts_amount=row['amount'], transferts_count=row['count'])
+    for row in get_paid_exceptionnal_movements().filter(**in_range).annotate(month=by_month).order_by().values(
+            'month').annotate(credits=Sum('amount', filter=Q(is_credit=True)),
+                              debits=Sum('amount', filter=Q(is_credit=False)), count=Count('pk')):
+        if row['month'] in figures:
+            figures[row['month']].update(exceptionnal_credits=row['credits'] or 0,
+                                         exceptionnal_debits=row['debits'] or 0,
+                                         exceptionnal_count=row['count'])
+
+    # Same computation as Event.pay_by_total and Event.pay_by_ponderation
+    for month, price, payment_by_ponderation, total_weights in Event.objects.filter(
+            done=True, price__gt=0, **in_range).annotate(
+                month=by_month, total_weights=Sum('weightsuser__weights_participation')).values_list(
+                    'month', 'price', 'payment_by_ponderation', 'total_weights'):
+        if not total_weights or month not in figures:
+            continue
+        if payment_by_ponderation:
+            figures[month]['events_amount'] += price * total_weights
+        else:
+            figures[month]['events_amount'] += round(price / total_weights, 2) * total_weights
+        figures[month]['events_count'] += 1
+
+    for month in months:
+        get_treasury_figures_totals(figures[month])
+
+    # The sum of the balances at the end of a month is the one at the end of
+    # the next month, without the operations of the next month.
+    next_figures = None
+    for month in reversed(months):
+        month_end = get_month_bounds(month)[3]
+        if next_figures is not None and next_figures['month'] == localdate(month_end):
+            figures[month]['balances_total'] = (
+                next_figures['balances_total'] - next_figures['rechargings_total']
+                - next_figures['exceptionnal_credits'] + next_figures['exceptionnal_debits']
+                + next_figures['sales_total'])
+        else:
+            figures[month]['balances_total'] = get_balances_total_at(month_end)
+        next_figures = figures[month]
+    return figures
+
+
+def get_treasury_figures_totals(figures):
+    """
+    Add the totals of the rechargings, Lydia fees and sales to the figures.
+    """
+    figures['rechargings_total'] = sum(solution['amount'] for solution in figures['rechargings'])
+    figures['fees_total'] = sum(solution['fee'] for solution in figures['rechargings'])
+    figures['sales_total'] = sum(shop['revenue'] for shop in figures['shops'])
+    return figures
+
+
+def get_period_figures(period):
+    """
+    Return the figures frozen in a closed period, see compute_treasury_figures.
+    """
+    labels = {solution: label for solution, _, label in TREASURY_SOLUTIONS}
+    figures = {field: getattr(period, field) for field in (
+        'month', 'transferts_amount', 'transferts_count', 'exceptionnal_credits', 'exceptionnal_debits',
+        'exceptionnal_count', 'events_amount', 'events_count', 'balances_total')}
+    figures['period'] = period
+    figures['rechargings'] = [{'solution': snapshot.solution, 'label': labels.get(snapshot.solution, snapshot.solution),
+                               'amount': snapshot.amount, 'fee': snapshot.fee, 'count': snapshot.count}
+                              for snapshot in period.rechargings.all()]
+    figures['shops'] = [{'shop': snapshot.shop_id, 'shop_name': snapshot.shop_name,
+                         'revenue': snapshot.revenue, 'sale_count': snapshot.sale_count}
+                        for snapshot in period.shops.all()]
+    return get_treasury_figures_totals(figures)
+
+
+def close_treasury_period(month, operator=None):
+    """
+    Freeze the figures of an ended month in the snapshot tables, in a single
+    transaction.
+
+    :param month: date, of any day of the month.
+    :param operator: User closing the month.
+    :returns: the TreasuryPeriod.
+    :raise: ValueError if the month isn't ended or is already closed.
+    """
+    month = month.replace(day=1)
+    if get_month_bounds(month)[1] > localdate():
+        raise ValueError('Le mois n\'est pas terminé.')
+    if TreasuryPeriod.objects.filter(month=month).exists():
+        raise ValueError('Le mois est déjà clôturé.')
+
+    figures = compute_treasury_figures([month])[month]
+    try:
+        with transaction.atomic():
+            period = TreasuryPeriod.objects.create(
+                month=month, operator=operator,
+                **{field: figures[field] for field in (
+                    'transferts_amount', 'transferts_count', 'exceptionnal_credits', 'exceptionnal_debits',
+                    'exceptionnal_count', 'events_amount', 'events_count', 'balances_total')})
+            TreasuryRechargingSnapshot.objects.bulk_create(
+                TreasuryRechargingSnapshot(period=period, solution=solution['solution'], amount=solution['amount'],
+                                           fee=solution['fee'], count=solution['count'])
+                for solution in figures['rechargings'])
+            TreasuryShopSnapshot.objects.bulk_create(
+                TreasuryShopSnapshot(period=period, shop_id=shop['shop'], shop_name=shop['shop_name'],
+                                     revenue=shop['revenue'], sale_count=shop['sale_count'])
+                for shop in figures['shops'])
+    except IntegrityError:
+        # Closed in between
+        raise ValueError('Le mois est déjà clôturé.')
+    return period
+
+
+def get_treasury_report(months):
+    """
+    Return the figures of the months: read from the snapshots for the closed
+    ones, computed from the operations for the others.
+
+    :param months: list of dates, first days of the months.
+    :returns: list of dicts, by month, see compute_treasury_figures, period
+    being the TreasuryPeriod of the closed months.
+    """
+    periods = {period.month: period for period in TreasuryPeriod.objects.filter(
+        month__in=months).select_related('operator').prefetch_related(
+            Prefetch('rechargings', queryset=TreasuryRechargingSnapshot.objects.order_by('pk')),
+            Prefetch('shops', queryset=TreasuryShopSnapshot.objects.order_by('shop_name')))}
+    open_months = [month for month in months if month not in periods]
+    figures = compute_treasury_figures(open_months) if open_months else {}
+    return [get_period_figures(periods[month]) if month in periods else figures[month]
+            for month in months]
@@ -7,28 +7,31 @@ from django.contrib.auth.mixins import (LoginRequiredMixin,
                                         PermissionRequiredMixin)
 from django.core.exceptions import ObjectDoesNotExist, PermissionDenied
 from django.db.models import Q
-from django.http import Http404
+from django.http import Http404, HttpResponseForbidden
 from django.shortcuts import HttpResponse, render
 from django.urls import reverse
-from django.utils.timezone import now
+from django.utils.timezone import localdate, now
 from django.views.decorators.csrf import csrf_exempt
 
+from borgia.mixins import ReplicaReadMixin
 from borgia.views import BorgiaFormView, BorgiaView
 from configurations.utils import configuration_get
 from finances.forms import (ExceptionnalMovementForm,
-                            GenericListSearchDateForm, RechargingCreateForm,
-                            RechargingListForm, SelfLydiaCreateForm,
-                            TransfertCreateForm)
+                            GenericListSearchDateForm, LydiaReconciliationForm,
+                            RechargingCreateForm, RechargingListForm,
+                            SelfLydiaCreateForm, TransfertCreateForm,
+                            TreasuryPeriodCloseForm)
 from finances.models import (Cash, Cheque, ExceptionnalMovement, Lydia,
                              Recharging, Transfert)
-from finances.utils import (verify_token_lydia, 
-                            calculate_lydia_fee_from_total,
-                            calculate_total_amount_lydia)
+from finances.utils import (calculate_total_amount_lydia,
+                            close_treasury_period, get_month_bounds,
+                            get_treasury_report, process_lydia_callbacks,
+                            read_lydia_statement, reconcile_lydia_statement,
+                            record_lydia_callback, verify_token_lydia)
 from users.mixins import UserMixin
-from users.models import User
 
 
-class RechargingList(LoginRequiredMixin, PermissionRequiredMixin, BorgiaFormView):
+class RechargingList(ReplicaReadMixin, LoginRequiredMixin, PermissionRequiredMixin, BorgiaFormView):
     """
     View to list recharging sales.
 
@@ -37,6 +40,8 @@ class RechargingList(LoginRequiredMixin, PermissionRequiredMixin, BorgiaFormView
     transactions, please refer to other classes (SaleList, TransfertList and
     ExceptionnalMovementList).
     """
+    # The search form only reads.
+    replica_methods = ('GET', 'HEAD', 'POST')
     permission_required = 'finances.view_recharging'
     menu_type = 'managers'
     template_name = 'finances/recharging_list.html'
@@ -196,7 +201,7 @@ class RechargingRetrieve(LoginRequiredMixin, PermissionRequiredMixin, BorgiaView
         return render(request, self.template_name, context=context)
 
 
-class TransfertList(LoginRequiredMixin, PermissionRequiredMixin, BorgiaFormView):
+class TransfertList(ReplicaReadMixin, LoginRequiredMixin, PermissionRequiredMixin, BorgiaFormView):
     """
     View to list transfert sales.
 
@@ -205,6 +210,8 @@ class TransfertList(LoginRequiredMixin, PermissionRequiredMixin, BorgiaFormView)
     transactions, please refer to other classes (SaleList, RechargingList and
     ExceptionnalMovementList).
     """
+    # The search form only reads.
+    replica_methods = ('GET', 'HEAD', 'POST')
     permission_required = 'finances.view_transfert'
     menu_type = 'managers'
     template_name = 'finances/transfert_list.html'
@@ -335,7 +342,7 @@ class TransfertCreate(LoginRequiredMixin, PermissionRequiredMixin, BorgiaFormVie
         return reverse('url_members_workboard')
 
 
-class ExceptionnalMovementList(LoginRequiredMixin, PermissionRequiredMixin, BorgiaFormView):
+class ExceptionnalMovementList(ReplicaReadMixin, LoginRequiredMixin, PermissionRequiredMixin, BorgiaFormView):
     """
     View to list exceptionnal movement sales.
 
@@ -346,6 +353,8 @@ class ExceptionnalMovementList(LoginRequiredMixin, PermissionRequiredMixin, Borg
     SaleList).
 
     """
+    # The search form only reads.
+    replica_methods = ('GET', 'HEAD', 'POST')
     permission_required = 'finances.view_exceptionnalmovement'
     menu_type = 'managers'
     template_name = 'finances/exceptionnalmovement_list.html'
@@ -397,6 +406,86 @@ class ExceptionnalMovementList(LoginRequiredMixin, PermissionRequiredMixin, Borg
         return self.get(self.request, self.args, self.kwargs)
 
 
+class LydiaReconciliation(LoginRequiredMixin, PermissionRequiredMixin, BorgiaFormView):
+    """
+    View to reconcile the online Lydia of a period against the statement
+    exported from Lydia.
+
+    The report lists the payments not credited, the duplicates, the amounts or
+    fees differing, the credits absent from the statement and the callbacks
+    never applied.
+    """
+    permission_required = 'finances.view_recharging'
+    menu_type = 'managers'
+    template_name = 'finances/lydia_reconciliation.html'
+    form_class = LydiaReconciliationForm
+    lm_active = 'lm_lydia_reconciliation'
+
+    def form_valid(self, form):
+        try:
+            report = reconcile_lydia_statement(
+                read_lydia_statement(form.cleaned_data['statement']),
+                form.cleaned_data['date_begin'], form.cleaned_data['date_end'])
+        except ValueError as error:
+            form.add_error('statement', str(error))
+            return self.form_invalid(form)
+        return self.render_to_response(self.get_context_data(form=form, report=report))
+
+
+class TreasuryReport(ReplicaReadMixin, LoginRequiredMixin, PermissionRequiredMixin, BorgiaFormView):
+    """
+    View of the treasury figures of the last months, and to close the ended
+    months.
+
+    Closed months are read from their snapshots, the others are computed from
+    the operations.
+    """
+    permission_required = 'finances.view_treasuryperiod'
+    menu_type = 'managers'
+    template_name = 'finances/treasury_report.html'
+    form_class = TreasuryPeriodCloseForm
+    lm_active = 'lm_treasury_report'
+    success_message = 'Le mois a bien été clôturé'
+    months_number = 12
+
+    def __init__(self):
+        super().__init__()
+        self.report = None
+
+    def get_report(self):
+        if self.report is None:
+            months = [localdate().replace(day=1)]
+            while len(months) < self.months_number:
+                months.append((months[-1] - datetime.timedelta(days=1)).replace(day=1))
+            self.report = get_treasury_report(months)
+        return self.report
+
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        kwargs['months'] = [figures['month'] for figures in self.get_report()
+                            if figures['period'] is None and get_month_bounds(figures['month'])[1] <= localdate()]
+        return kwargs
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['report'] = self.get_report()
+        context['can_close'] = self.request.user.has_perm('finances.add_treasuryperiod')
+        return context
+
+    def form_valid(self, form):
+        if not self.request.user.has_perm('finances.add_treasuryperiod'):
+            raise PermissionDenied
+        try:
+            close_treasury_period(form.cleaned_data['month'], self.request.user)
+        except ValueError as error:
+            form.add_error('month', str(error))
+            return self.form_invalid(form)
+        return super().form_valid(form)
+
+    def get_success_url(self):
+        return reverse('url_treasury_report')
+
+
 class ExceptionnalMovementRetrieve(LoginRequiredMixin, PermissionRequiredMixin, BorgiaView):
     """
     Retrieve an exceptionnal movement sale.
@@ -726,6 +815,9 @@ class SelfLydiaConfirm(LoginRequiredMixin, BorgiaView):
     # TODO: check if a Lydia object exist and if it's from the current day,
     # else raise Error
     def get(self, request, *args, **kwargs):
+        # The payment of the user is credited now if the callback is already
+        # received, without waiting for the worker.
+        process_lydia_callbacks(user_pk=request.user.pk)
         context = super().get_context_data()
         context['transaction'] = self.request.GET.get('transaction')
         context['order'] = self.request.GET.get('order_ref')
@@ -737,8 +829,9 @@ def self_lydia_callback(request):
     """
     Function to catch the callback from Lydia after a payment.
 
-    Create all objects needed to have a proper sale in the database, and credit
-    the client.
+    The callback is recorded, to be processed by process_lydia_callbacks
+    which creates the Lydia and the Recharging and credits the client. A
+    callback sent again for the same transaction is recorded once.
 
     :param GET['user_pk']: pk of the client, mandatory.
     :param POST['currency']: icon of the currency, for instance EUR, mandatory.
@@ -763,10 +856,8 @@ def self_lydia_callback(request):
     they are mandatory because used to generated the signatory and verify the
     transaction.
 
-    :raises: PermissionDenied if signatory generated is not sig.
-    :returns: 300 if the user_pk doesn't match an user.
-    :returns: 300 if a parameter is missing.
-    :returns: 200 if all's good.
+    :returns: 403 if signatory generated is not sig.
+    :returns: 200 if the callback is recorded, or was already.
     :rtype: Http request
     """
     params_dict = {
@@ -780,43 +871,8 @@ def self_lydia_callback(request):
     }
     lydia_token = configuration_get("API_TOKEN_LYDIA").get_value()
 
-    if verify_token_lydia(params_dict, lydia_token) is False:
-        raise PermissionDenied
-    else:
-        try:
-            user_pk = request.GET.get('user_pk')
-        except KeyError:
-            return PermissionDenied
-
-        try:
-            user = User.objects.get(pk=user_pk)
-        except ObjectDoesNotExist:
-            raise Http404
-
-        total_amount = decimal.Decimal(params_dict['amount'])
-        if not configuration_get('ENABLE_FEE_LYDIA').get_value():
-            fee = 0
-            recharging_amount = total_amount
-        else:
-            base_fee = decimal.Decimal(configuration_get('BASE_FEE_LYDIA').get_value()).quantize(decimal.Decimal('.01'))
-            ratio_fee = decimal.Decimal(configuration_get('RATIO_FEE_LYDIA').get_value()).quantize(decimal.Decimal('.01'))
-            tax_fee = decimal.Decimal(configuration_get('TAX_FEE_LYDIA').get_value()).quantize(decimal.Decimal('.01'))
-
-            fee = calculate_lydia_fee_from_total(
-                total_amount, base_fee, ratio_fee, tax_fee)
-            recharging_amount = total_amount - fee
-
-        lydia = Lydia.objects.create(
-            sender=user,
-            amount=recharging_amount,
-            id_from_lydia=params_dict['transaction_identifier'],
-            fee=fee
-        )
-        recharging = Recharging.objects.create(
-            sender=user,
-            operator=user,
-            content_solution=lydia
-        )
-        recharging.pay()
+    if verify_token_lydia(dict(params_dict), lydia_token) is False:
+        return HttpResponseForbidden()
 
-        return HttpResponse('200')
+    record_lydia_callback(params_dict, request.GET.get('user_pk'))
+    return HttpResponse('200')
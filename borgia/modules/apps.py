@@ -3,3 +3,8 @@ from django.apps import AppConfig
 
 class ModulesConfig(AppConfig):
     name = 'modules'
+
+    def ready(self):
+        # Import module signals
+        from modules.signals import (bump_modules_version,
+                                     invalidate_module_directory_on_change)
@@ -1,9 +1,11 @@
+import re
+
 from django import forms
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.validators import MinValueValidator
 
-from modules.models import CategoryProduct
-from shops.models import Product
+from modules.utils import get_sale_category_products
+from shops.utils import get_product_choices
 from users.models import User
 
 
@@ -19,24 +21,36 @@ class ShopModuleSaleForm(forms.Form):
         if self.module_class == 'operator_sales':
             self.fields['client'] = self.get_client_field()
 
-        for category in self.module.categories.all():
-            for category_product in category.categoryproduct_set.all():
-                if (category_product.get_price() > 0 and
-                        not category_product.product.is_removed and
-                        category_product.product.is_active):
-                    self.fields[str(category_product.pk)
-                                + '-' + str(category.pk)
-                                ] = forms.IntegerField(
-                                    label=category_product.__str__(),
-                                    widget=forms.NumberInput(
-                                        attrs={'data_category_pk': category.pk,
-                                               'data_price': category_product.get_price(),
-                                               'class': 'form-control buyable_product',
-                                               'min': 0}),
-                                    initial=0,
-                                    required=False,
-                                    validators=[MinValueValidator(0, """La commande doit être
-                                                                positive ou nulle""")])
+        # Category product and price by field, read by clean and the sale.
+        self.category_products = {}
+        for category, lines in get_sale_category_products(self.module):
+            for category_product, price in lines:
+                field = str(category_product.pk) + '-' + str(category.pk)
+                self.category_products[field] = (category_product, price)
+                self.fields[field] = forms.IntegerField(
+                    label=category_product.__str__(),
+                    widget=forms.NumberInput(
+                        attrs={'data_category_pk': category.pk,
+                               'data_price': price,
+                               'class': 'form-control buyable_product',
+                               'min': 0}),
+                    initial=0,
+                    required=False,
+                    validators=[MinValueValidator(0, """La commande doit être
+                                                positive ou nulle""")])
+
+    def get_basket(self):
+        """
+        Return the products ordered, from the cleaned data.
+
+        :returns: list of (category product, price, invoice).
+        """
+        basket = []
+        for field, (category_product, price) in self.category_products.items():
+            invoice = self.cleaned_data.get(field)
+            if isinstance(invoice, int) and invoice > 0:
+                basket.append((category_product, price, invoice))
+        return basket
 
     def clean(self):
         super().clean()
@@ -50,17 +64,7 @@ class ShopModuleSaleForm(forms.Form):
                 raise forms.ValidationError('Utilisateur non sélectionné')
             if not self.client.is_active:
                 raise forms.ValidationError("L'utilisateur a été desactivé")
-        total_price = 0
-        for field in self.cleaned_data:
-            if field != 'client':
-                invoice = self.cleaned_data[field]
-                if isinstance(invoice, int) and invoice > 0:
-                    try:
-                        category_product_pk = field.split('-')[0]
-                        total_price += (CategoryProduct.objects.get(
-                            pk=category_product_pk).get_price() * invoice)
-                    except ObjectDoesNotExist:
-                        pass
+        total_price = sum(price * invoice for category_product, price, invoice in self.get_basket())
         if (self.client.balance - total_price) < self.balance_threshold_purchase.get_value():
             raise forms.ValidationError('Crédit insuffisant !')
         if self.module.limit_purchase:
@@ -83,21 +87,70 @@ class ShopModuleSaleForm(forms.Form):
                                           'autofocus': 'true',
                                           'placeholder': "Nom d'utilisateur"}))
 
+
+class ShopModuleRoundSaleForm(ShopModuleSaleForm):
+    """
+    Sale of the same products to several clients, by an operator.
+
+    The clients are read with their balance in a single query. A client
+    listed several times gets as many sales.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        del self.fields['client']
+        self.fields['clients'] = forms.CharField(
+            label="Clients",
+            widget=forms.Textarea(attrs={'class': 'form-control',
+                                         'rows': 4,
+                                         'autofocus': 'true',
+                                         'placeholder': "Noms d'utilisateur, séparés par des espaces"}))
+
+    def clean_clients(self):
+        usernames = [username for username in re.split(r'[\s,;]+', self.cleaned_data['clients']) if username]
+        if not usernames:
+            raise forms.ValidationError('Aucun client.')
+        return usernames
+
+    def clean(self):
+        cleaned_data = forms.Form.clean(self)
+        usernames = cleaned_data.get('clients')
+        if not usernames:
+            return cleaned_data
+
+        total_price = sum(price * invoice for category_product, price, invoice in self.get_basket())
+        if total_price <= 0:
+            raise forms.ValidationError('La commande doit être positive.')
+        if self.module.limit_purchase and total_price > self.module.limit_purchase:
+            raise forms.ValidationError('Le montant est supérieur à la limite.')
+
+        clients = User.objects.filter(username__in=set(usernames)).in_bulk(field_name='username')
+        unknown = sorted(set(usernames) - set(clients))
+        if unknown:
+            raise forms.ValidationError("Utilisateurs inexistants : " + ', '.join(unknown))
+        inactive = sorted(username for username, client in clients.items() if not client.is_active)
+        if inactive:
+            raise forms.ValidationError("Utilisateurs désactivés : " + ', '.join(inactive))
+        threshold = self.balance_threshold_purchase.get_value()
+        insufficient = sorted(username for username, client in clients.items()
+                              if client.balance - total_price * usernames.count(username) < threshold)
+        if insufficient:
+            raise forms.ValidationError('Crédit insuffisant : ' + ', '.join(insufficient))
+
+        cleaned_data['clients'] = [clients[username] for username in usernames]
+        return cleaned_data
+
 class ModuleCategoryCreateForm(forms.Form):
     def __init__(self, *args, **kwargs):
         shop = kwargs.pop('shop')
+        # The choices can be given, to be shared by the forms of a formset.
+        product_choices = kwargs.pop('product_choices', None)
         super().__init__(*args, **kwargs)
+        if product_choices is None:
+            product_choices = get_product_choices(shop)
         self.fields['product'] = forms.ChoiceField(
             label='Produit',
-            choices=([(None, 'Sélectionner un produit')] + [
-                (str(product.pk)+'/'+str(product.get_unit_display()),
-                 product.__str__())
-                for product in Product.objects.filter(shop=shop, is_removed=False, is_active=True)
-            ] + [
-                (str(product.pk)+'/'+str(product.get_unit_display()),
-                 product.__str__() + ' DESACTIVE')
-                for product in Product.objects.filter(shop=shop, is_removed=False, is_active=False)
-            ]),
+            choices=[(None, 'Sélectionner un produit')] + product_choices,
             widget=forms.Select(
                 attrs={'class': 'form-control selectpicker',
                        'data-live-search': 'True'})
@@ -0,0 +1,23 @@
+# Generated by Django 2.2.28 on 2026-10-19 00:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('modules', '0002_category_order'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='operatorsalemodule',
+            name='catalog_version',
+            field=models.PositiveIntegerField(default=0, verbose_name='Version du catalogue'),
+        ),
+        migrations.AddField(
+            model_name='selfsalemodule',
+            name='catalog_version',
+            field=models.PositiveIntegerField(default=0, verbose_name='Version du catalogue'),
+        ),
+    ]
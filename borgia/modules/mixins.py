@@ -1,8 +1,14 @@
+from django.contrib.auth.mixins import PermissionRequiredMixin
 from django.core.exceptions import ImproperlyConfigured, ObjectDoesNotExist
+from django.db import transaction
 from django.http import Http404
 
+from configurations.utils import configuration_get
 from modules.models import Category, OperatorSaleModule, SelfSaleModule
+from sales.models import Sale, SaleProduct
+from sales.utils import rollup_sale
 from shops.mixins import ShopMixin
+from users.models import User
 
 
 class ShopModuleMixin(ShopMixin):
@@ -81,6 +87,100 @@ class ShopModuleMixin(ShopMixin):
             )
 
 
+class ShopModuleSaleMixin(ShopModuleMixin):
+    """
+    Mixin for the views selling through a module: the sale page, the catalog
+    and the sale API.
+
+    For Permission :
+    Self sales only need the permission to use the module, operator sales also
+    need to manage the shop. The module must be activated.
+    """
+    permission_required_self = 'modules.use_selfsalemodule'
+    permission_required_operator = 'modules.use_operatorsalemodule'
+
+    def has_permission(self):
+        if self.kwargs['module_class'] == 'self_sales':
+            has_perms = self.has_permission_selfsales()
+        else:
+            has_perms = super().has_permission()
+        if not has_perms:
+            return False
+        else:
+            if self.module.state is False:
+                raise Http404
+            else:
+                return True
+
+    def has_permission_selfsales(self):
+        """
+        Customized permission for self_sale in shops. 
+        The user still need the use_selfsalemodule permission
+        """
+        self.add_context_objects()
+        return PermissionRequiredMixin.has_permission(self)
+
+    def get_sale_form_kwargs(self):
+        """
+        Return the kwargs of ShopModuleSaleForm, except data.
+        """
+        kwargs = {
+            'module_class': self.module_class,
+            'module': self.module,
+            'balance_threshold_purchase': configuration_get('BALANCE_THRESHOLD_PURCHASE')
+        }
+        if self.module_class == "self_sales":
+            kwargs['client'] = self.request.user
+        elif self.module_class == "operator_sales":
+            kwargs['client'] = None
+        else:
+            self.handle_unexpected_module_class()
+        return kwargs
+
+    def create_sale(self, form):
+        """
+        Create a sale from a valid ShopModuleSaleForm and pay it.
+
+        :returns: the sale.
+        """
+        if self.module_class == "self_sales":
+            client = self.request.user
+        elif self.module_class == "operator_sales":
+            client = form.cleaned_data['client']
+        else:
+            self.handle_unexpected_module_class()
+
+        sale_products = []
+        for field, (category_product, price) in form.category_products.items():
+            invoice = form.cleaned_data.get(field)
+            if invoice:
+                sale_products.append(SaleProduct(
+                    product=category_product.product,
+                    quantity=category_product.quantity * invoice,
+                    price=price * invoice
+                ))
+        sale = Sale(
+            operator=self.request.user,
+            sender=client,
+            recipient=User.objects.get(pk=1),
+            module=self.module,
+            shop=self.shop
+        )
+        sale.summarize(sale_products)
+
+        # The sale, its products, the stock counters, the sales rollups and
+        # the balance are updated together.
+        with transaction.atomic():
+            sale.save()
+            for sale_product in sale_products:
+                sale_product.sale = sale
+                # Saved one by one for the stock counters signal.
+                sale_product.save()
+            rollup_sale(sale, sale_products)
+            sale.pay()
+        return sale
+
+
 class ShopModuleCategoryMixin(ShopModuleMixin):
     """
     """
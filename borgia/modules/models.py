@@ -50,20 +50,25 @@ class CategoryProduct(models.Model):
             return self.product.name + ' / ' + str(self.quantity) + self.product.get_unit_display()
         return self.product.name
 
-    def get_price(self):
+    def get_price(self, product_price=None):
         """
         Return the price for the quantity.
+
+        :param product_price: price of the product if already known, by
+        default it's calculated.
         """
+        if product_price is None:
+            product_price = self.product.get_price()
         try:
             if self.product.unit:
                 # - price for a L, quantity in cl
                 # - price for a kg, quantity in kg
                 if self.product.unit == 'CL':
-                    return decimal.Decimal(self.quantity * self.product.get_price() / 100)
+                    return decimal.Decimal(self.quantity * product_price / 100)
                 if self.product.unit == 'G':
-                    return decimal.Decimal(self.quantity * self.product.get_price() / 1000)
+                    return decimal.Decimal(self.quantity * product_price / 1000)
             else:
-                return decimal.Decimal(self.product.get_price())
+                return decimal.Decimal(product_price)
         except (ZeroDivisionError, decimal.DivisionUndefined, decimal.DivisionByZero):
             return decimal.Decimal(0)
 
@@ -84,9 +89,12 @@ class ShopModule(Module):
     If null, there is no limit. Positiv.
     :param logout_post_purchase: If True, the user will be logout after the
     sale, mandatory.
+    :param catalog_version: Incremented each time the categories of the
+    module change, to invalidate the catalogs built from them.
     :type delay_post_purchase: Integer, in seconds.
     :type limit_purchase: Float (Decimal).
     :type logout_post_purchase: Boolean.
+    :type catalog_version: Integer.
     """
     shop = models.ForeignKey(
         Shop,
@@ -107,6 +115,7 @@ class ShopModule(Module):
                                          blank=True, null=True)
     logout_post_purchase = models.BooleanField('Deconnexion après une vente',
                                                default=False)
+    catalog_version = models.PositiveIntegerField('Version du catalogue', default=0)
 
     class Meta:
         abstract = True
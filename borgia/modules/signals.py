@@ -0,0 +1,29 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from borgia.utils import MODULES_VERSION, bump_data_version
+from modules.models import OperatorSaleModule, SelfSaleModule
+from modules.utils import invalidate_module_directory
+from shops.models import Shop
+
+
+@receiver(post_save, sender=Shop)
+@receiver(post_delete, sender=Shop)
+@receiver(post_save, sender=SelfSaleModule)
+@receiver(post_delete, sender=SelfSaleModule)
+@receiver(post_save, sender=OperatorSaleModule)
+@receiver(post_delete, sender=OperatorSaleModule)
+def invalidate_module_directory_on_change(**kwargs):
+    """
+    Invalidate the cached directory of the sale modules when a shop or a
+    module is saved or deleted.
+    """
+    invalidate_module_directory()
+
+
+@receiver(post_save, sender=SelfSaleModule)
+@receiver(post_delete, sender=SelfSaleModule)
+@receiver(post_save, sender=OperatorSaleModule)
+@receiver(post_delete, sender=OperatorSaleModule)
+def bump_modules_version(**kwargs):
+    bump_data_version(MODULES_VERSION)
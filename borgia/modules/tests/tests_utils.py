@@ -0,0 +1,101 @@
+import datetime
+import decimal
+
+from django.utils import timezone
+
+from modules.models import (Category, CategoryProduct, OperatorSaleModule,
+                            SelfSaleModule)
+from modules.utils import (create_round_sales, edit_category,
+                           shift_category_orders)
+from sales.models import Sale, SaleProduct
+from shops.models import Product
+from shops.tests.tests_views import BaseShopsViewsTest
+from users.models import User
+
+
+class EditCategoryTestCase(BaseShopsViewsTest):
+    def setUp(self):
+        super().setUp()
+        self.module = SelfSaleModule.objects.create(shop=self.shop1, state=True)
+        self.categories = [Category.objects.create(name='Category' + str(order), order=order, module=self.module)
+                           for order in range(4)]
+        self.category = self.categories[0]
+        self.skoll = CategoryProduct.objects.create(category=self.category, product=self.product1, quantity=1)
+        self.beer = CategoryProduct.objects.create(category=self.category, product=self.product2, quantity=25)
+        self.meat = CategoryProduct.objects.create(category=self.category, product=self.product3, quantity=100)
+
+    def test_diff(self):
+        edit_category(self.category, None, None,
+                      [(self.product1, 1), (self.product2, 50), (self.product2, 25)])
+        self.assertEqual(
+            sorted(self.category.categoryproduct_set.values_list('product', 'quantity')),
+            sorted([(self.product1.pk, 1), (self.product2.pk, 50), (self.product2.pk, 25)]))
+        # Unchanged lines keep their pk, the removed one is deleted.
+        self.assertTrue(CategoryProduct.objects.filter(pk=self.skoll.pk, quantity=1).exists())
+        self.assertTrue(CategoryProduct.objects.filter(pk=self.beer.pk, quantity=25).exists())
+        self.assertFalse(CategoryProduct.objects.filter(pk=self.meat.pk).exists())
+
+    def test_quantity_updated(self):
+        edit_category(self.category, None, None,
+                      [(self.product1, 1), (self.product2, 50), (self.product3, 100)])
+        self.beer.refresh_from_db()
+        self.assertEqual(self.beer.quantity, 50)
+
+    def test_catalog_invalidated_once(self):
+        edit_category(self.category, 'Renamed', 2, [(self.product1, 1)])
+        self.module.refresh_from_db()
+        self.assertEqual(self.module.catalog_version, 1)
+
+    def test_shift_category_orders(self):
+        shift_category_orders(self.category, 2)
+        self.category.save()
+        self.assertEqual(
+            [category.order for category in Category.objects.filter(pk__in=[c.pk for c in self.categories])
+             .order_by('pk')],
+            [2, 0, 1, 3])
+
+        shift_category_orders(self.category, 0)
+        self.category.save()
+        self.assertEqual(
+            [category.order for category in Category.objects.filter(pk__in=[c.pk for c in self.categories])
+             .order_by('pk')],
+            [0, 1, 2, 3])
+
+    def test_queries(self):
+        # Savepoint, category, lines, bulk update, bulk insert, module and
+        # release.
+        category = Category.objects.get(pk=self.category.pk)
+        category.module
+        with self.assertNumQueries(7):
+            edit_category(category, 'Renamed', None,
+                          [(self.product1, 1), (self.product2, 50), (self.product3, 500), (self.product1, 2)])
+
+
+class CreateRoundSalesTestCase(BaseShopsViewsTest):
+    def setUp(self):
+        super().setUp()
+        self.module = OperatorSaleModule.objects.create(shop=self.shop1, state=True)
+        self.lines = [(self.product2, 25, decimal.Decimal('0.50')), (self.product3, 100, decimal.Decimal('1.00'))]
+
+    def test_round(self):
+        Product.objects.filter(pk=self.product3.pk).update(
+            last_inventory_datetime=timezone.now() + datetime.timedelta(days=1))
+        sales = create_round_sales(self.module, self.user3,
+                                   [(self.user1, self.lines), (self.user2, self.lines), (self.user1, self.lines)])
+        self.assertEqual([sale.sender for sale in sales], [self.user1, self.user2, self.user1])
+        self.assertEqual(SaleProduct.objects.filter(sale__in=sales).count(), 6)
+        self.assertEqual(self.user1.balance, decimal.Decimal('50.00'))
+        self.user1.refresh_from_db()
+        self.assertEqual(self.user1.balance, decimal.Decimal('50.00'))
+        # Counted incrementally, except before the last inventory.
+        self.product2.refresh_from_db()
+        self.product3.refresh_from_db()
+        self.assertEqual((self.product2.stock_output, self.product3.stock_output), (75, 0))
+
+    def test_balance_checked_in_transaction(self):
+        User.objects.filter(pk=self.user1.pk).update(balance=1)
+        with self.assertRaises(ValueError):
+            create_round_sales(self.module, self.user3, [(self.user2, self.lines), (self.user1, self.lines)])
+        self.assertFalse(Sale.objects.filter(operator=self.user3).exists())
+        self.user2.refresh_from_db()
+        self.assertEqual(self.user2.balance, 144)
@@ -1,8 +1,13 @@
+import decimal
+import json
+
 from django.test import Client
 from django.urls import reverse
 
 from borgia.tests.utils import get_login_url_redirected
-from modules.models import Category, OperatorSaleModule, SelfSaleModule
+from modules.models import (Category, CategoryProduct, OperatorSaleModule,
+                            SelfSaleModule)
+from sales.models import Sale
 from shops.tests.tests_views import BaseShopsViewsTest
 
 
@@ -79,6 +84,140 @@ class ShopModuleSaleViewTests(BaseGeneralShopModuleViewsTest):
         super().offline_user_redirection()
 
 
+class ShopModuleCatalogViewTests(BaseGeneralShopModuleViewsTest):
+    url_view = 'url_shop_module_catalog'
+
+    def setUp(self):
+        super().setUp()
+        self.category = Category.objects.create(name='Beers', module=self.selfsalemodule1)
+        self.category_product = CategoryProduct.objects.create(
+            category=self.category, product=self.product2, quantity=25)
+
+    def test_catalog(self):
+        response = self.client1.get(self.get_url(self.shop1.pk, 'self_sales'))
+        self.assertEqual(response.status_code, 200)
+        catalog = response.json()
+        self.assertEqual(catalog['module']['class'], 'self_sales')
+        self.assertEqual(catalog['categories'][0]['products'], [{
+            'field': str(self.category_product.pk) + '-' + str(self.category.pk),
+            'pk': self.category_product.pk,
+            'product': self.product2.pk,
+            'name': str(self.category_product),
+            'price': '0.50',
+        }])
+
+    def test_etag(self):
+        url = self.get_url(self.shop1.pk, 'self_sales')
+        etag = self.client1.get(url)['ETag']
+        self.assertEqual(self.client1.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.client3.post(reverse('url_product_update_price', kwargs={
+            'shop_pk': self.shop1.pk, 'product_pk': self.product2.pk}),
+            {'is_manual': True, 'manual_price': 3})
+        response = self.client1.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['categories'][0]['products'][0]['price'], '0.75')
+
+    def test_not_allowed_user_get(self):
+        response = self.client2.get(self.get_url(self.shop1.pk, 'self_sales'))
+        self.assertEqual(response.status_code, 403)
+
+    def test_offline_user(self):
+        response = Client().get(self.get_url(self.shop1.pk, 'self_sales'))
+        self.assertEqual(response.status_code, 403)
+
+
+class ShopModuleSaleApiViewTests(BaseGeneralShopModuleViewsTest):
+    url_view = 'url_shop_module_sale_api'
+
+    def setUp(self):
+        super().setUp()
+        self.category = Category.objects.create(name='Beers', module=self.selfsalemodule1)
+        self.category_product = CategoryProduct.objects.create(
+            category=self.category, product=self.product2, quantity=25)
+        self.field = str(self.category_product.pk) + '-' + str(self.category.pk)
+
+    def post(self, client, body):
+        return client.post(self.get_url(self.shop1.pk, 'self_sales'), json.dumps(body),
+                           content_type='application/json')
+
+    def test_sale(self):
+        response = self.post(self.client1, {'products': {self.field: 2}})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['amount'], '1.00')
+        self.assertEqual(response.json()['balance'], '52.00')
+        sale = Sale.objects.get(pk=response.json()['sale'])
+        self.assertEqual(sale.sender, self.user1)
+        self.assertEqual(sale.saleproduct_set.get().quantity, 50)
+        self.assertEqual(sale.products_summary, str(sale.saleproduct_set.get()))
+        self.assertEqual(sale.total_amount, decimal.Decimal('1.00'))
+
+    def test_invalid(self):
+        self.assertEqual(self.post(self.client1, {'products': {self.field: 0}}).status_code, 400)
+        response = self.client1.post(self.get_url(self.shop1.pk, 'self_sales'), 'not json',
+                                     content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Sale.objects.filter(sender=self.user1, shop=self.shop1).exists())
+
+    def test_not_allowed_user(self):
+        self.assertEqual(self.post(self.client2, {'products': {self.field: 1}}).status_code, 403)
+
+
+class ShopModuleRoundSaleViewTests(BaseGeneralShopModuleViewsTest):
+    url_view = 'url_shop_module_round_sale'
+
+    def setUp(self):
+        super().setUp()
+        self.category = Category.objects.create(name='Beers', module=self.operatorsalemodule1)
+        self.category_product = CategoryProduct.objects.create(
+            category=self.category, product=self.product2, quantity=25)
+        self.field = str(self.category_product.pk) + '-' + str(self.category.pk)
+
+    def test_chief_get(self):
+        response_client3 = self.client3.get(self.get_url(self.shop1.pk, 'operator_sales'))
+        self.assertEqual(response_client3.status_code, 200)
+
+    def test_self_sales_module(self):
+        response_client3 = self.client3.get(self.get_url(self.shop1.pk, 'self_sales'))
+        self.assertEqual(response_client3.status_code, 404)
+
+    def test_round(self):
+        response = self.client3.post(self.get_url(self.shop1.pk, 'operator_sales'),
+                                     {'clients': 'user1 user2,\nuser1', self.field: 2})
+        self.assertEqual(response.status_code, 302)
+        sales = Sale.objects.filter(shop=self.shop1, operator=self.user3).order_by('pk')
+        self.assertEqual([sale.sender for sale in sales], [self.user1, self.user2, self.user1])
+        for sale in sales:
+            self.assertEqual(sale.saleproduct_set.get().quantity, 50)
+            self.assertEqual(sale.total_amount, decimal.Decimal('1.00'))
+        self.user1.refresh_from_db()
+        self.user2.refresh_from_db()
+        self.assertEqual(self.user1.balance, decimal.Decimal('51.00'))
+        self.assertEqual(self.user2.balance, decimal.Decimal('143.00'))
+        self.product2.refresh_from_db()
+        self.assertEqual(self.product2.stock_output, 150)
+
+    def test_insufficient_balance(self):
+        response = self.client3.post(self.get_url(self.shop1.pk, 'operator_sales'),
+                                     {'clients': 'user1 user2 user1', self.field: 60})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['form'].non_field_errors(), ['Crédit insuffisant : user1'])
+        self.assertFalse(Sale.objects.filter(shop=self.shop1, operator=self.user3).exists())
+
+    def test_unknown_client(self):
+        response = self.client3.post(self.get_url(self.shop1.pk, 'operator_sales'),
+                                     {'clients': 'user1 nobody', self.field: 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['form'].non_field_errors(), ['Utilisateurs inexistants : nobody'])
+
+    def test_not_allowed_user_get(self):
+        response_client2 = self.client2.get(self.get_url(self.shop1.pk, 'operator_sales'))
+        self.assertEqual(response_client2.status_code, 403)
+
+    def test_not_existing_shop_get(self):
+        super().not_existing_shop_get()
+
+
 class ShopModuleConfigViewTests(BaseGeneralShopModuleViewsTest):
     url_view = 'url_shop_module_config'
 
@@ -205,6 +344,32 @@ class BaseFocusShopModuleCategoryViewsTest(BaseShopModuleCategoryViewsTest):
 class ShopModuleCategoryUpdateViewTests(BaseFocusShopModuleCategoryViewsTest):
     url_view = 'url_shop_module_category_update'
 
+    def test_chief_post(self):
+        CategoryProduct.objects.create(category=self.category1, product=self.product1, quantity=1)
+        response = self.client3.post(self.get_url(self.shop1.pk, 'self_sales', self.category1.pk), {
+            'name': 'Renamed', 'order': 0,
+            'form-TOTAL_FORMS': 2, 'form-INITIAL_FORMS': 0,
+            'form-0-product': str(self.product1.pk) + '/None', 'form-0-quantity': '',
+            'form-1-product': str(self.product2.pk) + '/cl', 'form-1-quantity': 25})
+        self.assertEqual(response.status_code, 302)
+        self.category1.refresh_from_db()
+        self.assertEqual(self.category1.name, 'Renamed')
+        self.assertEqual(sorted(self.category1.categoryproduct_set.values_list('product', 'quantity')),
+                         [(self.product1.pk, 1), (self.product2.pk, 25)])
+        self.selfsalemodule1.refresh_from_db()
+        self.assertEqual(self.selfsalemodule1.catalog_version, 1)
+
+    def test_unitless_product_initial(self):
+        CategoryProduct.objects.create(category=self.category1, product=self.product1, quantity=1)
+        CategoryProduct.objects.create(category=self.category1, product=self.product2, quantity=25)
+        response = self.client3.get(self.get_url(self.shop1.pk, 'self_sales', self.category1.pk))
+        self.assertEqual(response.status_code, 200)
+        choices = dict(response.context['cat_form'].forms[0].fields['product'].choices)
+        initial = [form.initial['product'] for form in response.context['cat_form'].initial_forms]
+        self.assertEqual(initial, [str(self.product1.pk) + '/None', str(self.product2.pk) + '/cl'])
+        for value in initial:
+            self.assertIn(value, choices)
+
     def test_chief_get(self):
         super().chief_get()
 
@@ -1,6 +1,8 @@
 from django.urls import include, path
 
-from modules.views import (ShopModuleSaleView,
+from modules.views import (ShopModuleSaleView, ShopModuleSaleApiView,
+                           ShopModuleRoundSaleView,
+                           ShopModuleCatalogView,
                            ShopModuleCategoryCreateView, ShopModuleCategoryDeleteView,
                            ShopModuleCategoryUpdateView, ShopModuleConfigUpdateView,
                            ShopModuleConfigView)
@@ -9,6 +11,12 @@ modules_patterns = [
     path('shops/<int:shop_pk>/modules/', include([
         path('<str:module_class>/', include([
             path('', ShopModuleSaleView.as_view(), name='url_shop_module_sale'),
+            path('catalog/', ShopModuleCatalogView.as_view(),
+                 name='url_shop_module_catalog'),
+            path('sale/', ShopModuleSaleApiView.as_view(),
+                 name='url_shop_module_sale_api'),
+            path('round/', ShopModuleRoundSaleView.as_view(),
+                 name='url_shop_module_round_sale'),
             path('config/', ShopModuleConfigView.as_view(),
                  name='url_shop_module_config'),
             path('config/update/', ShopModuleConfigUpdateView.as_view(),
@@ -0,0 +1,389 @@
+"""
+Catalog of the sale modules and edition of their categories.
+
+The products of a category are updated as a diff against the existing lines,
+so that unchanged lines keep their pk, and the catalog of the module is
+invalidated once per edition.
+
+The directory of the modules of every shop, shown on the login page, is
+cached until a shop or a module changes.
+"""
+from urllib.parse import urlparse, urlunparse
+
+from django.conf import settings
+from django.contrib.auth import REDIRECT_FIELD_NAME
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Case, DecimalField, F, Max, Prefetch, Value, When
+from django.http import QueryDict
+from django.shortcuts import resolve_url
+from django.urls import reverse
+from django.utils.timezone import now
+
+from configurations.utils import configuration_get
+from modules.models import (Category, CategoryProduct, OperatorSaleModule,
+                            SelfSaleModule)
+from sales.models import Sale, SaleProduct
+from sales.utils import rollup_sales
+from shops.models import Product, ProductPriceHistory, Shop
+from shops.utils import count_stock_movements, get_current_prices
+from users.models import User
+
+MODULE_DIRECTORY_CACHE_KEY = 'modules:directory'
+# Invalidation reaches the other processes only with a shared cache backend,
+# the timeout bounds the staleness with a local one.
+MODULE_DIRECTORY_CACHE_TIMEOUT = 300
+
+
+def invalidate_catalog(module):
+    """
+    Increment the catalog version of the module, in a single query.
+    """
+    module.__class__.objects.filter(pk=module.pk).update(
+        catalog_version=F('catalog_version') + 1)
+    module.catalog_version += 1
+
+
+def invalidate_shop_catalogs(shop):
+    """
+    Increment the catalog version of every module of the shop, after a change
+    of its products.
+    """
+    for module_model in (SelfSaleModule, OperatorSaleModule):
+        module_model.objects.filter(shop=shop).update(
+            catalog_version=F('catalog_version') + 1)
+
+
+def get_catalog_etag(module):
+    """
+    Return the ETag of the catalog of the module.
+
+    The catalog changes with the categories and products, counted by the
+    catalog version, and with the prices, recorded in the price history.
+    """
+    last_price = ProductPriceHistory.objects.filter(
+        product__shop_id=module.shop_id).aggregate(last_price=Max('pk'))['last_price']
+    return '%s-%s-%s-%s' % (module.get_module_class(), module.pk,
+                            module.catalog_version, last_price or 0)
+
+
+def get_sale_category_products(module):
+    """
+    Return the products on sale in the module, by category, with their price
+    in a few queries.
+
+    The products are active, not removed, with a positive price.
+
+    :returns: list of (category, list of (category product, price)), the
+    categories in their order.
+    """
+    categories = list(module.categories.order_by('order').prefetch_related(
+        Prefetch('categoryproduct_set',
+                 queryset=CategoryProduct.objects.select_related('product').order_by('pk'))))
+    category_products = [category_product for category in categories
+                         for category_product in category.categoryproduct_set.all()
+                         if category_product.product.is_active and not category_product.product.is_removed]
+    prices = get_current_prices({category_product.product for category_product in category_products})
+
+    on_sale = []
+    for category in categories:
+        lines = []
+        for category_product in category.categoryproduct_set.all():
+            product = category_product.product
+            if not product.is_active or product.is_removed:
+                continue
+            price = category_product.get_price(prices[product.pk])
+            if price > 0:
+                lines.append((category_product, price))
+        on_sale.append((category, lines))
+    return on_sale
+
+
+def get_catalog(module):
+    """
+    Return the catalog of the module: its configuration and the products on
+    sale by category, with their price.
+
+    The products are those of ShopModuleSaleForm, each one has the name of its
+    field in the form.
+    """
+    catalog_categories = []
+    for category, lines in get_sale_category_products(module):
+        catalog_categories.append({
+            'pk': category.pk,
+            'name': category.name,
+            'order': category.order,
+            'products': [{
+                'field': str(category_product.pk) + '-' + str(category.pk),
+                'pk': category_product.pk,
+                'product': category_product.product_id,
+                'name': str(category_product),
+                'price': str(round(price, 2)),
+            } for category_product, price in lines],
+        })
+
+    return {
+        'shop': {'pk': module.shop_id, 'name': module.shop.name},
+        'module': {
+            'class': module.get_module_class(),
+            'limit_purchase': None if module.limit_purchase is None else str(module.limit_purchase),
+            'delay_post_purchase': module.delay_post_purchase,
+            'logout_post_purchase': module.logout_post_purchase,
+        },
+        'categories': catalog_categories,
+    }
+
+
+def add_next_to_login(path_next, redirect_field_name=REDIRECT_FIELD_NAME, login_url=None):
+    """
+    Add the given 'path_next' path to the 'login_url' path.
+    """
+    resolved_url = resolve_url(login_url or settings.LOGIN_URL)
+
+    login_url_parts = list(urlparse(resolved_url))
+    if redirect_field_name:
+        querystring = QueryDict(login_url_parts[4], mutable=True)
+        querystring[redirect_field_name] = path_next
+        login_url_parts[4] = querystring.urlencode(safe='/')
+
+    return urlunparse(login_url_parts)
+
+
+def build_module_directory():
+    """
+    Return the sale modules of every shop, with the links to log in directly
+    to them, in three queries.
+
+    :returns: list by shop of dicts: shop (pk and name), and for self and
+    operator modules: module (state, None if not created yet), rev_link (url
+    of the sale page), link (login url to the sale page) and label.
+    """
+    modules = {}
+    for module_class, module_model in (('self', SelfSaleModule), ('operator', OperatorSaleModule)):
+        modules[module_class] = {}
+        # The first module of each shop, as created by ShopModuleMixin.
+        for shop_id, state in module_model.objects.order_by('-pk').values_list('shop_id', 'state'):
+            modules[module_class][shop_id] = {'state': state}
+
+    directory = []
+    for shop in Shop.objects.order_by('pk').values('pk', 'name'):
+        entry = {'shop': shop}
+        for module_class, label in (('self', 'Vente directe'), ('operator', 'Vente par opérateur')):
+            rev_link = reverse('url_shop_module_sale', kwargs={
+                'shop_pk': shop['pk'], 'module_class': module_class + '_sales'})
+            entry[module_class + '_module'] = modules[module_class].get(shop['pk'])
+            entry[module_class + '_module_rev_link'] = rev_link
+            entry[module_class + '_module_link'] = add_next_to_login(rev_link)
+            entry[module_class + '_module_label'] = label + ' - ' + shop['name'].capitalize()
+        directory.append(entry)
+    return directory
+
+
+def get_module_directory():
+    """
+    Return the directory of the sale modules, see build_module_directory,
+    cached until a shop or a module is saved or deleted.
+    """
+    directory = cache.get(MODULE_DIRECTORY_CACHE_KEY)
+    if directory is None:
+        directory = build_module_directory()
+        cache.set(MODULE_DIRECTORY_CACHE_KEY, directory, MODULE_DIRECTORY_CACHE_TIMEOUT)
+    return directory
+
+
+def invalidate_module_directory():
+    """
+    Remove the directory of the sale modules from the cache.
+    """
+    cache.delete(MODULE_DIRECTORY_CACHE_KEY)
+
+
+def get_category_lines_from_forms(shop, forms):
+    """
+    Return the products and quantities selected in the forms, with a single
+    query for the products.
+
+    Forms without product or quantity, or with a product not in the shop, are
+    ignored.
+
+    :param forms: cleaned data of ModuleCategoryCreateForm.
+    :returns: list of (product, quantity).
+    """
+    selected = []
+    for form in forms:
+        try:
+            selected.append((int(form['product'].split('/')[0]), form))
+        except (KeyError, AttributeError, ValueError):
+            pass
+    products = Product.objects.filter(shop=shop, is_removed=False).in_bulk(
+        [pk for pk, form in selected])
+
+    lines = []
+    for pk, form in selected:
+        product = products.get(pk)
+        if product is None:
+            continue
+        if product.unit:
+            try:
+                quantity = int(form['quantity'])
+            except (KeyError, TypeError):
+                continue
+        else:
+            quantity = 1
+        lines.append((product, quantity))
+    return lines
+
+
+def update_category_products(category, lines):
+    """
+    Make the products of the category match the lines, changing only what
+    differs: a line with the same product and quantity is kept, a line with
+    the same product gets its quantity updated, other lines are deleted or
+    created.
+
+    :param lines: list of (product, quantity).
+    """
+    existing = list(category.categoryproduct_set.all())
+
+    to_create = []
+    unmatched = []
+    for product, quantity in lines:
+        for category_product in existing:
+            if category_product.product_id == product.pk and category_product.quantity == quantity:
+                existing.remove(category_product)
+                break
+        else:
+            unmatched.append((product, quantity))
+
+    to_update = []
+    for product, quantity in unmatched:
+        for category_product in existing:
+            if category_product.product_id == product.pk:
+                existing.remove(category_product)
+                category_product.quantity = quantity
+                to_update.append(category_product)
+                break
+        else:
+            to_create.append(CategoryProduct(category=category, product=product, quantity=quantity))
+
+    if existing:
+        CategoryProduct.objects.filter(pk__in=[category_product.pk for category_product in existing]).delete()
+    if to_update:
+        CategoryProduct.objects.bulk_update(to_update, ['quantity'])
+    if to_create:
+        CategoryProduct.objects.bulk_create(to_create)
+
+
+def shift_category_orders(category, new_order):
+    """
+    Move the category to the new order, shifting the categories in between
+    with a single UPDATE. The category itself isn't saved.
+    """
+    siblings = Category.objects.filter(content_type_id=category.content_type_id,
+                                       module_id=category.module_id).exclude(pk=category.pk)
+    if new_order < category.order:
+        siblings.filter(order__gte=new_order, order__lt=category.order).update(
+            order=F('order') + 1)
+    elif new_order > category.order:
+        siblings.filter(order__lte=new_order, order__gt=category.order).update(
+            order=F('order') - 1)
+    category.order = int(new_order)
+
+
+def create_category(module, name, order, lines):
+    """
+    Create a category with its products, and invalidate the catalog of the
+    module, in a single transaction.
+
+    :param lines: list of (product, quantity), see get_category_lines_from_forms.
+    :returns: the category.
+    """
+    with transaction.atomic():
+        category = Category.objects.create(name=name, order=order, module=module)
+        CategoryProduct.objects.bulk_create(
+            CategoryProduct(category=category, product=product, quantity=quantity)
+            for product, quantity in lines)
+        invalidate_catalog(module)
+    return category
+
+
+def edit_category(category, name, order, lines):
+    """
+    Update the name, order and products of a category, and invalidate the
+    catalog of its module, in a single transaction.
+
+    :param name: new name, unchanged if None.
+    :param order: new order, unchanged if None.
+    :param lines: list of (product, quantity), see get_category_lines_from_forms.
+    """
+    with transaction.atomic():
+        if name is not None:
+            category.name = name
+        if order is not None and order != category.order:
+            shift_category_orders(category, order)
+        category.save()
+        update_category_products(category, lines)
+        invalidate_catalog(category.module)
+
+
+def create_round_sales(module, operator, baskets):
+    """
+    Create and pay the sales of a round: one sale per basket, sold by the
+    operator to its client.
+
+    Everything is written in a single transaction: the clients are locked and
+    their balances checked again against BALANCE_THRESHOLD_PURCHASE, then the
+    sales and their products are created in bulk, the stock counters and the
+    rollups incremented, and the balances debited with one UPDATE. The
+    balances of the clients are updated in memory.
+
+    :param baskets: list of (client, list of (product, quantity, price)), a
+    client can have several baskets.
+    :returns: list of the sales, in the order of the baskets.
+    :raise: ValueError if a balance is no longer sufficient.
+    """
+    recipient = User.objects.get(pk=1)
+    threshold = configuration_get('BALANCE_THRESHOLD_PURCHASE').get_value()
+    datetime = now()
+    sales = []
+    debits = {}
+    quantities = {}
+    for client, lines in baskets:
+        sale_products = [SaleProduct(product=product, quantity=quantity, price=price)
+                         for product, quantity, price in lines]
+        sale = Sale(operator=operator, sender=client, recipient=recipient,
+                    module=module, shop_id=module.shop_id, datetime=datetime)
+        sale.summarize(sale_products)
+        sales.append((sale, sale_products))
+        debits[client.pk] = debits.get(client.pk, 0) + sale.total_amount
+        for sale_product in sale_products:
+            quantities[sale_product.product_id] = quantities.get(sale_product.product_id, 0) + sale_product.quantity
+
+    with transaction.atomic():
+        balances = dict(User.objects.select_for_update().filter(pk__in=debits).values_list('pk', 'balance'))
+        insufficient = sorted({sale.sender.username for sale, sale_products in sales
+                               if balances[sale.sender_id] - debits[sale.sender_id] < threshold})
+        if insufficient:
+            raise ValueError('Crédit insuffisant : ' + ', '.join(insufficient))
+
+        if connection.features.can_return_ids_from_bulk_insert:
+            Sale.objects.bulk_create([sale for sale, sale_products in sales])
+        else:
+            # The pks are needed for the products.
+            for sale, sale_products in sales:
+                sale.save()
+        for sale, sale_products in sales:
+            for sale_product in sale_products:
+                sale_product.sale = sale
+        SaleProduct.objects.bulk_create(
+            [sale_product for sale, sale_products in sales for sale_product in sale_products])
+        count_stock_movements('stock_output', quantities, datetime)
+        rollup_sales(sales)
+
+        User.objects.filter(pk__in=debits).update(balance=F('balance') - Case(
+            *[When(pk=pk, then=Value(amount)) for pk, amount in debits.items()],
+            output_field=DecimalField(max_digits=9, decimal_places=2)))
+
+    for sale, sale_products in sales:
+        sale.sender.balance = balances[sale.sender_id] - debits[sale.sender_id]
+    return [sale for sale, sale_products in sales]
@@ -1,26 +1,35 @@
+import json
 from functools import partial, wraps
 
+from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from django.contrib.auth.mixins import PermissionRequiredMixin
-from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
 from django.forms.formsets import formset_factory
-from django.http import Http404
+from django.http import Http404, JsonResponse
 from django.shortcuts import redirect, render
 from django.urls import reverse
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from django.views.generic.base import View
 
+from borgia.mixins import FragmentCacheMixin
+from borgia.utils import MODULES_VERSION, PRODUCTS_VERSION
 from borgia.views import BorgiaFormView, BorgiaView
-from configurations.utils import configuration_get
 from modules.forms import (ModuleCategoryCreateForm,
                            ModuleCategoryCreateNameForm, ShopModuleConfigForm,
-                           ShopModuleSaleForm)
-from modules.mixins import ShopModuleCategoryMixin, ShopModuleMixin
-from modules.models import Category, CategoryProduct, SelfSaleModule
-from sales.models import Sale, SaleProduct
-from shops.models import Product, Shop
-from users.models import User
-
-
-class ShopModuleSaleView(ShopModuleMixin, BorgiaFormView):
+                           ShopModuleRoundSaleForm, ShopModuleSaleForm)
+from modules.mixins import (ShopModuleCategoryMixin, ShopModuleMixin,
+                            ShopModuleSaleMixin)
+from modules.models import SelfSaleModule
+from modules.utils import (create_category, create_round_sales,
+                           edit_category, get_catalog,
+                           get_catalog_etag, get_category_lines_from_forms,
+                           invalidate_catalog)
+from shops.models import Shop
+from shops.utils import get_product_choice_value, get_product_choices
+
+
+class ShopModuleSaleView(ShopModuleSaleMixin, BorgiaFormView):
     """
     Generic FormView for handling invoice concerning product bases through a
     shop.
@@ -34,33 +43,9 @@ class ShopModuleSaleView(ShopModuleMixin, BorgiaFormView):
     :type self.permission_required_selfsale: string
     :type self.permission_required_operatorsale: string
     """
-    permission_required_self = 'modules.use_selfsalemodule'
-    permission_required_operator = 'modules.use_operatorsalemodule'
     template_name = 'modules/shop_module_sale.html'
     form_class = ShopModuleSaleForm
 
-    def has_permission(self):
-        if self.kwargs['module_class'] == 'self_sales':
-            has_perms = self.has_permission_selfsales()
-        else:
-            has_perms = super().has_permission()
-        if not has_perms:
-            return False
-        else:
-            if self.module.state is False:
-                raise Http404
-            else:
-                return True
-
-    def has_permission_selfsales(self):
-        """
-        Customized permission for self_sale in shops. 
-        The user still need the use_selfsalemodule permission
-        """
-        self.add_context_objects()
-        return PermissionRequiredMixin.has_permission(self)
-
-
     def get_menu_type(self):
         if self.module_class == "self_sales":
             return 'members'
@@ -69,17 +54,7 @@ class ShopModuleSaleView(ShopModuleMixin, BorgiaFormView):
 
     def get_form_kwargs(self):
         kwargs = super().get_form_kwargs()
-        kwargs['module_class'] = self.module_class
-        kwargs['module'] = self.module
-        kwargs['balance_threshold_purchase'] = configuration_get(
-            'BALANCE_THRESHOLD_PURCHASE')
-
-        if self.module_class == "self_sales":
-            kwargs['client'] = self.request.user
-        elif self.module_class == "operator_sales":
-            kwargs['client'] = None
-        else:
-            self.handle_unexpected_module_class()
+        kwargs.update(self.get_sale_form_kwargs())
         return kwargs
 
     def get_context_data(self, **kwargs):
@@ -91,38 +66,7 @@ class ShopModuleSaleView(ShopModuleMixin, BorgiaFormView):
         """
         Create a sale and like all products via SaleProduct objects.
         """
-        if self.module_class == "self_sales":
-            client = self.request.user
-        elif self.module_class == "operator_sales":
-            client = form.cleaned_data['client']
-        else:
-            self.handle_unexpected_module_class()
-
-        sale = Sale.objects.create(
-            operator=self.request.user,
-            sender=client,
-            recipient=User.objects.get(pk=1),
-            module=self.module,
-            shop=self.shop
-        )
-        for field in form.cleaned_data:
-            if field != 'client' and form.cleaned_data[field] != '':
-                invoice = int(form.cleaned_data[field])
-                if invoice > 0:
-                    try:
-                        category_product = CategoryProduct.objects.get(
-                            pk=field.split('-')[0])
-                    except ObjectDoesNotExist:
-                        pass
-                    else:
-                        SaleProduct.objects.create(
-                            sale=sale,
-                            product=category_product.product,
-                            quantity=category_product.quantity * invoice,
-                            price=category_product.get_price() * invoice
-                        )
-        sale.pay()
-
+        sale = self.create_sale(form)
 
         context = self.get_context_data()
 
@@ -145,6 +89,110 @@ class ShopModuleSaleView(ShopModuleMixin, BorgiaFormView):
         )
 
 
+class ShopModuleRoundSaleView(ShopModuleSaleMixin, BorgiaFormView):
+    """
+    Sell the same products to several clients at once, by an operator.
+
+    The balances of all the clients are checked in one query, and the sales
+    are created and paid together, see create_round_sales.
+    """
+    menu_type = 'shops'
+    template_name = 'modules/shop_module_round_sale.html'
+    form_class = ShopModuleRoundSaleForm
+
+    def has_permission(self):
+        if self.kwargs['module_class'] != 'operator_sales':
+            raise Http404
+        return super().has_permission()
+
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        kwargs.update(self.get_sale_form_kwargs())
+        return kwargs
+
+    def form_valid(self, form):
+        lines = [(category_product.product, category_product.quantity * invoice, price * invoice)
+                 for category_product, price, invoice in form.get_basket()]
+        try:
+            sales = create_round_sales(self.module, self.request.user,
+                                       [(client, lines) for client in form.cleaned_data['clients']])
+        except ValueError as error:
+            # A balance changed since the form was checked.
+            form.add_error(None, str(error))
+            return self.form_invalid(form)
+        messages.success(self.request, "%d ventes de %s€ enregistrées." % (
+            len(sales), sales[0].amount()))
+        return redirect(self.get_success_url())
+
+    def get_success_url(self):
+        return reverse(
+            'url_shop_module_round_sale',
+            kwargs={'shop_pk': self.shop.pk, 'module_class': self.module_class}
+        )
+
+
+class ShopModuleApiView(ShopModuleSaleMixin, View):
+    """
+    Base of the JSON views of a sale module, answering a denied request with
+    a JSON 403 rather than a redirection to the login page.
+    """
+
+    def handle_no_permission(self):
+        return JsonResponse({'errors': {'__all__': ['Permission refusée.']}}, status=403)
+
+
+class ShopModuleCatalogView(ShopModuleApiView):
+    """
+    Return the catalog of a sale module in JSON, for kiosks rendering the
+    sale page themselves.
+
+    The response has an ETag, a request with the current one in
+    If-None-Match gets a 304 without the catalog being built.
+    """
+
+    def get(self, request, *args, **kwargs):
+        etag = quote_etag(get_catalog_etag(self.module))
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = JsonResponse(get_catalog(self.module))
+        response['ETag'] = etag
+        return response
+
+
+class ShopModuleSaleApiView(ShopModuleApiView):
+    """
+    Create a sale from a JSON body, with the same validation as the sale page.
+
+    The body is an object with the quantities by field of the catalog, and
+    the username of the client for operator sales:
+    {"client": "username", "products": {"<field>": quantity, ...}}
+
+    Return the sale and the new balance of the client, or the errors with a
+    400 status.
+    """
+
+    def post(self, request, *args, **kwargs):
+        try:
+            body = json.loads(request.body.decode('utf-8'))
+            data = {field: str(quantity) for field, quantity in body.get('products', {}).items()}
+            if 'client' in body:
+                data['client'] = body['client']
+        except (ValueError, AttributeError):
+            return JsonResponse({'errors': {'__all__': ['Requête invalide.']}}, status=400)
+
+        form = ShopModuleSaleForm(data=data, **self.get_sale_form_kwargs())
+        if not form.is_valid():
+            return JsonResponse({'errors': form.errors}, status=400)
+
+        sale = self.create_sale(form)
+        return JsonResponse({
+            'sale': sale.pk,
+            'amount': str(sale.amount()),
+            'balance': str(sale.sender.balance),
+            'logout': self.module.logout_post_purchase,
+        }, status=201)
+
+
 def sale_shop_module_resume(request, context):
     """
     Display shop module resume after a sale
@@ -153,7 +201,7 @@ def sale_shop_module_resume(request, context):
     return render(request, template_name, context=context)
 
 
-class ShopModuleConfigView(ShopModuleMixin, BorgiaView):
+class ShopModuleConfigView(FragmentCacheMixin, ShopModuleMixin, BorgiaView):
     """
     ConfigView for a shopModule.
     """
@@ -161,6 +209,11 @@ class ShopModuleConfigView(ShopModuleMixin, BorgiaView):
     permission_required_operator = 'modules.view_config_operatorsalemodule'
     menu_type = 'shops'
     template_name = 'modules/shop_module_config.html'
+    fragment_data = (MODULES_VERSION, PRODUCTS_VERSION)
+
+    def get_fragment_cache_vary(self):
+        # The categories change with the catalog version of the module.
+        return super().get_fragment_cache_vary() + [self.module.catalog_version]
 
     def get(self, request, *args, **kwargs):
         context = self.get_context_data(**kwargs)
@@ -198,7 +251,10 @@ class ShopModuleConfigUpdateView(ShopModuleMixin, BorgiaFormView):
             self.module.delay_post_purchase = None
         else:
             self.module.delay_post_purchase = form.cleaned_data['delay_post_purchase']
-        self.module.save()
+        with transaction.atomic():
+            self.module.save(update_fields=['state', 'logout_post_purchase', 'limit_purchase',
+                                            'delay_post_purchase'])
+            invalidate_catalog(self.module)
         return super(ShopModuleConfigUpdateView, self).form_valid(form)
 
     def get_success_url(self):
@@ -226,7 +282,8 @@ class ShopModuleCategoryCreateView(ShopModuleMixin, BorgiaView):
             return False
         else:
             self.form_class = formset_factory(wraps(ModuleCategoryCreateForm)(
-                partial(ModuleCategoryCreateForm, shop=self.shop)), extra=1)
+                partial(ModuleCategoryCreateForm, shop=self.shop,
+                        product_choices=get_product_choices(self.shop))), extra=1)
             return True
 
     def get(self, request, *args, **kwargs):
@@ -238,31 +295,12 @@ class ShopModuleCategoryCreateView(ShopModuleMixin, BorgiaView):
 
     def post(self, request, *args, **kwargs):
         cat_name_form = ModuleCategoryCreateNameForm(request.POST)
-        if cat_name_form.is_valid():
-            category = Category.objects.create(
-                name=cat_name_form.cleaned_data['name'],
-                order=cat_name_form.cleaned_data['order'],
-                module=self.module
-            )
-
         cat_form = self.form_class(request.POST)
-        for product_form in cat_form.cleaned_data:
-            try:
-                product = Product.objects.get(
-                    pk=product_form['product'].split('/')[0])
-                if product.unit:
-                    quantity = int(product_form['quantity'])
-                else:
-                    quantity = 1
-                CategoryProduct.objects.create(
-                    category=category,
-                    product=product,
-                    quantity=quantity
-                )
-            except ObjectDoesNotExist:
-                pass
-            except KeyError:
-                pass
+        if cat_name_form.is_valid() and cat_form.is_valid():
+            create_category(self.module,
+                            cat_name_form.cleaned_data['name'],
+                            cat_name_form.cleaned_data['order'],
+                            get_category_lines_from_forms(self.shop, cat_form.cleaned_data))
         return redirect(self.get_success_url())
 
     def get_success_url(self):
@@ -290,15 +328,16 @@ class ShopModuleCategoryUpdateView(ShopModuleCategoryMixin, BorgiaView):
             return False
         else:
             self.form_class = formset_factory(wraps(ModuleCategoryCreateForm)(
-                partial(ModuleCategoryCreateForm, shop=self.shop)), extra=1)
+                partial(ModuleCategoryCreateForm, shop=self.shop,
+                        product_choices=get_product_choices(self.shop))), extra=1)
             return True
 
     def get(self, request, *args, **kwargs):
         context = self.get_context_data(**kwargs)
-        cat_form_data = [{'product': str(category_product.product.pk) + '/' +
-                                     str(category_product.product.get_unit_display()),
+        cat_form_data = [{'product': get_product_choice_value(category_product.product_id,
+                                                              category_product.product.unit),
                           'quantity': category_product.quantity}
-                         for category_product in self.category.categoryproduct_set.all()]
+                         for category_product in self.category.categoryproduct_set.select_related('product')]
         context['cat_form'] = self.form_class(initial=cat_form_data)
         context['cat_name_form'] = ModuleCategoryCreateNameForm(
             initial={'name': self.category.name, 'order': self.category.order})
@@ -306,31 +345,15 @@ class ShopModuleCategoryUpdateView(ShopModuleCategoryMixin, BorgiaView):
 
     def post(self, request, *args, **kwargs):
         cat_name_form = ModuleCategoryCreateNameForm(request.POST)
-        if cat_name_form.is_valid():
-            self.category.name = cat_name_form.cleaned_data['name']
-            if cat_name_form.cleaned_data['order'] != self.category.order:
-               shift_category_orders(self.category,cat_name_form.cleaned_data['order'])
-            self.category.save()
-
         cat_form = self.form_class(request.POST)
-        CategoryProduct.objects.filter(category=self.category).delete()
-        for product_form in cat_form.cleaned_data:
-            try:
-                product = Product.objects.get(
-                    pk=product_form['product'].split('/')[0])
-                if product.unit:
-                    quantity = int(product_form['quantity'])
-                else:
-                    quantity = 1
-                CategoryProduct.objects.create(
-                    category=self.category,
-                    product=product,
-                    quantity=quantity
-                )
-            except ObjectDoesNotExist:
-                pass
-            except KeyError:
-                pass
+        if cat_form.is_valid():
+            if cat_name_form.is_valid():
+                name = cat_name_form.cleaned_data['name']
+                order = cat_name_form.cleaned_data['order']
+            else:
+                name = order = None
+            edit_category(self.category, name, order,
+                          get_category_lines_from_forms(self.shop, cat_form.cleaned_data))
         return redirect(self.get_success_url())
 
     def get_success_url(self):
@@ -356,35 +379,12 @@ class ShopModuleCategoryDeleteView(ShopModuleCategoryMixin, BorgiaView):
         return render(request, self.template_name, context=context)
 
     def post(self, request, *args, **kwargs):
-        CategoryProduct.objects.filter(category=self.category).delete()
-        self.category.delete()
+        with transaction.atomic():
+            self.category.delete()
+            invalidate_catalog(self.module)
         return redirect(self.get_success_url())
 
     def get_success_url(self):
         return reverse('url_shop_module_config',
                        kwargs={'shop_pk': self.shop.pk, 'module_class': self.module_class})
 
-
-def shift_category_orders(category,new_order):
-    module_id = category.module_id
-    content_type_id = category.content_type_id
-    order = category.order
-    if new_order < order:
-       categories = Category.objects.filter(content_type_id=content_type_id,
-                                            module_id=module_id,
-                                            order__gte=new_order,order__lt=order)
-       if categories:
-          for cat in categories:
-              cat.order += 1
-              cat.save()
-    elif new_order > order:
-       categories = Category.objects.filter(content_type_id=content_type_id,
-                                            module_id=module_id,
-                                            order__lte=new_order,order__gt=order)
-       if categories:
-          for cat in categories:
-              cat.order -= 1
-              cat.save()
-    category.order = int(new_order)
-    category.save()
-
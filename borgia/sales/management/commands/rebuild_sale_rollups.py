@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from sales.models import SaleDailyRollup, UserMonthlySpend
+from sales.utils import rebuild_sale_rollups
+from shops.models import Shop
+
+
+class Command(BaseCommand):
+    help = ("Recalculate the daily sales of the shops and products, and the "
+            "monthly spending of the users, from the sales.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shop', default=None,
+                            help="Name of the shop to rebuild, all shops by default.")
+
+    def handle(self, *args, **options):
+        shops = Shop.objects.all()
+        if options['shop']:
+            shops = shops.filter(name=options['shop'])
+
+        rebuild_sale_rollups(shops)
+        if options['verbosity'] > 0:
+            self.stdout.write("%d daily rollups and %d monthly spendings rebuilt." % (
+                SaleDailyRollup.objects.filter(shop__in=shops).count(),
+                UserMonthlySpend.objects.filter(shop__in=shops).count()))
@@ -0,0 +1,101 @@
+# Generated by Django 2.2.28 on 2026-10-19 00:27
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import Coalesce, TruncDate, TruncMonth
+import django.db.models.deletion
+
+
+def backfill_sale_rollups(apps, schema_editor):
+    """
+    Same calculation as sales.utils.rebuild_sale_rollups, historical models
+    don't have its methods.
+    """
+    Sale = apps.get_model('sales', 'Sale')
+    SaleProduct = apps.get_model('sales', 'SaleProduct')
+    SaleDailyRollup = apps.get_model('sales', 'SaleDailyRollup')
+    UserMonthlySpend = apps.get_model('sales', 'UserMonthlySpend')
+
+    rows = SaleProduct.objects.annotate(date=TruncDate('sale__datetime')).order_by().values(
+        'sale__shop', 'product', 'date').annotate(
+        total_quantity=Sum('quantity'), total_revenue=Sum('price'),
+        total_sale_count=Count('sale', distinct=True))
+    rollups = [SaleDailyRollup(shop_id=row['sale__shop'], product_id=row['product'], date=row['date'],
+                               quantity=row['total_quantity'], revenue=row['total_revenue'],
+                               sale_count=row['total_sale_count'])
+               for row in rows]
+    rows = Sale.objects.annotate(date=TruncDate('datetime')).order_by().values('shop', 'date').annotate(
+        total_revenue=Coalesce(Sum('saleproduct__price'), 0),
+        total_sale_count=Count('id', distinct=True))
+    rollups += [SaleDailyRollup(shop_id=row['shop'], date=row['date'],
+                                revenue=row['total_revenue'], sale_count=row['total_sale_count'])
+                for row in rows]
+    SaleDailyRollup.objects.bulk_create(rollups)
+
+    rows = Sale.objects.annotate(month=TruncMonth('datetime', output_field=models.DateField())).order_by().values(
+        'sender', 'shop', 'month').annotate(
+        total_amount=Coalesce(Sum('saleproduct__price'), 0),
+        total_sale_count=Count('id', distinct=True))
+    UserMonthlySpend.objects.bulk_create(
+        UserMonthlySpend(user_id=row['sender'], shop_id=row['shop'], month=row['month'],
+                         amount=row['total_amount'], sale_count=row['total_sale_count'])
+        for row in rows)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('shops', '0003_product_price_history'),
+        ('sales', '0002_auto_20190103_1237'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserMonthlySpend',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(verbose_name='Mois')),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Montant')),
+                ('sale_count', models.PositiveIntegerField(default=0, verbose_name='Nombre de ventes')),
+                ('shop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='shops.Shop')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'default_permissions': (),
+            },
+        ),
+        migrations.CreateModel(
+            name='SaleDailyRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Date')),
+                ('quantity', models.PositiveIntegerField(default=0, verbose_name='Quantité')),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Montant')),
+                ('sale_count', models.PositiveIntegerField(default=0, verbose_name='Nombre de ventes')),
+                ('product', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='shops.Product')),
+                ('shop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='shops.Shop')),
+            ],
+            options={
+                'default_permissions': (),
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='usermonthlyspend',
+            constraint=models.UniqueConstraint(fields=('user', 'shop', 'month'), name='unique_user_monthly_spend'),
+        ),
+        migrations.AddIndex(
+            model_name='saledailyrollup',
+            index=models.Index(fields=['shop', 'date'], name='sales_saled_shop_id_fd2625_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='saledailyrollup',
+            constraint=models.UniqueConstraint(fields=('shop', 'product', 'date'), name='unique_sale_daily_rollup_product'),
+        ),
+        migrations.AddConstraint(
+            model_name='saledailyrollup',
+            constraint=models.UniqueConstraint(condition=models.Q(product__isnull=True), fields=('shop', 'date'), name='unique_sale_daily_rollup_shop'),
+        ),
+        migrations.RunPython(backfill_sale_rollups, migrations.RunPython.noop),
+    ]
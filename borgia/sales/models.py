@@ -7,7 +7,7 @@ from django.core.validators import MinValueValidator
 from django.db import models
 from django.utils.timezone import now
 
-from shops.models import Product, Shop
+from shops.models import Product, Shop, get_lines_summary
 from users.models import User
 
 
@@ -30,6 +30,8 @@ class Sale(models.Model):
     :param module:
     :param shop:
     :param products:
+    :param products_summary: summary of the lines, see summarize.
+    :param total_amount: total price of the lines, see summarize.
 
 
     :type datetime: date string, default now
@@ -43,6 +45,8 @@ class Sale(models.Model):
     :type module:
     :type shop: Shop object
     :type products: Product object
+    :type products_summary: string, None if not computed yet
+    :type total_amount: decimal, None if not computed yet
 
     :note:: Initial Django Permission (add, change, delete, view) are added.
     """
@@ -58,6 +62,9 @@ class Sale(models.Model):
     module = GenericForeignKey('content_type', 'module_id')
     shop = models.ForeignKey(Shop, on_delete=models.CASCADE)
     products = models.ManyToManyField(Product, through='SaleProduct')
+    products_summary = models.TextField('Produits', blank=True, null=True)
+    total_amount = models.DecimalField('Montant', decimal_places=2, max_digits=9,
+                                       blank=True, null=True)
 
     def __str__(self):
         """
@@ -71,6 +78,16 @@ class Sale(models.Model):
     def pay(self):
         self.sender.debit(self.amount())
 
+    def summarize(self, lines):
+        """
+        Set the summary and the total of the lines of the sale, saved with it
+        so that the lists don't read the lines.
+
+        :param lines: SaleProduct objects, with their product.
+        """
+        self.products_summary = get_lines_summary(lines)
+        self.total_amount = sum(line.price for line in lines)
+
     def string_products(self):
         """
         Return a formated string concerning all products in this Sale.
@@ -80,6 +97,8 @@ class Sale(models.Model):
 
         :note:: Why do Events are excluded ?
         """
+        if self.products_summary is not None:
+            return self.products_summary
         string = ''
         for sp in self.saleproduct_set.all():
             string += sp.__str__() + ', '
@@ -95,6 +114,8 @@ class Sale(models.Model):
             return None
 
     def amount(self):
+        if self.total_amount is not None:
+            return self.total_amount
         amount = 0
         for sale_product in self.saleproduct_set.all():
             amount += sale_product.price
@@ -123,3 +144,84 @@ class SaleProduct(models.Model):
                 return self.product.__str__() + ' x ' + str(self.quantity)
             else:
                 return self.product.__str__()
+
+
+class SaleDailyRollup(models.Model):
+    """
+    Define the sales of a product in a shop during a day.
+
+    Rows are maintained by sales.utils.rollup_sale when a sale is created and
+    rebuilt by the command rebuild_sale_rollups. A row without product holds
+    the totals of the shop for the day.
+
+    :param shop: Related shop, mandatory.
+    :param product: Related product, None for the totals of the shop.
+    :param date: day of the sales, in local time, mandatory.
+    :param quantity: quantity sold, in cl, g or units.
+    :param revenue: amount of the sales.
+    :param sale_count: number of sales.
+    :type shop: Shop object
+    :type product: Product object
+    :type date: date string
+    :type quantity: integer
+    :type revenue: decimal
+    :type sale_count: integer
+    """
+    shop = models.ForeignKey(Shop, on_delete=models.CASCADE)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE,
+                                blank=True, null=True)
+    date = models.DateField('Date')
+    quantity = models.PositiveIntegerField('Quantité', default=0)
+    revenue = models.DecimalField('Montant', default=0, decimal_places=2,
+                                  max_digits=12)
+    sale_count = models.PositiveIntegerField('Nombre de ventes', default=0)
+
+    class Meta:
+        """
+        Remove default permissions for SaleDailyRollup
+        """
+        default_permissions = ()
+        indexes = [models.Index(fields=['shop', 'date'])]
+        constraints = [
+            models.UniqueConstraint(fields=['shop', 'product', 'date'],
+                                    name='unique_sale_daily_rollup_product'),
+            models.UniqueConstraint(fields=['shop', 'date'],
+                                    condition=models.Q(product__isnull=True),
+                                    name='unique_sale_daily_rollup_shop'),
+        ]
+
+
+class UserMonthlySpend(models.Model):
+    """
+    Define the spending of a user in a shop during a month.
+
+    Rows are maintained by sales.utils.rollup_sale when a sale is created and
+    rebuilt by the command rebuild_sale_rollups.
+
+    :param user: Related user (sender of the sales), mandatory.
+    :param shop: Related shop, mandatory.
+    :param month: first day of the month, in local time, mandatory.
+    :param amount: amount of the sales.
+    :param sale_count: number of sales.
+    :type user: User object
+    :type shop: Shop object
+    :type month: date string
+    :type amount: decimal
+    :type sale_count: integer
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    shop = models.ForeignKey(Shop, on_delete=models.CASCADE)
+    month = models.DateField('Mois')
+    amount = models.DecimalField('Montant', default=0, decimal_places=2,
+                                 max_digits=12)
+    sale_count = models.PositiveIntegerField('Nombre de ventes', default=0)
+
+    class Meta:
+        """
+        Remove default permissions for UserMonthlySpend
+        """
+        default_permissions = ()
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'shop', 'month'],
+                                    name='unique_user_monthly_spend'),
+        ]
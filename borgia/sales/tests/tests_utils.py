@@ -0,0 +1,68 @@
+import decimal
+
+from django.utils import timezone
+
+from modules.models import SelfSaleModule
+from sales.models import Sale, SaleDailyRollup, SaleProduct, UserMonthlySpend
+from sales.utils import rebuild_sale_rollups, rollup_sale, rollup_sales
+from shops.tests.tests_views import BaseShopsViewsTest
+
+
+class SaleRollupsTestCase(BaseShopsViewsTest):
+    def setUp(self):
+        super().setUp()
+        self.module = SelfSaleModule.objects.create(shop=self.shop1)
+        self.today = timezone.localdate()
+        self.create_sale(self.user1, ((self.product1, 2, '2.00'), (self.product2, 50, '1.00')))
+        self.create_sale(self.user1, ((self.product1, 1, '1.00'),))
+        self.create_sale(self.user2, ((self.product1, 1, '1.00'), (self.product1, 3, '3.00')))
+
+    def create_sale(self, sender, lines):
+        sale = Sale.objects.create(
+            sender=sender, recipient=self.user3, operator=self.user3,
+            shop=self.shop1, module=self.module)
+        sale_products = [SaleProduct.objects.create(sale=sale, product=product, quantity=quantity,
+                                                    price=decimal.Decimal(price))
+                         for product, quantity, price in lines]
+        rollup_sale(sale, sale_products)
+        return sale
+
+    def get_rollups(self):
+        return (
+            sorted(SaleDailyRollup.objects.filter(shop=self.shop1).values_list(
+                'product', 'date', 'quantity', 'revenue', 'sale_count'), key=str),
+            sorted(UserMonthlySpend.objects.filter(shop=self.shop1).values_list(
+                'user', 'month', 'amount', 'sale_count'), key=str)
+        )
+
+    def test_daily_rollups(self):
+        product1 = SaleDailyRollup.objects.get(product=self.product1)
+        self.assertEqual((product1.date, product1.quantity, product1.revenue, product1.sale_count),
+                         (self.today, 7, decimal.Decimal('7.00'), 3))
+        shop1 = SaleDailyRollup.objects.get(shop=self.shop1, product__isnull=True)
+        self.assertEqual((shop1.revenue, shop1.sale_count), (decimal.Decimal('8.00'), 3))
+
+    def test_monthly_spends(self):
+        spend = UserMonthlySpend.objects.get(user=self.user1)
+        self.assertEqual((spend.shop, spend.month, spend.amount, spend.sale_count),
+                         (self.shop1, self.today.replace(day=1), decimal.Decimal('4.00'), 2))
+
+    def test_rebuild_same_as_incremental(self):
+        rollups = self.get_rollups()
+        SaleDailyRollup.objects.all().delete()
+        UserMonthlySpend.objects.all().delete()
+        rebuild_sale_rollups([self.shop1])
+        self.assertEqual(self.get_rollups(), rollups)
+
+    def test_rebuild_other_shop(self):
+        rollups = self.get_rollups()
+        rebuild_sale_rollups([self.shop2])
+        self.assertEqual(self.get_rollups(), rollups)
+
+    def test_rollup_sales_same_as_rollup_sale(self):
+        rollups = self.get_rollups()
+        sales = [(sale, list(sale.saleproduct_set.all())) for sale in Sale.objects.filter(shop=self.shop1)]
+        SaleDailyRollup.objects.all().delete()
+        UserMonthlySpend.objects.all().delete()
+        rollup_sales(sales)
+        self.assertEqual(self.get_rollups(), rollups)
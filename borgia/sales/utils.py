@@ -0,0 +1,153 @@
+"""
+Daily and monthly rollups of the sales.
+
+Dashboards read these small tables instead of scanning every sale. They're
+updated in the transaction creating a sale, and can be rebuilt from the sales
+with the command rebuild_sale_rollups.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import Count, DateField, F, Sum
+from django.db.models.functions import Coalesce, TruncDate, TruncMonth
+from django.utils import timezone
+
+from sales.models import Sale, SaleDailyRollup, SaleProduct, UserMonthlySpend
+
+
+def add_to_rollup(model, keys, values):
+    """
+    Add the values to the row of the keys, created if needed.
+
+    :param model: SaleDailyRollup or UserMonthlySpend.
+    :param keys: dict of the fields identifying the row.
+    :param values: dict of the amounts to add.
+    """
+    increments = {field: F(field) + value for field, value in values.items()}
+    if model.objects.filter(**keys).update(**increments):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**keys, **values)
+    except IntegrityError:
+        # Created in between by a concurrent sale.
+        model.objects.filter(**keys).update(**increments)
+
+
+def rollup_sale(sale, sale_products=None):
+    """
+    Add a sale to the daily rollups of its shop and products, and to the
+    monthly spend of its sender.
+
+    Must be called once per sale, in the transaction creating it, after its
+    products are saved.
+
+    :param sale: Sale
+    :param sale_products: list of SaleProduct of the sale, loaded by default.
+    """
+    if sale_products is None:
+        sale_products = sale.saleproduct_set.all()
+    date = timezone.localdate(sale.datetime)
+
+    products = {}
+    for sale_product in sale_products:
+        quantity, revenue = products.get(sale_product.product_id, (0, 0))
+        products[sale_product.product_id] = (quantity + sale_product.quantity,
+                                              revenue + sale_product.price)
+    amount = sum(revenue for quantity, revenue in products.values())
+
+    for product_id, (quantity, revenue) in products.items():
+        add_to_rollup(SaleDailyRollup,
+                      {'shop_id': sale.shop_id, 'product_id': product_id, 'date': date},
+                      {'quantity': quantity, 'revenue': revenue, 'sale_count': 1})
+    add_to_rollup(SaleDailyRollup,
+                  {'shop_id': sale.shop_id, 'product': None, 'date': date},
+                  {'revenue': amount, 'sale_count': 1})
+    add_to_rollup(UserMonthlySpend,
+                  {'user_id': sale.sender_id, 'shop_id': sale.shop_id, 'month': date.replace(day=1)},
+                  {'amount': amount, 'sale_count': 1})
+
+
+def rollup_sales(sales):
+    """
+    Add several sales to the rollups, like rollup_sale, with a single update
+    per row reached rather than per sale.
+
+    :param sales: list of (sale, list of SaleProduct of the sale).
+    """
+    increments = {}
+    for sale, sale_products in sales:
+        date = timezone.localdate(sale.datetime)
+        products = {}
+        for sale_product in sale_products:
+            quantity, revenue = products.get(sale_product.product_id, (0, 0))
+            products[sale_product.product_id] = (quantity + sale_product.quantity,
+                                                  revenue + sale_product.price)
+        amount = sum(revenue for quantity, revenue in products.values())
+
+        rows = [(SaleDailyRollup, (('shop_id', sale.shop_id), ('product_id', product_id), ('date', date)),
+                 {'quantity': quantity, 'revenue': revenue, 'sale_count': 1})
+                for product_id, (quantity, revenue) in products.items()]
+        rows.append((SaleDailyRollup, (('shop_id', sale.shop_id), ('product', None), ('date', date)),
+                     {'revenue': amount, 'sale_count': 1}))
+        rows.append((UserMonthlySpend,
+                     (('user_id', sale.sender_id), ('shop_id', sale.shop_id), ('month', date.replace(day=1))),
+                     {'amount': amount, 'sale_count': 1}))
+        for model, keys, values in rows:
+            totals = increments.setdefault((model, keys), dict.fromkeys(values, 0))
+            for field, value in values.items():
+                totals[field] += value
+
+    for (model, keys), values in increments.items():
+        add_to_rollup(model, dict(keys), values)
+
+
+def rebuild_sale_rollups(shops=None):
+    """
+    Recalculate the rollups from the sales, in a few grouped queries and bulk
+    creations.
+
+    :param shops: queryset or list of shops to rebuild, all by default.
+    """
+    sales = Sale.objects.all()
+    sale_products = SaleProduct.objects.all()
+    daily_rollups = SaleDailyRollup.objects.all()
+    monthly_spends = UserMonthlySpend.objects.all()
+    if shops is not None:
+        sales = sales.filter(shop__in=shops)
+        sale_products = sale_products.filter(sale__shop__in=shops)
+        daily_rollups = daily_rollups.filter(shop__in=shops)
+        monthly_spends = monthly_spends.filter(shop__in=shops)
+
+    with transaction.atomic():
+        daily_rollups.delete()
+        monthly_spends.delete()
+
+        rows = sale_products.annotate(
+            date=TruncDate('sale__datetime')
+        ).order_by().values('sale__shop', 'product', 'date').annotate(
+            total_quantity=Sum('quantity'),
+            total_revenue=Sum('price'),
+            total_sale_count=Count('sale', distinct=True))
+        rollups = [SaleDailyRollup(shop_id=row['sale__shop'], product_id=row['product'], date=row['date'],
+                                   quantity=row['total_quantity'], revenue=row['total_revenue'],
+                                   sale_count=row['total_sale_count'])
+                   for row in rows]
+
+        rows = sales.annotate(
+            date=TruncDate('datetime')
+        ).order_by().values('shop', 'date').annotate(
+            total_revenue=Coalesce(Sum('saleproduct__price'), 0),
+            total_sale_count=Count('id', distinct=True))
+        rollups += [SaleDailyRollup(shop_id=row['shop'], date=row['date'],
+                                    revenue=row['total_revenue'], sale_count=row['total_sale_count'])
+                    for row in rows]
+        SaleDailyRollup.objects.bulk_create(rollups)
+
+        rows = sales.annotate(
+            month=TruncMonth('datetime', output_field=DateField())
+        ).order_by().values('sender', 'shop', 'month').annotate(
+            total_amount=Coalesce(Sum('saleproduct__price'), 0),
+            total_sale_count=Count('id', distinct=True))
+        UserMonthlySpend.objects.bulk_create(
+            UserMonthlySpend(user_id=row['sender'], shop_id=row['shop'], month=row['month'],
+                             amount=row['total_amount'], sale_count=row['total_sale_count'])
+            for row in rows)
@@ -2,6 +2,7 @@ from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
 from django.db.models import Q
 from django.shortcuts import render
 
+from borgia.mixins import ReplicaReadMixin
 from borgia.views import BorgiaFormView, BorgiaView
 from sales.forms import SaleListSearchDateForm
 from sales.mixins import SaleMixin
@@ -9,7 +10,7 @@ from sales.models import Sale
 from shops.mixins import ShopMixin
 
 
-class SaleList(ShopMixin, BorgiaFormView):
+class SaleList(ReplicaReadMixin, ShopMixin, BorgiaFormView):
     """
     View to list sales.
 
@@ -20,6 +21,8 @@ class SaleList(ShopMixin, BorgiaFormView):
     types of transactions, please refer to other classes (RechargingList,
     TransfertList and ExceptionnalMovementList).
     """
+    # The search form only reads.
+    replica_methods = ('GET', 'HEAD', 'POST')
     permission_required = 'sales.view_sale'
     menu_type = 'shops'
     template_name = 'sales/sale_shop_list.html'
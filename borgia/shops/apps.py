@@ -6,4 +6,6 @@ class ShopConfig(AppConfig):
 
     def ready(self):
         # Import shop signals
-        from shops.signals import create_shop_groups
+        from shops.signals import (bump_products_version, bump_shops_version,
+                                   create_shop_groups,
+                                   invalidate_product_choices_on_change)
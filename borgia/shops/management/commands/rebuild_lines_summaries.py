@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from sales.models import Sale
+from shops.utils import rebuild_lines_summaries
+from stocks.models import StockEntry
+
+
+class Command(BaseCommand):
+    help = ("Save the summaries and totals of the lines of the sales and stock "
+            "entries, shown in the lists.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help="Recalculate every summary, not only the missing ones.")
+
+    def handle(self, *args, **options):
+        for model in (Sale, StockEntry):
+            objects = model.objects.all()
+            if not options['all']:
+                objects = objects.filter(products_summary__isnull=True)
+
+            count = rebuild_lines_summaries(objects)
+            if options['verbosity'] > 0:
+                self.stdout.write("Summaries of %d %s rebuilt." % (count, model._meta.verbose_name_plural))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from shops.models import Product
+from shops.utils import update_stock_counters
+
+
+class Command(BaseCommand):
+    help = ("Recalculate the stock counters of the products from their "
+            "inventories, stock entries and sales.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shop', default=None,
+                            help="Name of the shop to rebuild, all shops by default.")
+
+    def handle(self, *args, **options):
+        products = Product.objects.all()
+        if options['shop']:
+            products = products.filter(shop__name=options['shop'])
+
+        with transaction.atomic():
+            update_stock_counters(products)
+        if options['verbosity'] > 0:
+            self.stdout.write("Stock counters of %d products rebuilt." % products.count())
@@ -0,0 +1,65 @@
+# Generated by Django 2.2.28 on 2026-10-19 00:03
+
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def backfill_stock_counters(apps, schema_editor):
+    """
+    Same calculation as shops.utils.update_stock_counters, with the
+    historical models.
+    """
+    Product = apps.get_model('shops', 'Product')
+    InventoryProduct = apps.get_model('stocks', 'InventoryProduct')
+    StockEntryProduct = apps.get_model('stocks', 'StockEntryProduct')
+    SaleProduct = apps.get_model('sales', 'SaleProduct')
+
+    for product in Product.objects.all():
+        last_inventoryproduct = InventoryProduct.objects.filter(
+            product=product).select_related('inventory').order_by('-id').first()
+        stockentryproducts = StockEntryProduct.objects.filter(product=product)
+        saleproducts = SaleProduct.objects.filter(product=product)
+        if last_inventoryproduct is not None:
+            product.stock_base = last_inventoryproduct.quantity
+            product.last_inventory_datetime = last_inventoryproduct.inventory.datetime
+            stockentryproducts = stockentryproducts.filter(
+                stockentry__datetime__gte=product.last_inventory_datetime)
+            saleproducts = saleproducts.filter(
+                sale__datetime__gte=product.last_inventory_datetime)
+        product.stock_input = stockentryproducts.aggregate(total=Sum('quantity'))['total'] or 0
+        product.stock_output = saleproducts.aggregate(total=Sum('quantity'))['total'] or 0
+        product.save(update_fields=['stock_base', 'stock_input', 'stock_output',
+                                    'last_inventory_datetime'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shops', '0001_initial'),
+        ('sales', '0002_auto_20190103_1237'),
+        ('stocks', '0002_auto_20190103_1237'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='last_inventory_datetime',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Date du dernier inventaire'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='stock_base',
+            field=models.IntegerField(default=0, verbose_name='Stock au dernier inventaire'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='stock_input',
+            field=models.IntegerField(default=0, verbose_name='Entrées depuis le dernier inventaire'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='stock_output',
+            field=models.IntegerField(default=0, verbose_name='Ventes depuis le dernier inventaire'),
+        ),
+        migrations.RunPython(backfill_stock_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,79 @@
+# Generated by Django 2.2.28 on 2026-10-19 00:18
+
+import decimal
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def backfill_price_history(apps, schema_editor):
+    """
+    Record the current price of every product, same calculation as
+    shops.utils.record_price_history, historical models don't have its
+    methods.
+    """
+    Configuration = apps.get_model('configurations', 'Configuration')
+    Product = apps.get_model('shops', 'Product')
+    ProductPriceHistory = apps.get_model('shops', 'ProductPriceHistory')
+    StockEntryProduct = apps.get_model('stocks', 'StockEntryProduct')
+
+    margin_profit = Configuration.objects.filter(name='MARGIN_PROFIT').first()
+    if margin_profit is None:
+        # Products can't exist without the configuration, loaded with them.
+        return
+    margin_profit = float(margin_profit.value)
+
+    price_histories = []
+    for product in Product.objects.all():
+        last_stockentryproduct = StockEntryProduct.objects.filter(
+            product=product).order_by('-stockentry__datetime').first()
+        automatic_price = decimal.Decimal(0)
+        if last_stockentryproduct is not None and last_stockentryproduct.quantity:
+            factor = {'G': 1000, 'CL': 100}.get(product.unit, 1)
+            unit_price = decimal.Decimal(
+                factor * last_stockentryproduct.price / last_stockentryproduct.quantity)
+            automatic_price = round(decimal.Decimal(
+                unit_price * product.correcting_factor * decimal.Decimal(1 + margin_profit / 100)), 4)
+        price_histories.append(ProductPriceHistory(
+            product=product,
+            price=product.manual_price if product.is_manual else automatic_price,
+            automatic_price=automatic_price,
+            is_manual=product.is_manual,
+            manual_price=product.manual_price,
+            correcting_factor=product.correcting_factor,
+            margin_profit=round(decimal.Decimal(str(margin_profit)), 4)))
+    ProductPriceHistory.objects.bulk_create(price_histories)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('configurations', '0001_initial'),
+        ('shops', '0002_product_stock_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductPriceHistory',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('valid_from', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Date de début')),
+                ('price', models.DecimalField(decimal_places=4, max_digits=9, verbose_name='Prix')),
+                ('automatic_price', models.DecimalField(decimal_places=4, max_digits=9, verbose_name='Prix automatique')),
+                ('is_manual', models.BooleanField(verbose_name='Gestion manuelle du prix')),
+                ('manual_price', models.DecimalField(decimal_places=2, max_digits=9, verbose_name='Prix manuel')),
+                ('correcting_factor', models.DecimalField(decimal_places=4, max_digits=9, verbose_name='Facteur correcteur de ventes')),
+                ('margin_profit', models.DecimalField(decimal_places=4, max_digits=9, verbose_name='Marge')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='shops.Product')),
+            ],
+            options={
+                'default_permissions': (),
+            },
+        ),
+        migrations.AddIndex(
+            model_name='productpricehistory',
+            index=models.Index(fields=['product', 'valid_from'], name='shops_produ_product_69c98d_idx'),
+        ),
+        migrations.RunPython(backfill_price_history, migrations.RunPython.noop),
+    ]
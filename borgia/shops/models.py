@@ -4,9 +4,41 @@ from django.contrib.auth.models import Group
 from django.core.exceptions import ImproperlyConfigured, ObjectDoesNotExist
 from django.core.validators import MinValueValidator, RegexValidator
 from django.db import models
+from django.utils.timezone import now
 
 from configurations.utils import configuration_get
 
+STOCK_COUNTER_FIELDS = ('stock_base', 'stock_input', 'stock_output',
+                        'last_inventory_datetime')
+
+
+def get_unit_price(unit, price, quantity):
+    """
+    Return the price per L, kg or unit of a quantity in cl, g or units.
+    """
+    if unit:
+        if unit == 'G':
+            return decimal.Decimal(1000 * price / quantity)
+        if unit == 'CL':
+            return decimal.Decimal(100 * price / quantity)
+    else:
+        return decimal.Decimal(price / quantity)
+
+
+def get_lines_summary(lines):
+    """
+    Return the summary of the product lines of a sale or a stock entry, shown
+    in the lists.
+    """
+    return ', '.join(str(line) for line in lines)
+
+
+def get_automatic_price(unit_price, correcting_factor, margin_profit):
+    """
+    Return the selling price from the buying unit price of the last stock entry.
+    """
+    return round(decimal.Decimal(unit_price * correcting_factor * decimal.Decimal(1 + margin_profit / 100)), 4)
+
 
 class Shop(models.Model):
     """
@@ -74,6 +106,10 @@ class Product(models.Model):
     :param is_removed: is the product removed.
     :param unit: unit of the product.
     :param correcting_factor: for automatic price.
+    :param stock_base: quantity of the last inventory.
+    :param stock_input: quantity entered in stock since the last inventory.
+    :param stock_output: quantity sold since the last inventory.
+    :param last_inventory_datetime: date of the last inventory.
     :type name: string
     :type is_manual: bool
     :type manual_price: decimal
@@ -82,6 +118,13 @@ class Product(models.Model):
     :type is_removed: bool
     :type unit: string
     :type correcting_factor: decimal
+    :type stock_base: integer
+    :type stock_input: integer
+    :type stock_output: integer
+    :type last_inventory_datetime: date string
+
+    :note:: Stock counters are maintained by shops.signals and only written by
+    shops.utils.update_stock_counters, they're never overwritten by save.
     """
     UNIT_CHOICES = (('CL', 'cl'), ('G', 'g'))
 
@@ -102,6 +145,11 @@ class Product(models.Model):
                                                 MinValueValidator(decimal.Decimal(0))])
     is_active = models.BooleanField('Actif', default=True)
     is_removed = models.BooleanField('Retiré', default=False)
+    stock_base = models.IntegerField('Stock au dernier inventaire', default=0)
+    stock_input = models.IntegerField('Entrées depuis le dernier inventaire', default=0)
+    stock_output = models.IntegerField('Ventes depuis le dernier inventaire', default=0)
+    last_inventory_datetime = models.DateTimeField('Date du dernier inventaire',
+                                                   blank=True, null=True)
 
     class Meta:
         """
@@ -116,6 +164,17 @@ class Product(models.Model):
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        """
+        Save the product without its stock counters, which may have been
+        updated since the instance was loaded.
+        """
+        if not self._state.adding and not kwargs.get('force_insert') and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in STOCK_COUNTER_FIELDS]
+        super().save(*args, **kwargs)
+
     def get_unit_display(self):
         if self.unit is not None:
             return self.unit.lower()
@@ -159,14 +218,33 @@ class Product(models.Model):
             last_stockentry = self.stockentryproduct_set.order_by(
                 '-stockentry__datetime').first()
             if last_stockentry is not None:
-                return round(decimal.Decimal(last_stockentry.unit_price() * self.correcting_factor * decimal.Decimal(1 + margin_profit / 100)), 4)
+                return get_automatic_price(last_stockentry.unit_price(), self.correcting_factor, margin_profit)
             else:
                 return 0
         except IndexError:
             return decimal.Decimal(0)
 
-    def deviating_price_from_auto(self):
-        automatic_price = self.get_automatic_price()
+    def get_last_price_history(self):
+        """
+        Return the current price history of the product, None if the price
+        was never recorded.
+        """
+        return self.productpricehistory_set.order_by('-valid_from').first()
+
+    def get_price_at(self, datetime):
+        """
+        Return the price of the product at the datetime, from its price history.
+        Return None if the price wasn't recorded yet.
+        """
+        price_history = self.productpricehistory_set.filter(
+            valid_from__lte=datetime).order_by('-valid_from').first()
+        if price_history is None:
+            return None
+        return price_history.price
+
+    def deviating_price_from_auto(self, automatic_price=None):
+        if automatic_price is None:
+            automatic_price = self.get_automatic_price()
         if automatic_price == 0:
             return 0
         else:
@@ -233,7 +311,13 @@ class Product(models.Model):
         Calculate the theorical stock since the last inventory.
         Used in order to modify the correcting_factor comparing this value with
         the value given by the next inventory.
+
+        The current stock (offset 0) is calculated from the stock counters.
         """
+        if offset == 0:
+            return self.stock_base + self.stock_input - \
+                self.stock_output * decimal.Decimal(self.correcting_factor)
+
         stock_base = self.last_inventoryproduct_value(offset)
         stock_input = sum(
             se.quantity for se in self.stockentries_since_last_inventory(offset))
@@ -259,35 +343,48 @@ class Product(models.Model):
 
         return self.get_quantity_display(current_stock_estimated)
 
-    def update_correcting_factor(self, next_stock):
+
+class ProductPriceHistory(models.Model):
+    """
+    Define the price of a product from a date, until the next price of the
+    product.
+
+    Written by shops.utils.record_price_history each time the price, or what
+    it is calculated from, changes.
+
+    :param product: Related product.
+    :param valid_from: date from which the price is applied.
+    :param price: price of the product, manual or automatic.
+    :param automatic_price: price calculated from the last stock entry.
+    :param is_manual: is the price set manually.
+    :param manual_price: price if set manually.
+    :param correcting_factor: correcting factor of the product.
+    :param margin_profit: margin profit of the association, in percent.
+    :type product:
+    :type valid_from: date string
+    :type price: decimal
+    :type automatic_price: decimal
+    :type is_manual: bool
+    :type manual_price: decimal
+    :type correcting_factor: decimal
+    :type margin_profit: decimal
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    valid_from = models.DateTimeField('Date de début', default=now)
+    price = models.DecimalField('Prix', decimal_places=4, max_digits=9)
+    automatic_price = models.DecimalField('Prix automatique', decimal_places=4, max_digits=9)
+    is_manual = models.BooleanField('Gestion manuelle du prix')
+    manual_price = models.DecimalField('Prix manuel', decimal_places=2, max_digits=9)
+    correcting_factor = models.DecimalField('Facteur correcteur de ventes',
+                                            decimal_places=4, max_digits=9)
+    margin_profit = models.DecimalField('Marge', decimal_places=4, max_digits=9)
+
+    class Meta:
         """
-        Calculate the corrected correcting_factor comparing the next stock and
-        the one currently calculated.
-        estimated_stock = last_inventory + input - output_estimated
-        real_stock = last_inventory + input - output_real
-        diff = input_estimated - input_real
-        estimated_stock - real_stock = last_inventory + input - output_estimated - last_inventory - input + output_real
-        estimated_stock - real_stock = output_real - output_estimated
-        I need: estimated_stock - real_stock = 0
-        => output_real = output_estimated
-        output_real = sales * correcting_factor
-        correcting_factor = output_real / sales
-        correcting_factor = (last_inventory + input - real_stock) / sales
-
-        If no sales are registered since the last inventory (stock_output = 0),
-        don't update the correcting factor (it should tend to infinity).
-        It appends when ZeroDivisionError is raised.
+        Remove default permissions for ProductPriceHistory
         """
-        stock_base = self.last_inventoryproduct_value(1)
-        stock_input = sum(
-            se.quantity for se in self.stockentries_since_last_inventory(1))
-        stock_output = sum(
-            s.quantity for s in self.sales_since_last_inventory(1))
+        default_permissions = ()
+        indexes = [models.Index(fields=['product', 'valid_from'])]
 
-        try:
-            self.correcting_factor = decimal.Decimal(
-                (stock_base + stock_input - next_stock) / stock_output
-            )
-            self.save()
-        except (ZeroDivisionError, decimal.DivisionByZero, decimal.DivisionUndefined, decimal.InvalidOperation):
-            pass
+    def __str__(self):
+        return str(self.product) + ' ' + str(self.valid_from) + ' : ' + str(self.price)
@@ -1,12 +1,16 @@
 from django.contrib.auth.models import Group, Permission
 from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ObjectDoesNotExist
-from django.db.models.signals import post_save
+from django.db.models import F, Q
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 
-from shops.models import Shop
+from borgia.utils import (PRODUCTS_VERSION, SHOPS_VERSION, STOCKS_VERSION,
+                          bump_data_version, bump_data_version_on_commit)
+from shops.models import Product, Shop
 from shops.utils import (DEFAULT_PERMISSIONS_ASSOCIATES,
-                         DEFAULT_PERMISSIONS_CHIEFS)
+                         DEFAULT_PERMISSIONS_CHIEFS,
+                         invalidate_product_choices, update_stock_counters)
 
 
 @receiver(post_save, sender=Shop)
@@ -56,3 +60,85 @@ def create_shop_groups(instance, created, **kwargs):
         else:
             vice_presidents.permissions.add(manage_chiefs)
             vice_presidents.save()
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product_choices_on_change(instance, **kwargs):
+    """
+    Invalidate the cached choices of products of the shop when one of its
+    products is saved or deleted.
+    """
+    invalidate_product_choices(instance.shop_id)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def bump_products_version(**kwargs):
+    bump_data_version(PRODUCTS_VERSION)
+
+
+@receiver(post_save, sender=Shop)
+@receiver(post_delete, sender=Shop)
+def bump_shops_version(**kwargs):
+    bump_data_version(SHOPS_VERSION)
+
+
+def count_stock_movement(instance, counter_field, datetime, sign):
+    """
+    Add (or remove) the quantity of a sale or stock entry line to the stock
+    counters of its product, if it's dated after the last inventory.
+
+    The condition and the update are done in a single query.
+    """
+    quantity = sign * instance.quantity
+    updated = Product.objects.filter(pk=instance.product_id).filter(
+        Q(last_inventory_datetime__isnull=True) | Q(last_inventory_datetime__lte=datetime)
+    ).update(**{counter_field: F(counter_field) + quantity})
+    bump_data_version_on_commit(STOCKS_VERSION)
+
+    # Keep the related instance, if loaded, up to date.
+    product_field = instance.__class__.product.field
+    if updated and product_field.is_cached(instance):
+        setattr(instance.product, counter_field, getattr(instance.product, counter_field) + quantity)
+
+
+@receiver(post_save, sender='sales.SaleProduct')
+def count_sale_product(instance, created, raw, **kwargs):
+    if raw:
+        return
+    if created:
+        count_stock_movement(instance, 'stock_output', instance.sale.datetime, 1)
+    else:
+        update_stock_counters([instance.product])
+
+
+@receiver(post_delete, sender='sales.SaleProduct')
+def uncount_sale_product(instance, **kwargs):
+    count_stock_movement(instance, 'stock_output', instance.sale.datetime, -1)
+
+
+@receiver(post_save, sender='stocks.StockEntryProduct')
+def count_stockentry_product(instance, created, raw, **kwargs):
+    if raw:
+        return
+    if created:
+        count_stock_movement(instance, 'stock_input', instance.stockentry.datetime, 1)
+    else:
+        update_stock_counters([instance.product])
+
+
+@receiver(post_delete, sender='stocks.StockEntryProduct')
+def uncount_stockentry_product(instance, **kwargs):
+    count_stock_movement(instance, 'stock_input', instance.stockentry.datetime, -1)
+
+
+@receiver(post_save, sender='stocks.InventoryProduct')
+@receiver(post_delete, sender='stocks.InventoryProduct')
+def reset_stock_counters(instance, raw=False, **kwargs):
+    """
+    An inventory changes the base of the stock counters, they're recalculated.
+    """
+    if raw:
+        return
+    update_stock_counters([instance.product])
@@ -1,8 +1,18 @@
+import datetime
+import decimal
+
 from django.contrib.auth.models import Group
 from django.core.exceptions import ObjectDoesNotExist
 from django.test import TestCase
+from django.utils import timezone
 
-from shops.models import Shop
+from modules.models import SelfSaleModule
+from sales.models import Sale, SaleProduct
+from shops.models import Product, Shop
+from shops.utils import update_stock_counters
+from stocks.models import (Inventory, InventoryProduct, StockEntry,
+                           StockEntryProduct)
+from users.models import User
 
 
 class CreateShopGroupTestCase(TestCase):
@@ -19,3 +29,105 @@ class CreateShopGroupTestCase(TestCase):
             Group.objects.get(name='associates-'+self.shop1.name)
         except ObjectDoesNotExist:
             self.fail("Shop creation should also create management groups")
+
+
+class StockCountersTestCase(TestCase):
+    fixtures = ['initial']
+
+    def setUp(self):
+        self.operator = User.objects.get(pk=1)
+        self.shop1 = Shop.objects.create(
+            name="shop1",
+            description="The first shop ever.",
+            color="#F4FA58")
+        self.product1 = Product.objects.create(
+            name='Product1 name', unit='CL', shop=self.shop1,
+            correcting_factor=decimal.Decimal('1.1'))
+        self.module1 = SelfSaleModule.objects.create(shop=self.shop1)
+
+    def get_stock_recalculated(self, product):
+        "Stock as calculated before the stock counters"
+        product = Product.objects.get(pk=product.pk)
+        return (product.last_inventoryproduct_value()
+                + sum(se.quantity for se in product.stockentries_since_last_inventory())
+                - sum(s.quantity for s in product.sales_since_last_inventory())
+                * decimal.Decimal(product.correcting_factor))
+
+    def assertStockCounted(self, product, expected):
+        self.assertEqual(self.get_stock_recalculated(product), expected)
+        self.assertEqual(Product.objects.get(pk=product.pk).current_stock_estimated(), expected)
+        self.assertEqual(product.current_stock_estimated(), expected)
+
+    def sell(self, quantity, datetime=None):
+        sale = Sale.objects.create(operator=self.operator, sender=self.operator,
+                                   recipient=self.operator, shop=self.shop1,
+                                   module=self.module1)
+        if datetime is not None:
+            sale.datetime = datetime
+            sale.save()
+        return SaleProduct.objects.create(sale=sale, product=self.product1,
+                                          quantity=quantity, price=1)
+
+    def enter(self, quantity):
+        stockentry = StockEntry.objects.create(operator=self.operator, shop=self.shop1)
+        return StockEntryProduct.objects.create(stockentry=stockentry, product=self.product1,
+                                                quantity=quantity, price=10)
+
+    def inventory(self, quantity):
+        inventory = Inventory.objects.create(operator=self.operator, shop=self.shop1)
+        return InventoryProduct.objects.create(inventory=inventory, product=self.product1,
+                                               quantity=quantity)
+
+    def test_without_inventory(self):
+        self.enter(1000)
+        self.sell(25)
+        self.sell(50)
+        self.assertStockCounted(self.product1, decimal.Decimal('917.5'))
+
+    def test_inventory(self):
+        self.enter(1000)
+        self.sell(25)
+        self.inventory(900)
+        self.assertStockCounted(self.product1, 900)
+        self.enter(100)
+        self.sell(10)
+        self.assertStockCounted(self.product1, 989)
+
+    def test_sale_before_last_inventory(self):
+        self.inventory(900)
+        self.sell(10, timezone.now() - datetime.timedelta(days=1))
+        self.assertStockCounted(self.product1, 900)
+
+    def test_deletions(self):
+        self.enter(1000)
+        saleproduct = self.sell(25)
+        inventoryproduct = self.inventory(900)
+        self.sell(10)
+        inventoryproduct.delete()
+        self.assertStockCounted(self.product1, 1000 - 35 * decimal.Decimal('1.1'))
+        saleproduct.sale.delete()
+        # Sale products deleted in cascade are loaded without their product.
+        self.product1.refresh_from_db()
+        self.assertStockCounted(self.product1, 989)
+
+    def test_update(self):
+        saleproduct = self.sell(25)
+        saleproduct.quantity = 30
+        saleproduct.save()
+        self.assertStockCounted(self.product1, -33)
+
+    def test_outdated_product_save(self):
+        outdated_product = Product.objects.get(pk=self.product1.pk)
+        self.enter(1000)
+        outdated_product.name = 'Product1 new name'
+        outdated_product.save()
+        self.assertStockCounted(self.product1, 1000)
+
+    def test_update_stock_counters(self):
+        self.enter(1000)
+        self.inventory(900)
+        self.sell(10)
+        Product.objects.filter(pk=self.product1.pk).update(
+            stock_base=0, stock_input=0, stock_output=0, last_inventory_datetime=None)
+        update_stock_counters(Product.objects.all())
+        self.assertStockCounted(Product.objects.get(pk=self.product1.pk), 889)
@@ -37,6 +37,7 @@ class ShopProductsNamedURLTests(TestCase):
         "Named products URLs should be reversible"
         expected_named_urls = [
             ('url_product_list', [], {'shop_pk': 53}),
+            ('url_product_list_download_xlsx', [], {'shop_pk': 53}),
             ('url_product_create', [], {'shop_pk': 53}),
             ('url_product_retrieve', [], {'shop_pk': 53, 'product_pk': 53}),
             ('url_product_update', [], {'shop_pk': 53, 'product_pk': 53}),
@@ -0,0 +1,184 @@
+import datetime
+import decimal
+
+from django.utils import timezone
+
+from modules.models import SelfSaleModule
+from sales.models import Sale, SaleProduct
+from configurations.utils import configuration_get
+from shops.models import Product, ProductPriceHistory
+from shops.tests.tests_views import BaseShopsViewsTest
+from shops.utils import (get_product_choices, get_shop_stock_report,
+                         rebuild_lines_summaries, record_price_history)
+from stocks.models import (Inventory, InventoryProduct, StockEntry,
+                           StockEntryProduct)
+
+
+class ShopStockReportTestCase(BaseShopsViewsTest):
+    def setUp(self):
+        super().setUp()
+        module = SelfSaleModule.objects.create(shop=self.shop1)
+        self.product3.correcting_factor = decimal.Decimal('1.2')
+        self.product3.save()
+
+        stockentry = StockEntry.objects.create(
+            operator=self.user3, shop=self.shop1,
+            datetime=timezone.now() - datetime.timedelta(days=2))
+        StockEntryProduct.objects.create(
+            stockentry=stockentry, product=self.product1, quantity=24, price=12)
+        StockEntryProduct.objects.create(
+            stockentry=stockentry, product=self.product2, quantity=3000, price=45)
+        StockEntryProduct.objects.create(
+            stockentry=stockentry, product=self.product3, quantity=5000, price=40)
+
+        inventory = Inventory.objects.create(
+            operator=self.user3, shop=self.shop1,
+            datetime=timezone.now() - datetime.timedelta(days=1))
+        InventoryProduct.objects.create(
+            inventory=inventory, product=self.product3, quantity=4500)
+
+        sale = Sale.objects.create(
+            sender=self.user1, recipient=self.user3, operator=self.user3,
+            shop=self.shop1, module=module)
+        for product, quantity in ((self.product1, 2), (self.product2, 50), (self.product3, 250)):
+            SaleProduct.objects.create(sale=sale, product=product, quantity=quantity, price=1)
+
+    def test_same_as_products(self):
+        report = get_shop_stock_report(self.shop1)
+        self.assertEqual([row['product'] for row in report],
+                         list(self.shop1.product_set.filter(is_removed=False)))
+        for row in report:
+            with self.subTest(product=row['product'].name):
+                product = Product.objects.get(pk=row['product'].pk)
+                self.assertEqual(row['stock_estimated'], product.current_stock_estimated())
+                self.assertEqual(row['stock_estimated_display'],
+                                 product.get_current_stock_estimated_display())
+                self.assertEqual(row['price'], product.get_price())
+                self.assertEqual(row['strategy'], product.get_strategy_display())
+
+    def test_since_last_inventory(self):
+        row = get_shop_stock_report(self.shop1, Product.objects.filter(pk=self.product3.pk))[0]
+        self.assertEqual(row['last_inventory_quantity'], 4500)
+        self.assertEqual(row['stock_input'], 0)
+        self.assertEqual(row['stock_output'], 250)
+        self.assertEqual(row['stock_estimated'], 4200)
+        self.assertEqual(row['stock_value'], decimal.Decimal('33.60'))
+
+    def test_from_stock_counters(self):
+        Product.objects.filter(pk=self.product3.pk).update(stock_base=1000, stock_input=100, stock_output=0)
+        row = get_shop_stock_report(self.shop1, Product.objects.filter(pk=self.product3.pk))[0]
+        self.assertEqual(row['last_inventory_quantity'], 1000)
+        self.assertEqual(row['stock_input'], 100)
+        self.assertEqual(row['stock_output'], 0)
+        self.assertEqual(row['stock_estimated'], 1100)
+
+    def test_queries(self):
+        with self.assertNumQueries(2):
+            get_shop_stock_report(self.shop1)
+
+
+class PriceHistoryTestCase(BaseShopsViewsTest):
+    def setUp(self):
+        super().setUp()
+        self.stockentry = StockEntry.objects.create(
+            operator=self.user3, shop=self.shop1,
+            datetime=timezone.now() - datetime.timedelta(days=2))
+        StockEntryProduct.objects.create(
+            stockentry=self.stockentry, product=self.product1, quantity=24, price=12)
+
+    def test_record(self):
+        price_histories = record_price_history(Product.objects.filter(pk=self.product1.pk))
+        self.assertEqual(len(price_histories), 1)
+        price_history = self.product1.get_last_price_history()
+        self.assertEqual(price_history.automatic_price, self.product1.get_automatic_price())
+        self.assertEqual(price_history.price, self.product1.get_price())
+        self.assertEqual(price_history.margin_profit,
+                         decimal.Decimal(str(configuration_get('MARGIN_PROFIT').get_value())))
+
+    def test_record_only_changes(self):
+        record_price_history([self.product1, self.product2])
+        self.assertEqual(record_price_history([self.product1, self.product2]), [])
+
+        self.product2.manual_price = 3
+        self.product2.save()
+        price_histories = record_price_history([self.product1, self.product2])
+        self.assertEqual([price_history.product for price_history in price_histories],
+                         [self.product2])
+        self.assertEqual(self.product2.get_last_price_history().price, 3)
+
+    def test_margin_change(self):
+        record_price_history([self.product1])
+        margin_profit = configuration_get('MARGIN_PROFIT')
+        margin_profit.value = margin_profit.get_value() + 10
+        margin_profit.save()
+        self.assertEqual(len(record_price_history([self.product1])), 1)
+        self.assertEqual(self.product1.get_last_price_history().automatic_price,
+                         self.product1.get_automatic_price())
+
+    def test_price_at(self):
+        before = timezone.now() - datetime.timedelta(days=1)
+        ProductPriceHistory.objects.create(
+            product=self.product2, valid_from=before - datetime.timedelta(days=1),
+            price=1, automatic_price=0, is_manual=True, manual_price=1,
+            correcting_factor=1, margin_profit=0)
+        record_price_history([self.product2])
+        self.assertIsNone(self.product2.get_price_at(before - datetime.timedelta(days=2)))
+        self.assertEqual(self.product2.get_price_at(before), 1)
+        self.assertEqual(self.product2.get_price_at(timezone.now()), 2)
+
+    def test_queries(self):
+        with self.assertNumQueries(3):
+            record_price_history(Product.objects.all())
+
+
+class ProductChoicesTestCase(BaseShopsViewsTest):
+    def test_choices(self):
+        self.product3.is_active = False
+        self.product3.save()
+        self.assertEqual(get_product_choices(self.shop1), [
+            (str(self.product1.pk) + '/None', 'skoll'),
+            (str(self.product2.pk) + '/cl', 'beer'),
+            (str(self.product3.pk) + '/g', 'meat DESACTIVE')])
+
+    def test_cached_and_invalidated(self):
+        get_product_choices(self.shop1)
+        with self.assertNumQueries(0):
+            get_product_choices(self.shop1)
+
+        self.product1.is_removed = True
+        self.product1.save()
+        self.assertNotIn(str(self.product1.pk) + '/None', dict(get_product_choices(self.shop1)))
+
+
+class LinesSummariesTestCase(BaseShopsViewsTest):
+    def setUp(self):
+        super().setUp()
+        self.stockentry = StockEntry.objects.create(operator=self.user3, shop=self.shop1)
+        for product, quantity, price in ((self.product1, 10, 12), (self.product2, 500, 3)):
+            StockEntryProduct.objects.create(stockentry=self.stockentry, product=product,
+                                             quantity=quantity, price=price)
+        self.module = SelfSaleModule.objects.create(shop=self.shop1)
+        self.sale = Sale.objects.create(sender=self.user1, recipient=self.user3, operator=self.user3,
+                                        shop=self.shop1, module=self.module)
+        SaleProduct.objects.create(sale=self.sale, product=self.product1, quantity=2, price=4)
+
+    def test_rebuild(self):
+        # Computed from the lines until rebuilt.
+        summary = self.stockentry.string_products()
+        self.assertEqual(summary, 'skoll x 10, beer x 500cl')
+        self.assertEqual(rebuild_lines_summaries(StockEntry.objects.filter(pk=self.stockentry.pk)), 1)
+        self.assertEqual(rebuild_lines_summaries(Sale.objects.filter(pk=self.sale.pk)), 1)
+
+        stockentry = StockEntry.objects.get(pk=self.stockentry.pk)
+        sale = Sale.objects.get(pk=self.sale.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(stockentry.string_products(), summary)
+            self.assertEqual(stockentry.total(), 15)
+            self.assertEqual(sale.string_products(), 'skoll x 2')
+            self.assertEqual(sale.amount(), 4)
+
+    def test_rebuild_queries(self):
+        # Identifiers, sales, lines and bulk update.
+        with self.assertNumQueries(4):
+            rebuild_lines_summaries(Sale.objects.all())
+
@@ -1,10 +1,16 @@
+import datetime
+import decimal
+
 from django.contrib.auth.models import Group, Permission
 from django.contrib.contenttypes.models import ContentType
+from django.db import connection
 from django.test import Client
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
 from borgia.tests.tests_views import BaseBorgiaViewsTestCase
 from borgia.tests.utils import get_login_url_redirected
+from sales.models import SaleDailyRollup
 from shops.models import Product, Shop
 from shops.utils import DEFAULT_PERMISSIONS_CHIEFS
 
@@ -76,6 +82,23 @@ class ShopListViewTest(BaseGeneralShopViewsTest):
     def test_offline_user_redirection(self):
         super().offline_user_redirection()
 
+    def test_fragment_cached(self):
+        response = self.client1.get(self.get_url())
+        with CaptureQueriesContext(connection) as context:
+            response_cached = self.client1.get(self.get_url())
+        self.assertContains(response_cached, 'shop2')
+        # The list of the shops, not the one of the lateral menu.
+        self.assertFalse([query for query in context.captured_queries
+                          if 'ORDER BY "shops_shop"."name"' in query['sql']])
+        self.assertEqual(response_cached.context['nav_tree'], response.context['nav_tree'])
+
+        Shop.objects.create(name='shop3', description='Third shop', color='#FFFFFF')
+        self.assertContains(self.client1.get(self.get_url()), 'shop3')
+
+    def test_fragment_by_permissions(self):
+        self.assertContains(self.client1.get(self.get_url()), reverse('url_shop_create'))
+        self.assertNotContains(self.client3.get(self.get_url()), reverse('url_shop_create'))
+
 
 class ShopCreateViewTest(BaseGeneralShopViewsTest):
     url_view = 'url_shop_create'
@@ -148,6 +171,25 @@ class ShopUpdateViewTest(BaseFocusShopViewsTest):
 class ShopCheckupViewTest(BaseFocusShopViewsTest):
     url_view = 'url_shop_checkup'
 
+    def test_sales_from_rollups(self):
+        today = datetime.date.today()
+        SaleDailyRollup.objects.create(shop=self.shop1, date=today, revenue=10, sale_count=4)
+        SaleDailyRollup.objects.create(shop=self.shop1, product=self.product1, date=today,
+                                       quantity=6, revenue=3, sale_count=2)
+        SaleDailyRollup.objects.create(shop=self.shop1, date=today - datetime.timedelta(days=40),
+                                       revenue=100, sale_count=1)
+
+        response = self.client3.get(self.get_url(self.shop1.pk))
+        self.assertEqual(response.context['transaction']['value'], 10)
+        self.assertEqual(response.context['transaction']['nb'], 4)
+
+        response = self.client3.post(self.get_url(self.shop1.pk), {
+            'date_begin': (today - datetime.timedelta(days=40)).strftime('%d/%m/%Y'),
+            'date_end': today.strftime('%d/%m/%Y'),
+            'products': [self.product1.pk]})
+        self.assertEqual(response.context['transaction']['value'], 3)
+        self.assertEqual(response.context['transaction']['nb'], 2)
+
     def test_as_president_get(self):
         super().as_president_get()
 
@@ -241,6 +283,25 @@ class ProductListViewTest(BaseGeneralProductViewsTest):
             self.get_url(self.shop1.pk)))
 
 
+class ProductListDownloadXlsxViewTest(BaseGeneralProductViewsTest):
+    url_view = 'url_product_list_download_xlsx'
+
+    def test_president_get(self):
+        super().president_get()
+
+    def test_chief_get(self):
+        response_client3 = self.client3.get(self.get_url(self.shop1.pk))
+        self.assertEqual(response_client3.status_code, 200)
+        self.assertEqual(response_client3['Content-Type'],
+                         'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+
+    def test_not_allowed_user_get(self):
+        super().not_allowed_user_get()
+
+    def test_offline_user_redirection_get(self):
+        super().offline_user_redirection()
+
+
 class ProductCreateViewTest(BaseGeneralProductViewsTest):
     url_view = 'url_product_create'
 
@@ -358,6 +419,15 @@ class ProductUpdateViewTest(BaseFocusProductViewsTest):
 class ProductUpdatePriceViewTest(BaseFocusProductViewsTest):
     url_view = 'url_product_update_price'
 
+    def test_post_records_price_history(self):
+        response = self.client3.post(
+            self.get_url(self.product1.shop.pk, self.product1.pk),
+            {'is_manual': True, 'manual_price': '1.5'})
+        self.assertEqual(response.status_code, 302)
+        price_history = self.product1.get_last_price_history()
+        self.assertTrue(price_history.is_manual)
+        self.assertEqual(price_history.price, decimal.Decimal('1.5'))
+
     def test_as_president_get(self):
         super().as_president_get()
 
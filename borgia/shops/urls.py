@@ -1,7 +1,7 @@
 from django.urls import include, path
 
 from shops.views import (ProductCreate, ProductDeactivate, ProductList,
-                         ProductRemove, ProductRetrieve, ProductUpdate,
+                         ProductListDownloadXlsx, ProductRemove, ProductRetrieve, ProductUpdate,
                          ProductUpdatePrice, ShopCheckup, ShopCreate, ShopList,
                          ShopUpdate, ShopWorkboard, ShopRemove)
 
@@ -21,6 +21,8 @@ shops_patterns = [
             # PRODUCTS
             path('products/', include([
                 path('', ProductList.as_view(), name='url_product_list'),
+                path('xlsx/download/', ProductListDownloadXlsx.as_view(),
+                     name='url_product_list_download_xlsx'),
                 path('create/', ProductCreate.as_view(),
                      name='url_product_create'),
                 path('<int:product_pk>/', include([
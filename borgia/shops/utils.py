@@ -1,9 +1,22 @@
+import decimal
+
 from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import (DateTimeField, F, IntegerField, OuterRef,
+                              Prefetch, Q, QuerySet, Subquery, Sum, Value)
+from django.db.models.functions import Coalesce
 from django.urls import reverse
 
-from borgia.utils import (get_permission_name_group_managing,
+from borgia.utils import (STOCKS_VERSION, bump_data_version_on_commit,
+                          get_permission_name_group_managing,
                           group_name_display, simple_lateral_link)
-from shops.models import Shop
+from configurations.utils import configuration_get
+from sales.models import Sale, SaleProduct
+from shops.models import (STOCK_COUNTER_FIELDS, Product, ProductPriceHistory,
+                          Shop, get_automatic_price, get_unit_price)
+from stocks.models import (MIN_DATETIME, InventoryProduct, StockEntry,
+                           StockEntryProduct)
 
 DEFAULT_PERMISSIONS_CHIEFS = ['add_user', 'view_user',
                               'change_shop', 'view_shop',
@@ -22,6 +35,9 @@ DEFAULT_PERMISSIONS_ASSOCIATES = ['add_user', 'view_user',
                                   'add_stockentry', 'view_stockentry',
                                   'add_inventory', 'view_inventory']
 
+PRODUCT_CHOICES_CACHE_KEY = 'shops:product_choices:%s'
+PRODUCT_CHOICES_CACHE_TIMEOUT = 300
+
 
 def is_shop_manager(shop, user):
     """
@@ -45,6 +61,41 @@ def get_shops_managed(user):
     return shop_list
 
 
+def get_product_choice_value(product_pk, unit):
+    """
+    Return the value of a product in the category forms: 'pk/unit', unit
+    being None for the products sold by unit.
+    """
+    return str(product_pk) + '/' + str(dict(Product.UNIT_CHOICES).get(unit))
+
+
+def get_product_choices(shop):
+    """
+    Return the choices of products of the shop for the category forms, in a
+    single query, cached until a product of the shop changes.
+
+    The active products come first, the inactive ones are marked.
+
+    :returns: list of ('pk/unit', label), see get_product_choice_value.
+    """
+    choices = cache.get(PRODUCT_CHOICES_CACHE_KEY % shop.pk)
+    if choices is None:
+        products = Product.objects.filter(shop=shop, is_removed=False).order_by(
+            '-is_active', 'pk').values_list('pk', 'name', 'unit', 'is_active')
+        choices = [(get_product_choice_value(pk, unit),
+                    name if is_active else name + ' DESACTIVE')
+                   for pk, name, unit, is_active in products]
+        cache.set(PRODUCT_CHOICES_CACHE_KEY % shop.pk, choices, PRODUCT_CHOICES_CACHE_TIMEOUT)
+    return choices
+
+
+def invalidate_product_choices(shop_pk):
+    """
+    Remove the choices of products of the shop from the cache.
+    """
+    cache.delete(PRODUCT_CHOICES_CACHE_KEY % shop_pk)
+
+
 def get_shops_tree(user, is_association_manager):
     shop_tree = []
     if is_association_manager:
@@ -216,3 +267,238 @@ def shops_lateral_menu(nav_tree, user, shop):
         nav_tree.append(subs[0])
 
     return nav_tree
+
+
+def annotate_stock_counters(products):
+    """
+    Annotate products with their last inventory and the quantities entered
+    and sold since the last inventory, recalculated with subqueries.
+    """
+    last_inventoryproducts = InventoryProduct.objects.filter(
+        product=OuterRef('pk')).order_by('-id')
+    return products.annotate(
+        report_inventory_quantity=Subquery(last_inventoryproducts.values('quantity')[:1]),
+        report_inventory_datetime=Subquery(last_inventoryproducts.values('inventory__datetime')[:1]),
+    ).annotate(
+        # Everything is counted when there is no inventory.
+        report_since=Coalesce('report_inventory_datetime',
+                              Value(MIN_DATETIME, output_field=DateTimeField()))
+    ).annotate(
+        report_input=Subquery(
+            StockEntryProduct.objects.filter(
+                product=OuterRef('pk'), stockentry__datetime__gte=OuterRef('report_since')
+            ).order_by().values('product').annotate(total=Sum('quantity')).values('total'),
+            output_field=IntegerField()),
+        report_output=Subquery(
+            SaleProduct.objects.filter(
+                product=OuterRef('pk'), sale__datetime__gte=OuterRef('report_since')
+            ).order_by().values('product').annotate(total=Sum('quantity')).values('total'),
+            output_field=IntegerField()),
+    )
+
+
+def annotate_last_stockentry(products):
+    """
+    Annotate products with the quantity and price of their last stock entry,
+    with subqueries.
+    """
+    last_stockentryproducts = StockEntryProduct.objects.filter(
+        product=OuterRef('pk')).order_by('-stockentry__datetime')
+    return products.annotate(
+        report_entry_quantity=Subquery(last_stockentryproducts.values('quantity')[:1]),
+        report_entry_price=Subquery(last_stockentryproducts.values('price')[:1]),
+    )
+
+
+def update_stock_counters(products):
+    """
+    Recalculate the stock counters of the products, in one query and one
+    bulk update.
+
+    Needed after bulk creations, updates or deletions of sales, stock entries
+    or inventories, which don't send the signals maintaining them, and by the
+    signals after an update or an inventory.
+
+    :param products: queryset or list of products, the counters of the
+    products of a list are updated too.
+    """
+    instances = []
+    if not isinstance(products, QuerySet):
+        instances = products
+        products = [product.pk for product in products]
+    with transaction.atomic():
+        # Rows are locked so that no sale is counted in between.
+        products = annotate_stock_counters(
+            Product.objects.filter(pk__in=products).select_for_update())
+        products = {product.pk: product for product in products}
+        for product in products.values():
+            product.stock_base = product.report_inventory_quantity or 0
+            product.last_inventory_datetime = product.report_inventory_datetime
+            product.stock_input = product.report_input or 0
+            product.stock_output = product.report_output or 0
+        Product.objects.bulk_update(products.values(), STOCK_COUNTER_FIELDS)
+    for instance in instances:
+        for field in STOCK_COUNTER_FIELDS:
+            setattr(instance, field, getattr(products[instance.pk], field))
+    bump_data_version_on_commit(STOCKS_VERSION)
+
+
+def count_stock_movements(counter_field, quantities, datetime):
+    """
+    Add quantities to a stock counter of the products, like
+    count_stock_movement for lines created in bulk: a single UPDATE per
+    product, only if the movement is dated after its last inventory.
+
+    :param counter_field: 'stock_input' or 'stock_output'.
+    :param quantities: dict of the quantities by product pk.
+    :param datetime: date of the movement.
+    """
+    for product_pk, quantity in quantities.items():
+        Product.objects.filter(pk=product_pk).filter(
+            Q(last_inventory_datetime__isnull=True) | Q(last_inventory_datetime__lte=datetime)
+        ).update(**{counter_field: F(counter_field) + quantity})
+    bump_data_version_on_commit(STOCKS_VERSION)
+
+
+LINES_SUMMARY_BATCH_SIZE = 500
+
+
+def rebuild_lines_summaries(objects, batch_size=LINES_SUMMARY_BATCH_SIZE):
+    """
+    Recalculate the summaries and totals of the lines of sales or stock
+    entries (see Sale.summarize), by batches of two queries and a bulk update.
+
+    :param objects: queryset of Sale or StockEntry.
+    :returns: the number of sales or stock entries updated.
+    """
+    model = objects.model
+    line_model = {Sale: SaleProduct, StockEntry: StockEntryProduct}[model]
+    lines_name = line_model._meta.model_name + '_set'
+
+    pks = list(objects.order_by('pk').values_list('pk', flat=True))
+    for start in range(0, len(pks), batch_size):
+        batch = list(model.objects.filter(pk__in=pks[start:start + batch_size]).only('pk').prefetch_related(
+            Prefetch(lines_name, queryset=line_model.objects.select_related('product').order_by('pk'))))
+        for obj in batch:
+            obj.summarize(getattr(obj, lines_name).all())
+        model.objects.bulk_update(batch, ['products_summary', 'total_amount'])
+    return len(pks)
+
+
+PRICE_HISTORY_FIELDS = ('price', 'automatic_price', 'is_manual', 'manual_price',
+                        'correcting_factor', 'margin_profit')
+
+
+def record_price_history(products):
+    """
+    Record the price of the products in their price history, if it changed
+    since the last record.
+
+    Needed after a change of what the price depends on: manual price, stock
+    entries, correcting factor or margin profit. Done in one query and one
+    bulk creation.
+
+    :param products: queryset or list of products.
+    :returns: list of ProductPriceHistory created.
+    """
+    if not isinstance(products, QuerySet):
+        products = [product.pk for product in products]
+
+    margin_profit = configuration_get('MARGIN_PROFIT').get_value()
+    last_price_histories = ProductPriceHistory.objects.filter(
+        product=OuterRef('pk')).order_by('-valid_from')
+    products = annotate_last_stockentry(Product.objects.filter(pk__in=products)).annotate(
+        **{'history_' + field: Subquery(last_price_histories.values(field)[:1])
+           for field in PRICE_HISTORY_FIELDS}
+    )
+
+    price_histories = []
+    for product in products:
+        if product.report_entry_quantity:
+            unit_price = get_unit_price(product.unit, product.report_entry_price,
+                                        product.report_entry_quantity)
+            automatic_price = get_automatic_price(unit_price, product.correcting_factor, margin_profit)
+        else:
+            automatic_price = decimal.Decimal(0)
+
+        price_history = ProductPriceHistory(
+            product=product,
+            price=product.manual_price if product.is_manual else automatic_price,
+            automatic_price=automatic_price,
+            is_manual=product.is_manual,
+            manual_price=product.manual_price,
+            correcting_factor=product.correcting_factor,
+            margin_profit=round(decimal.Decimal(str(margin_profit)), 4))
+        if any(getattr(product, 'history_' + field) != getattr(price_history, field)
+               for field in PRICE_HISTORY_FIELDS):
+            price_histories.append(price_history)
+
+    return ProductPriceHistory.objects.bulk_create(price_histories)
+
+
+def get_current_prices(products):
+    """
+    Return the current price of the products, read from their price history
+    in a single query. Prices of products never recorded are calculated.
+
+    :param products: list of products.
+    :returns: dict of prices by product pk.
+    """
+    last_price_histories = ProductPriceHistory.objects.filter(
+        product=OuterRef('pk')).order_by('-valid_from')
+    prices = dict(Product.objects.filter(pk__in=[product.pk for product in products]).annotate(
+        current_price=Subquery(last_price_histories.values('price')[:1])
+    ).values_list('pk', 'current_price'))
+    for product in products:
+        if prices.get(product.pk) is None:
+            prices[product.pk] = product.get_price()
+    return prices
+
+
+def get_shop_stock_report(shop, products=None):
+    """
+    Return the stock and price of the products of a shop, computed in a
+    single query from the stock counters and the last stock entries.
+
+    For each product: the last inventory (quantity and date), the quantities
+    entered and sold since then, the estimated stock (with the correcting
+    factor), the value of this stock at the last buying price, the price and
+    the price strategy.
+
+    :param shop: Shop
+    :param products: queryset of products of the shop, all the products not
+    removed by default.
+    :returns: list of dict, in the order of products.
+    """
+    if products is None:
+        products = shop.product_set.filter(is_removed=False)
+
+    products = annotate_last_stockentry(products)
+
+    margin_profit = configuration_get('MARGIN_PROFIT').get_value()
+    report = []
+    for product in products:
+        stock_estimated = product.current_stock_estimated()
+
+        if product.report_entry_quantity:
+            unit_price = get_unit_price(product.unit, product.report_entry_price,
+                                        product.report_entry_quantity)
+            automatic_price = get_automatic_price(unit_price, product.correcting_factor, margin_profit)
+            stock_value = max(stock_estimated, 0) * product.report_entry_price / product.report_entry_quantity
+        else:
+            automatic_price = 0
+            stock_value = 0
+
+        report.append({
+            'product': product,
+            'last_inventory_quantity': product.stock_base,
+            'last_inventory_datetime': product.last_inventory_datetime,
+            'stock_input': product.stock_input,
+            'stock_output': product.stock_output,
+            'stock_estimated': stock_estimated,
+            'stock_estimated_display': product.get_quantity_display(max(stock_estimated, 0)),
+            'stock_value': round(stock_value, 2),
+            'price': product.manual_price if product.is_manual else automatic_price,
+            'strategy': product.get_strategy_display(),
+        })
+    return report
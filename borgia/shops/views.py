@@ -3,19 +3,29 @@ import decimal
 
 from django.contrib.auth.mixins import (LoginRequiredMixin,
                                         PermissionRequiredMixin)
-from django.db.models import Q
+from django.db.models import Q, Sum
+from django.http import HttpResponse
 from django.shortcuts import redirect, render
 from django.urls import reverse
-
+from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
+from openpyxl import Workbook
+from openpyxl.writer.excel import save_virtual_workbook
+
+from borgia.mixins import FragmentCacheMixin, ReplicaReadMixin
+from borgia.utils import (CONFIGURATIONS_VERSION, PRODUCTS_VERSION,
+                          SHOPS_VERSION, STOCKS_VERSION)
 from borgia.views import BorgiaFormView, BorgiaView
 from configurations.utils import configuration_get
 from modules.models import CategoryProduct
-from sales.models import Sale
+from modules.utils import invalidate_shop_catalogs
+from sales.models import Sale, SaleDailyRollup
 from shops.forms import (ProductCreateForm, ProductListForm, ProductUpdateForm,
                          ProductUpdatePriceForm, ShopCheckupSearchForm,
                          ShopCreateForm, ShopUpdateForm)
 from shops.mixins import ProductMixin, ShopMixin
 from shops.models import Product, Shop
+from shops.utils import get_shop_stock_report, record_price_history
 
 
 class ShopCreate(LoginRequiredMixin, PermissionRequiredMixin, BorgiaFormView):
@@ -57,7 +67,7 @@ class ShopRemove(ShopMixin, LoginRequiredMixin, PermissionRequiredMixin ,BorgiaV
     def post(self, request, *args, **kwargs):
         self.shop.delete()
         return redirect(reverse('url_shop_list'))
-class ShopList(LoginRequiredMixin, PermissionRequiredMixin, BorgiaView):
+class ShopList(FragmentCacheMixin, LoginRequiredMixin, PermissionRequiredMixin, BorgiaView):
     """
     View that list the shops.
     """
@@ -65,6 +75,7 @@ class ShopList(LoginRequiredMixin, PermissionRequiredMixin, BorgiaView):
     menu_type = 'managers'
     template_name = 'shops/shop_list.html'
     lm_active = 'lm_shop_list'
+    fragment_data = (SHOPS_VERSION,)
 
     def get(self, request, *args, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -96,13 +107,15 @@ class ShopUpdate(ShopMixin, BorgiaFormView):
         return reverse('url_shop_checkup', kwargs={'shop_pk': self.shop.pk})
 
 
-class ShopCheckup(ShopMixin, BorgiaFormView):
+class ShopCheckup(ReplicaReadMixin, ShopMixin, BorgiaFormView):
     """
     Display data about a shop.
 
     You can see checkup of your own shop only.
     If you're not a manager of a shop, you need the permission 'view_shop'
     """
+    # The search form only reads.
+    replica_methods = ('GET', 'HEAD', 'POST')
     permission_required = 'shops.view_shop'
     menu_type = 'shops'
     template_name = 'shops/shop_checkup.html'
@@ -113,6 +126,7 @@ class ShopCheckup(ShopMixin, BorgiaFormView):
     date_end = None
     products = None
     sales_value = None
+    sales_nb = None
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -136,7 +150,11 @@ class ShopCheckup(ShopMixin, BorgiaFormView):
 
         return self.get(self.request, self.args, self.kwargs)
 
-    def info_sales(self, q_sales):
+    def info_sales(self):
+        """
+        Return the amount and number of sales of the period, from the daily
+        rollups. If products are selected, only their sales are counted.
+        """
         current_month = False
         if self.date_begin is None:
             self.date_begin = datetime.date.today().replace(day=1)
@@ -144,31 +162,35 @@ class ShopCheckup(ShopMixin, BorgiaFormView):
         if self.date_end is None:
             self.date_end = datetime.date.today()
 
-        q_sales = q_sales.filter(datetime__gte=self.date_begin)
-        q_sales = q_sales.filter(datetime__lte=self.date_end)
-
-        if self.products:
-            q_sales = q_sales.filter(
-                products__pk__in=[p.pk for p in self.products])
-
         if self.sales_value is None:
-            self.sales_value = sum(s.amount() for s in q_sales)
+            rollups = SaleDailyRollup.objects.filter(
+                shop=self.shop, date__gte=self.date_begin, date__lte=self.date_end)
+            if self.products:
+                rollups = rollups.filter(product__in=self.products)
+            else:
+                rollups = rollups.filter(product__isnull=True)
+            totals = rollups.aggregate(value=Sum('revenue'), nb=Sum('sale_count'))
+            self.sales_value = totals['value'] or 0
+            self.sales_nb = totals['nb'] or 0
 
         if self.date_begin == datetime.date.today().replace(day=1) and self.date_end == datetime.date.today():
             current_month = True
 
         return {
             'value': self.sales_value,
-            'nb': q_sales.count(),
+            'nb': self.sales_nb,
             'is_current_month': current_month
         }
 
     def info_stock(self):
-        return {}
+        report = get_shop_stock_report(self.shop)
+        return {
+            'nb': len([row for row in report if row['stock_estimated'] > 0]),
+            'value': sum(row['stock_value'] for row in report)
+        }
 
     def info_transaction(self):
-        q_sales = Sale.objects.filter(shop=self.shop)
-        info_sales = self.info_sales(q_sales)
+        info_sales = self.info_sales()
         value = info_sales.get('value')
         nb = info_sales.get('nb')
         try:
@@ -182,8 +204,7 @@ class ShopCheckup(ShopMixin, BorgiaFormView):
         }
 
     def info_checkup(self):
-        q_sales = Sale.objects.filter(shop=self.shop)
-        info_sales = self.info_sales(q_sales)
+        info_sales = self.info_sales()
         sale_value = info_sales.get('value')
         sale_nb = info_sales.get('nb')
         current_month = info_sales.get('is_current_month')
@@ -206,7 +227,7 @@ class ShopCheckup(ShopMixin, BorgiaFormView):
         return initial
 
 
-class ShopWorkboard(ShopMixin, BorgiaView):
+class ShopWorkboard(ReplicaReadMixin, ShopMixin, BorgiaView):
     permission_required = 'shops.view_shop'
     menu_type = 'shops'
     template_name = 'shops/shop_workboard.html'
@@ -220,13 +241,13 @@ class ShopWorkboard(ShopMixin, BorgiaView):
 
     def get_sales(self):
         sales = {}
-        s_list = Sale.objects.filter(shop=self.shop).order_by('-datetime')
-        sales['weeks'] = self.weeklist(
-            datetime.datetime.now() - datetime.timedelta(days=30),
-            datetime.datetime.now())
-        sales['data_weeks'] = self.sale_data_weeks(s_list, sales['weeks'])[0]
-        sales['total'] = self.sale_data_weeks(s_list, sales['weeks'])[1]
-        sales['all'] = s_list[:7]
+        start = datetime.datetime.now() - datetime.timedelta(days=30)
+        sales['weeks'] = self.weeklist(start, datetime.datetime.now())
+        rollups = SaleDailyRollup.objects.filter(
+            shop=self.shop, product__isnull=True,
+            date__gte=start.date() - datetime.timedelta(days=start.weekday()))
+        sales['data_weeks'], sales['total'] = self.sale_data_weeks(rollups, sales['weeks'])
+        sales['all'] = Sale.objects.filter(shop=self.shop).order_by('-datetime')[:7]
         return sales
 
     # TODO: purchases with stock
@@ -244,15 +265,15 @@ class ShopWorkboard(ShopMixin, BorgiaView):
         return amounts, total
 
     @staticmethod
-    def sale_data_weeks(weeklist, weeks):
+    def sale_data_weeks(rollups, weeks):
         amounts = [0 for _ in range(0, len(weeks))]
         total = 0
-        for obj in weeklist:
-            string = (str(obj.datetime.isocalendar()[1])
-                      + '-' + str(obj.datetime.year))
+        for rollup in rollups:
+            string = (str(rollup.date.isocalendar()[1])
+                      + '-' + str(rollup.date.year))
             if string in weeks:
-                amounts[weeks.index(string)] += obj.amount()
-                total += obj.amount()
+                amounts[weeks.index(string)] += rollup.revenue
+                total += rollup.revenue
         return amounts, total
 
     @staticmethod
@@ -270,12 +291,13 @@ class ShopWorkboard(ShopMixin, BorgiaView):
         return weeklist
 
 
-class ProductList(ShopMixin, BorgiaFormView):
+class ProductList(FragmentCacheMixin, ShopMixin, BorgiaFormView):
     permission_required = 'shops.view_product'
     menu_type = 'shops'
     template_name = 'shops/product_list.html'
     form_class = ProductListForm
     lm_active = 'lm_product_list'
+    fragment_data = (PRODUCTS_VERSION, STOCKS_VERSION, CONFIGURATIONS_VERSION)
 
     search = None
 
@@ -290,7 +312,7 @@ class ProductList(ShopMixin, BorgiaFormView):
         query = self.shop.product_set.filter(is_removed=False)
         if self.search:
             query = query.filter(name__icontains=self.search)
-        context['product_list'] = query
+        context['product_list'] = SimpleLazyObject(lambda: get_shop_stock_report(self.shop, query))
         return context
 
     def form_valid(self, form):
@@ -299,6 +321,44 @@ class ProductList(ShopMixin, BorgiaFormView):
         return self.get(self.request, self.args, self.kwargs)
 
 
+class ProductListDownloadXlsx(ReplicaReadMixin, ShopMixin, BorgiaView):
+    """
+    Download the stock report of the products of the shop.
+    """
+    permission_required = 'shops.view_product'
+    menu_type = 'shops'
+    lm_active = 'lm_product_list'
+
+    def get(self, request, *args, **kwargs):
+        wb = Workbook()
+        # grab the active worksheet
+        ws = wb.active
+        ws.title = "stocks"
+        ws.append(['Nom', 'Unité', 'Dernier inventaire', 'Quantité au dernier inventaire',
+                   'Entrées depuis', 'Ventes depuis', 'Facteur de correction',
+                   'Stock estimé', 'Valeur du stock', 'Prix de vente', 'Stratégie', 'Etat'])
+        for col in ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H', 'I', 'J', 'K', 'L']:
+            ws.column_dimensions[col].width = 20
+
+        for row in get_shop_stock_report(self.shop):
+            product = row['product']
+            last_inventory_datetime = row['last_inventory_datetime']
+            if last_inventory_datetime is not None:
+                last_inventory_datetime = timezone.localtime(last_inventory_datetime).replace(tzinfo=None)
+            ws.append([product.name, product.get_unit_display(), last_inventory_datetime,
+                       row['last_inventory_quantity'], row['stock_input'], row['stock_output'],
+                       product.correcting_factor, row['stock_estimated'], row['stock_value'],
+                       row['price'], row['strategy'],
+                       'Activé' if product.is_active else 'Désactivé'])
+
+        # Return the file
+        response = HttpResponse(save_virtual_workbook(wb),
+                                content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+        response['Content-Disposition'] = 'attachment; filename=stocks-' + \
+            self.shop.name + '-' + str(datetime.date.today()) + ".xlsx"
+        return response
+
+
 class ProductCreate(ShopMixin, BorgiaFormView):
     permission_required = 'shops.add_product'
     menu_type = 'shops'
@@ -329,6 +389,7 @@ class ProductCreate(ShopMixin, BorgiaFormView):
                 shop=self.shop,
                 correcting_factor=1
             )
+        record_price_history([product])
         self.product = product
         return super().form_valid(form)
 
@@ -358,6 +419,7 @@ class ProductDeactivate(ProductMixin, BorgiaView):
         else:
             self.product.is_active = True
         self.product.save()
+        invalidate_shop_catalogs(self.shop)
 
         return redirect(reverse('url_product_retrieve',
                                 kwargs={'shop_pk': self.shop.pk,
@@ -383,6 +445,7 @@ class ProductRemove(ProductMixin, BorgiaView):
 
         # Delete all category_product which use the product.
         CategoryProduct.objects.filter(product=self.product).delete()
+        invalidate_shop_catalogs(self.shop)
 
         return redirect(reverse('url_product_list', kwargs={'shop_pk': self.shop.pk}))
 
@@ -398,6 +461,12 @@ class ProductRetrieve(ProductMixin, BorgiaView):
     menu_type = 'shops'
     template_name = 'shops/product_retrieve.html'
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['price_histories'] = self.product.productpricehistory_set.order_by(
+            '-valid_from')[:10]
+        return context
+
     def get(self, request, *args, **kwargs):
         context = self.get_context_data(**kwargs)
         return render(request, self.template_name, context=context)
@@ -424,6 +493,7 @@ class ProductUpdate(ProductMixin, BorgiaFormView):
     def form_valid(self, form):
         self.product.name = form.cleaned_data['name']
         self.product.save()
+        invalidate_shop_catalogs(self.shop)
         return super().form_valid(form)
 
     def get_success_url(self):
@@ -447,8 +517,16 @@ class ProductUpdatePrice(ProductMixin, BorgiaFormView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['margin_profit'] = configuration_get(
-            'MARGIN_PROFIT').get_value()
+        price_history = self.product.get_last_price_history()
+        if price_history is not None:
+            context['margin_profit'] = price_history.margin_profit
+            context['automatic_price'] = price_history.automatic_price
+        else:
+            context['margin_profit'] = configuration_get(
+                'MARGIN_PROFIT').get_value()
+            context['automatic_price'] = self.product.get_automatic_price()
+        context['deviating_price'] = self.product.deviating_price_from_auto(
+            context['automatic_price'])
         return context
 
     def get_initial(self):
@@ -461,6 +539,7 @@ class ProductUpdatePrice(ProductMixin, BorgiaFormView):
         self.product.is_manual = form.cleaned_data['is_manual']
         self.product.manual_price = form.cleaned_data['manual_price']
         self.product.save()
+        record_price_history([self.product])
         return super().form_valid(form)
 
     def get_success_url(self):
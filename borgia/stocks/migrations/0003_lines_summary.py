@@ -0,0 +1,23 @@
+# Generated by Django 2.2.28 on 2026-10-19 01:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stocks', '0002_auto_20190103_1237'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stockentry',
+            name='products_summary',
+            field=models.TextField(blank=True, null=True, verbose_name='Produits'),
+        ),
+        migrations.AddField(
+            model_name='stockentry',
+            name='total_amount',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=9, null=True, verbose_name='Montant total'),
+        ),
+    ]
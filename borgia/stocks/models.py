@@ -1,12 +1,18 @@
+import datetime
 from decimal import Decimal
 
 from django.core.validators import MinValueValidator
-from django.db import models
+from django.db import models, transaction
+from django.db.models import OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
 from django.utils.timezone import now
 
-from shops.models import Product, Shop
+from sales.models import SaleProduct
+from shops.models import Product, Shop, get_lines_summary, get_unit_price
 from users.models import User
 
+MIN_DATETIME = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
 
 class StockEntry(models.Model):
     """
@@ -18,12 +24,30 @@ class StockEntry(models.Model):
     operator = models.ForeignKey(User, on_delete=models.CASCADE)
     products = models.ManyToManyField(Product, through='StockEntryProduct')
     shop = models.ForeignKey(Shop, on_delete=models.CASCADE)
+    # Saved with the stock entry, see summarize. None if not computed yet.
+    products_summary = models.TextField('Produits', blank=True, null=True)
+    total_amount = models.DecimalField('Montant total', decimal_places=2, max_digits=9,
+                                       blank=True, null=True)
+
+    def summarize(self, lines):
+        """
+        Set the summary and the total of the lines of the stock entry, saved
+        with it so that the lists don't read the lines.
+
+        :param lines: StockEntryProduct objects, with their product.
+        """
+        self.products_summary = get_lines_summary(lines)
+        self.total_amount = sum(line.price for line in lines)
 
     def total(self):
+        if self.total_amount is not None:
+            return self.total_amount
         total = sum(sep.price for sep in self.stockentryproduct_set.all())
         return total
 
     def string_products(self):
+        if self.products_summary is not None:
+            return self.products_summary
         string = ''
         for sep in self.stockentryproduct_set.all():
             string += sep.__str__() + ', '
@@ -56,13 +80,7 @@ class StockEntryProduct(models.Model):
             return self.product.__str__() + ' x ' + str(self.quantity)
 
     def unit_price(self):
-        if self.product.unit:
-            if self.product.unit == 'G':
-                return Decimal(1000 * self.price / self.quantity)
-            if self.product.unit == 'CL':
-                return Decimal(100 * self.price / self.quantity)
-        else:
-            return Decimal(self.price / self.quantity)
+        return get_unit_price(self.product.unit, self.price, self.quantity)
 
 
 class Inventory(models.Model):
@@ -78,9 +96,67 @@ class Inventory(models.Model):
     shop = models.ForeignKey(Shop, on_delete=models.CASCADE)
 
     def update_correcting_factors(self):
-        for inventoryproduct in self.inventoryproduct_set.all():
-            inventoryproduct.product.update_correcting_factor(
-                inventoryproduct.quantity)
+        """
+        Update the correcting factors of the products of the inventory.
+
+        For each product, the quantities entered and sold between its previous
+        inventory and this one are aggregated in a single query, then the
+        factors are saved together. The factor makes the estimated sales equal
+        to the real ones: (previous quantity + entered - quantity) / sold. If
+        nothing was sold, the factor is left unchanged.
+
+        :returns: for each product of the inventory, a dict with the product,
+        the old and the new correcting factors (None if unchanged).
+        :rtype: list of dict
+        """
+        previous_inventoryproducts = InventoryProduct.objects.filter(
+            product=OuterRef('product'), pk__lt=OuterRef('pk')).order_by('-pk')
+        inventoryproducts = self.inventoryproduct_set.select_related('product').annotate(
+            previous_quantity=Subquery(previous_inventoryproducts.values('quantity')[:1]),
+            previous_datetime=Subquery(previous_inventoryproducts.values('inventory__datetime')[:1]),
+        ).annotate(
+            # Everything is counted when there is no previous inventory.
+            since=Coalesce('previous_datetime', Value(MIN_DATETIME, output_field=models.DateTimeField()))
+        ).annotate(
+            stock_input=Subquery(
+                StockEntryProduct.objects.filter(
+                    product=OuterRef('product'),
+                    stockentry__datetime__gte=OuterRef('since'),
+                    stockentry__datetime__lt=self.datetime
+                ).order_by().values('product').annotate(total=Sum('quantity')).values('total'),
+                output_field=models.IntegerField()),
+            stock_output=Subquery(
+                SaleProduct.objects.filter(
+                    product=OuterRef('product'),
+                    sale__datetime__gte=OuterRef('since'),
+                    sale__datetime__lt=self.datetime
+                ).order_by().values('product').annotate(total=Sum('quantity')).values('total'),
+                output_field=models.IntegerField()),
+        ).order_by('pk')
+
+        report = []
+        products = []
+        for inventoryproduct in inventoryproducts:
+            product = inventoryproduct.product
+            old_correcting_factor = product.correcting_factor
+            new_correcting_factor = None
+            if inventoryproduct.stock_output:
+                new_correcting_factor = round(
+                    Decimal((inventoryproduct.previous_quantity or 0)
+                            + (inventoryproduct.stock_input or 0)
+                            - inventoryproduct.quantity)
+                    / Decimal(inventoryproduct.stock_output), 4)
+                product.correcting_factor = new_correcting_factor
+                products.append(product)
+            report.append({
+                'product': product,
+                'old_correcting_factor': old_correcting_factor,
+                'new_correcting_factor': new_correcting_factor
+            })
+
+        with transaction.atomic():
+            Product.objects.bulk_update(products, ['correcting_factor'])
+        return report
 
 
 class InventoryProduct(models.Model):
@@ -1,6 +1,11 @@
+import datetime
 import decimal
 
+from django.utils import timezone
+
 from borgia.tests.tests_views import BaseBorgiaViewsTestCase
+from modules.models import SelfSaleModule
+from sales.models import Sale, SaleProduct
 from shops.models import Product, Shop
 from stocks.models import (Inventory, InventoryProduct, StockEntry,
                            StockEntryProduct)
@@ -82,3 +87,47 @@ class StockEntryTestCase(BaseStocksTestCase):
 
         total = self.stockentry2.total()
         self.assertEqual(total, decimal.Decimal('5.0'))
+
+
+class InventoryTestCase(BaseStocksTestCase):
+    def setUp(self):
+        super().setUp()
+        module = SelfSaleModule.objects.create(shop=self.shop1)
+        now = timezone.now()
+        self.stockentry1.datetime = now - datetime.timedelta(days=3)
+        self.stockentry1.save()
+
+        self.inventory1 = Inventory.objects.create(
+            operator=self.user1, shop=self.shop1, datetime=now - datetime.timedelta(days=2))
+        InventoryProduct.objects.create(inventory=self.inventory1, product=self.product1, quantity=3)
+        InventoryProduct.objects.create(inventory=self.inventory1, product=self.product2, quantity=7)
+
+        stockentry = StockEntry.objects.create(
+            operator=self.user1, shop=self.shop1, datetime=now - datetime.timedelta(days=1))
+        StockEntryProduct.objects.create(stockentry=stockentry, product=self.product1,
+                                         quantity=10, price=decimal.Decimal('2.0'))
+        sale = Sale.objects.create(sender=self.user1, recipient=self.user1, operator=self.user1,
+                                   shop=self.shop1, module=module, datetime=now - datetime.timedelta(days=1))
+        SaleProduct.objects.create(sale=sale, product=self.product1, quantity=4, price=1)
+        SaleProduct.objects.create(sale=sale, product=self.product3, quantity=6, price=1)
+
+        self.inventory2 = Inventory.objects.create(operator=self.user1, shop=self.shop1)
+        for product, quantity in ((self.product1, 8), (self.product2, 7), (self.product3, 9)):
+            InventoryProduct.objects.create(inventory=self.inventory2, product=product, quantity=quantity)
+
+    def test_update_correcting_factors(self):
+        report = self.inventory2.update_correcting_factors()
+        self.assertEqual(
+            [(row['product'], row['old_correcting_factor'], row['new_correcting_factor']) for row in report],
+            [(self.product1, 1, decimal.Decimal('1.25')),
+             (self.product2, 1, None),
+             (self.product3, 1, decimal.Decimal('0.5'))])
+        # (3 + 10 - 8) / 4, unchanged without sales, (0 + 12 - 9) / 6
+        self.assertEqual(Product.objects.get(pk=self.product1.pk).correcting_factor, decimal.Decimal('1.25'))
+        self.assertEqual(Product.objects.get(pk=self.product2.pk).correcting_factor, 1)
+        self.assertEqual(Product.objects.get(pk=self.product3.pk).correcting_factor, decimal.Decimal('0.5'))
+
+    def test_queries(self):
+        # Select, and update within a savepoint.
+        with self.assertNumQueries(4):
+            self.inventory2.update_correcting_factors()
@@ -3,6 +3,7 @@ from django.urls import reverse
 
 from borgia.tests.utils import get_login_url_redirected
 from shops.tests.tests_views import BaseShopsViewsTest
+from shops.models import Product
 from stocks.models import (Inventory, InventoryProduct, StockEntry,
                            StockEntryProduct)
 
@@ -76,6 +77,16 @@ class StockEntryListViewTest(BaseGeneralStocksViewsTest):
 class StockEntryCreateViewTest(BaseGeneralStocksViewsTest):
     url_view = 'url_stockentry_create'
 
+    def get_data(self, product, quantity, unit_quantity):
+        return {
+            'form-TOTAL_FORMS': 1, 'form-INITIAL_FORMS': 0,
+            'form-0-product': str(product.pk) + '/' + product.get_unit_display(),
+            'form-0-quantity': quantity, 'form-0-unit_quantity': unit_quantity,
+            'form-0-amount': 15, 'form-0-unit_amount': 'PACKAGE',
+            'form-0-inventory_quantity': 20, 'form-0-unit_inventory': 'CL',
+            'isAddingInventory': 'with'
+        }
+
     def test_president_get(self):
         super().president_get()
 
@@ -88,6 +99,23 @@ class StockEntryCreateViewTest(BaseGeneralStocksViewsTest):
     def test_offline_user_redirection(self):
         super().offline_user_redirection()
 
+    def test_chief_post(self):
+        response = self.client3.post(self.get_url(self.shop1.pk), self.get_data(self.product2, 3, 'L'))
+        self.assertRedirects(response, reverse('url_stockentry_list', kwargs={'shop_pk': self.shop1.pk}))
+        stockentryproduct = StockEntryProduct.objects.latest('pk')
+        self.assertEqual(stockentryproduct.product, self.product2)
+        self.assertEqual(stockentryproduct.quantity, 300)
+        self.assertEqual(stockentryproduct.stockentry.string_products(), str(stockentryproduct))
+        self.assertEqual(stockentryproduct.stockentry.total(), 15)
+        self.assertEqual(InventoryProduct.objects.latest('pk').quantity, 320)
+        self.assertEqual(Product.objects.get(pk=self.product2.pk).current_stock_estimated(), 320)
+
+    def test_invalid_post(self):
+        stockentries = StockEntry.objects.count()
+        response = self.client3.post(self.get_url(self.shop1.pk), self.get_data(self.product2, 3, 'KG'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(StockEntry.objects.count(), stockentries)
+
 
 class StockEntryRetrieveViewTest(BaseStocksViewsTest):
     """
@@ -143,6 +171,14 @@ class InventoryListViewTest(BaseGeneralStocksViewsTest):
 class InventoryCreateViewTest(BaseGeneralStocksViewsTest):
     url_view = 'url_inventory_create'
 
+    def get_data(self, inventory_type):
+        return {
+            'form-TOTAL_FORMS': 1, 'form-INITIAL_FORMS': 0,
+            'form-0-product': str(self.product3.pk) + '/' + self.product3.get_unit_display(),
+            'form-0-quantity': 2, 'form-0-unit_quantity': 'KG',
+            'type': inventory_type
+        }
+
     def test_president_get(self):
         super().president_get()
 
@@ -155,6 +191,23 @@ class InventoryCreateViewTest(BaseGeneralStocksViewsTest):
     def test_offline_user_redirection(self):
         super().offline_user_redirection()
 
+    def test_chief_post(self):
+        response = self.client3.post(self.get_url(self.shop1.pk), self.get_data('full'))
+        self.assertRedirects(response, reverse('url_inventory_list', kwargs={'shop_pk': self.shop1.pk}))
+        inventory = Inventory.objects.latest('pk')
+        self.assertEqual(
+            dict(inventory.inventoryproduct_set.values_list('product', 'quantity')),
+            {self.product1.pk: 0, self.product2.pk: 0, self.product3.pk: 2000})
+        self.assertEqual(Product.objects.get(pk=self.product3.pk).current_stock_estimated(), 2000)
+
+    def test_invalid_post(self):
+        inventories = Inventory.objects.count()
+        data = self.get_data('partial')
+        data['form-0-unit_quantity'] = 'L'
+        response = self.client3.post(self.get_url(self.shop1.pk), data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Inventory.objects.count(), inventories)
+
 
 class InventoryRetrieveViewTest(BaseStocksViewsTest):
     """
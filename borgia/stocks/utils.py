@@ -0,0 +1,177 @@
+"""
+Creation of stock entries and inventories.
+
+Every line is validated before anything is written, then the lines are
+created in bulk in a single transaction. Bulk creations don't send signals,
+the stock counters of the products are updated once for the whole batch.
+"""
+import decimal
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from shops.models import Product
+from shops.utils import record_price_history, update_stock_counters
+from stocks.models import (Inventory, InventoryProduct, StockEntry,
+                           StockEntryProduct)
+
+QUANTITY_UNITS = {
+    'G': {'G': 1, 'KG': 1000},
+    'CL': {'CL': 1, 'L': 100},
+}
+
+
+def get_products_from_forms(shop, forms):
+    """
+    Return the products selected in the forms, in a single query.
+
+    :raises: ValidationError if a product doesn't exist in the shop.
+    :returns: dict of products by pk.
+    """
+    pks = [get_product_pk_from_form(form['product']) for form in forms]
+    products = Product.objects.filter(shop=shop, is_removed=False).in_bulk(pks)
+    for pk in pks:
+        if pk not in products:
+            raise ValidationError("Le produit sélectionné n'existe pas dans ce magasin.")
+    return products
+
+
+def get_product_pk_from_form(form_product):
+    try:
+        return int(form_product.split('/')[0])
+    except (AttributeError, ValueError):
+        raise ValidationError("Le produit sélectionné n'existe pas dans ce magasin.")
+
+
+def get_normalized_quantity(product, form_unit_quantity, form_quantity):
+    """
+    Return the quantity in cl, g or units.
+
+    :raises: ValidationError if the quantity is missing or its unit doesn't
+    match the unit of the product.
+    """
+    if form_quantity is None:
+        raise ValidationError("La quantité de " + str(product) + " est obligatoire.")
+    if product.unit is None:
+        # Single product
+        return form_quantity
+    try:
+        factor = QUANTITY_UNITS[product.unit][form_unit_quantity]
+    except KeyError:
+        raise ValidationError("L'unité choisie pour " + str(product) + " est incorrecte.")
+    return form_quantity * factor
+
+
+def get_normalized_price(form_unit_quantity, form_quantity, form_unit_amount, form_amount):
+    """
+    Return the price of the whole quantity.
+    """
+    if form_unit_amount == 'PACKAGE':
+        price = decimal.Decimal(form_amount)
+    else:
+        if form_unit_quantity == 'G' and form_unit_amount == 'KG':
+            price = decimal.Decimal(
+                form_amount * decimal.Decimal(form_quantity / 1000))
+        elif form_unit_quantity == 'CL' and form_unit_amount == 'L':
+            price = decimal.Decimal(
+                form_amount * decimal.Decimal(form_quantity / 100))
+        else:
+            price = decimal.Decimal(form_amount * form_quantity)
+
+    return price
+
+
+def after_stock_movements(products):
+    """
+    Update what is derived from the stock movements of the products, once
+    per batch of created lines: stock counters and price history.
+    """
+    update_stock_counters(products)
+    record_price_history(products)
+
+
+def create_stockentry(shop, operator, forms, with_inventory=False):
+    """
+    Create a stock entry, and optionally an inventory of the products entered.
+
+    :param forms: cleaned data of StockEntryProductForm.
+    :param with_inventory: if True, the remaining stock given in the forms,
+    plus the quantity entered, is saved in an inventory.
+    :raises: ValidationError, nothing is created.
+    :returns: the stock entry.
+    """
+    products = get_products_from_forms(shop, forms)
+
+    lines = []
+    inventory_lines = []
+    for form in forms:
+        product = products[get_product_pk_from_form(form['product'])]
+        quantity = get_normalized_quantity(product, form['unit_quantity'], form['quantity'])
+        if quantity <= 0:
+            raise ValidationError("La quantité de " + str(product) + " doit être positive.")
+        if form['amount'] is None:
+            raise ValidationError("Le prix de " + str(product) + " est obligatoire.")
+        price = get_normalized_price(
+            form['unit_quantity'], form['quantity'], form['unit_amount'], form['amount'])
+        lines.append(StockEntryProduct(product=product, quantity=quantity, price=price))
+
+        if with_inventory and form['unit_inventory'] and form['inventory_quantity']:
+            inventory_quantity = get_normalized_quantity(
+                product, form['unit_inventory'], form['inventory_quantity'])
+            inventory_lines.append(InventoryProduct(
+                product=product, quantity=inventory_quantity + quantity))
+
+    with transaction.atomic():
+        stockentry = StockEntry(operator=operator, shop=shop)
+        stockentry.summarize(lines)
+        stockentry.save()
+        for line in lines:
+            line.stockentry = stockentry
+        StockEntryProduct.objects.bulk_create(lines)
+
+        if with_inventory:
+            inventory = Inventory.objects.create(operator=operator, shop=shop)
+            for line in inventory_lines:
+                line.inventory = inventory
+            InventoryProduct.objects.bulk_create(inventory_lines)
+
+        after_stock_movements(products.values())
+    return stockentry
+
+
+def create_inventory(shop, operator, forms, full=False):
+    """
+    Create an inventory and update the correcting factors of its products.
+
+    :param forms: cleaned data of InventoryProductForm.
+    :param full: if True, active products of the shop not in the forms are
+    included with a quantity 0.
+    :raises: ValidationError, nothing is created.
+    :returns: the inventory and the report of
+    Inventory.update_correcting_factors.
+    """
+    products = get_products_from_forms(shop, forms)
+
+    lines = []
+    for form in forms:
+        product = products[get_product_pk_from_form(form['product'])]
+        quantity = get_normalized_quantity(product, form['unit_quantity'], form['quantity'])
+        if quantity < 0:
+            raise ValidationError("La quantité de " + str(product) + " ne peut pas être négative.")
+        lines.append(InventoryProduct(product=product, quantity=quantity))
+
+    if full:
+        for product in Product.objects.filter(shop=shop, is_removed=False, is_active=True).exclude(
+                pk__in=products.keys()):
+            products[product.pk] = product
+            lines.append(InventoryProduct(product=product, quantity=0))
+
+    with transaction.atomic():
+        inventory = Inventory.objects.create(operator=operator, shop=shop)
+        for line in lines:
+            line.inventory = inventory
+        InventoryProduct.objects.bulk_create(lines)
+
+        report = inventory.update_correcting_factors()
+        after_stock_movements(products.values())
+    return inventory, report
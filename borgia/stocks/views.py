@@ -1,6 +1,4 @@
-import decimal
-
-from django.core.exceptions import ObjectDoesNotExist
+from django.core.exceptions import ObjectDoesNotExist, ValidationError
 from django.forms.formsets import formset_factory
 from django.http import Http404
 from django.shortcuts import redirect, render
@@ -8,14 +6,13 @@ from django.urls import reverse
 
 from borgia.views import BorgiaFormView, BorgiaView
 from shops.mixins import ShopMixin
-from shops.models import Product
 from stocks.forms import (AdditionnalDataInventoryForm,
                           AdditionnalDataStockEntryForm,
                           BaseInventoryProductFormSet, InventoryListDateForm,
                           InventoryProductForm, StockEntryListDateForm,
                           StockEntryProductForm)
-from stocks.models import (Inventory, InventoryProduct, StockEntry,
-                           StockEntryProduct)
+from stocks.models import Inventory, StockEntry
+from stocks.utils import create_inventory, create_stockentry
 
 
 class StockEntryListView(ShopMixin, BorgiaFormView):
@@ -76,9 +73,6 @@ class StockEntryCreateView(ShopMixin, BorgiaView):
         return render(request, self.template_name, context=context)
 
     def post(self, request, *args, **kwargs):
-        stockentry = StockEntry.objects.create(
-            operator=request.user, shop=self.shop)
-
         # TODO: Verify formset with django 2.x
         stockentry_product_form = formset_factory(StockEntryProductForm,
                                                   extra=1)
@@ -87,48 +81,22 @@ class StockEntryCreateView(ShopMixin, BorgiaView):
         add_inventory_form = AdditionnalDataStockEntryForm(request.POST)
 
         if stockentry_form.is_valid() and add_inventory_form.is_valid():
-            is_adding_inventory = False
-            if add_inventory_form.cleaned_data['isAddingInventory'] == 'with':
-                inventory = Inventory.objects.create(
-                    operator=request.user, shop=self.shop)
-                is_adding_inventory = True
-
-            for form in stockentry_form.cleaned_data:
-                try:
-                    product = get_product_from_form(form['product'])
-                    quantity = get_normalized_quantity(
-                        product, form['unit_quantity'], form['quantity'])
-                    price = get_normalized_price(
-                        form['unit_quantity'], form['quantity'], form['unit_amount'], form['amount'])
-
-                    StockEntryProduct.objects.create(
-                        stockentry=stockentry,
-                        product=product,
-                        quantity=quantity,
-                        price=price
-                    )
-
-                    # AJOUT DE L'INVENTAIRE SI BESOIN
-                    if is_adding_inventory:
-                        if form['unit_inventory'] and form['inventory_quantity']:
-                            inventory_quantity = get_normalized_quantity(
-                                product, form['unit_inventory'], form['inventory_quantity'])
-
-                            InventoryProduct.objects.create(
-                                inventory=inventory,
-                                product=product,
-                                quantity=inventory_quantity+quantity
-                            )
-
-                except ObjectDoesNotExist:
-                    pass
-                except (ZeroDivisionError, decimal.DivisionUndefined, decimal.DivisionByZero):
-                    pass
-
-        return redirect(
-            reverse('url_stockentry_list',
-                    kwargs={'shop_pk': self.shop.pk})
-        )
+            try:
+                create_stockentry(
+                    self.shop, request.user, stockentry_form.cleaned_data,
+                    with_inventory=add_inventory_form.cleaned_data['isAddingInventory'] == 'with')
+            except ValidationError as error:
+                add_inventory_form.add_error(None, error)
+            else:
+                return redirect(
+                    reverse('url_stockentry_list',
+                            kwargs={'shop_pk': self.shop.pk})
+                )
+
+        context = self.get_context_data(**kwargs)
+        context['stockentry_form'] = stockentry_form
+        context['add_inventory_form'] = add_inventory_form
+        return render(request, self.template_name, context=context)
 
 
 class StockEntryRetrieveView(ShopMixin, BorgiaView):
@@ -238,52 +206,23 @@ class InventoryCreateView(ShopMixin, BorgiaView):
         additionnal_data_form = AdditionnalDataInventoryForm(request.POST)
 
         if inventory_formset.is_valid() and additionnal_data_form.is_valid():
-            inventory = Inventory.objects.create(
-                operator=request.user, shop=self.shop)
-
-            # Ids in the form
-            if inventory_formset.is_valid():
-                for form in inventory_formset.cleaned_data:
-                    try:
-                        product = get_product_from_form(form['product'])
-                        quantity = get_normalized_quantity(
-                            product, form['unit_quantity'], form['quantity'])
-
-                        InventoryProduct.objects.create(
-                            inventory=inventory,
-                            product=product,
-                            quantity=quantity
-                        )
-
-                    except ObjectDoesNotExist:
-                        pass
-
-                if additionnal_data_form.is_valid():
-                    if additionnal_data_form.cleaned_data['type'] == 'full':
-                        # Ids not in the form but active in the shop
-                        try:
-                            for product in Product.objects.filter(shop=self.shop, is_removed=False, is_active=True).exclude(
-                                    pk__in=[form['product'].split('/')[0] for form in inventory_formset.cleaned_data]):
-                                InventoryProduct.objects.create(
-                                    inventory=inventory,
-                                    product=product,
-                                    quantity=decimal.Decimal(0)
-                                )
-
-                        except ObjectDoesNotExist:
-                            pass
-                        except (ZeroDivisionError, decimal.DivisionUndefined, decimal.DivisionByZero):
-                            pass
-
-                # Update all correcting factors listed
-                inventory.update_correcting_factors()
-
-            return redirect(
-                reverse('url_inventory_list',
-                        kwargs={'shop_pk': self.shop.pk})
-            )
-        else:
-            return self.get(request)
+            try:
+                # Correcting factors are updated too
+                create_inventory(
+                    self.shop, request.user, inventory_formset.cleaned_data,
+                    full=additionnal_data_form.cleaned_data['type'] == 'full')
+            except ValidationError as error:
+                additionnal_data_form.add_error(None, error)
+            else:
+                return redirect(
+                    reverse('url_inventory_list',
+                            kwargs={'shop_pk': self.shop.pk})
+                )
+
+        context = self.get_context_data(**kwargs)
+        context['inventory_formset'] = inventory_formset
+        context['additionnal_data_form'] = additionnal_data_form
+        return render(request, self.template_name, context=context)
 
 
 class InventoryRetrieveView(ShopMixin, BorgiaView):
@@ -320,43 +259,3 @@ class InventoryRetrieveView(ShopMixin, BorgiaView):
         context['inventory'] = self.inventory
         return render(request, self.template_name, context=context)
 
-
-def get_product_from_form(form_product):
-    return Product.objects.get(pk=form_product.split('/')[0])
-
-
-def get_normalized_quantity(product, form_unit_quantity, form_quantity):
-    # Container
-    if product.unit:
-        if product.unit == 'G':
-            if form_unit_quantity == 'G':
-                quantity = decimal.Decimal(form_quantity)
-            elif form_unit_quantity == 'KG':
-                quantity = decimal.Decimal(form_quantity * 1000)
-        elif product.unit == 'CL':
-            if form_unit_quantity == 'CL':
-                quantity = decimal.Decimal(form_quantity)
-            elif form_unit_quantity == 'L':
-                quantity = decimal.Decimal(form_quantity * 100)
-    else:
-        # Single product
-        quantity = form_quantity
-
-    return quantity
-
-
-def get_normalized_price(form_unit_quantity, form_quantity, form_unit_amount, form_amount):
-    # Container
-    if form_unit_amount == 'PACKAGE':
-        price = decimal.Decimal(form_amount)
-    else:
-        if form_unit_quantity == 'G' and form_unit_amount == 'KG':
-            price = decimal.Decimal(
-                form_amount * decimal.Decimal(form_quantity / 1000))
-        elif form_unit_quantity == 'CL' and form_unit_amount == 'L':
-            price = decimal.Decimal(
-                form_amount * decimal.Decimal(form_quantity / 100))
-        else:
-            price = decimal.Decimal(form_amount * form_quantity)
-
-    return price
@@ -0,0 +1,33 @@
+from django.conf import settings
+
+from users.models import User
+from users.tokens import read_token
+
+
+class TokenBackend:
+    """
+    Authenticate a user from a token of users.tokens, with a single query.
+
+    The token is refused if it was issued before User.jwt_iat, or if the user
+    is inactive and TOKEN_CHECK_ACTIVE_USER is set (the default).
+    """
+
+    def authenticate(self, request, token=None):
+        payload = read_token(token) if token else None
+        if payload is None:
+            return None
+        try:
+            user = User.objects.get(pk=payload['id'])
+        except User.DoesNotExist:
+            return None
+        if payload['iat'] < user.jwt_iat.timestamp():
+            return None
+        if getattr(settings, 'TOKEN_CHECK_ACTIVE_USER', True) and not user.is_active:
+            return None
+        return user
+
+    def get_user(self, user_id):
+        try:
+            return User.objects.get(pk=user_id)
+        except User.DoesNotExist:
+            return None
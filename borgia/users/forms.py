@@ -1,8 +1,10 @@
 from django import forms
+from django.contrib.auth.models import Group
 from django.core.exceptions import ValidationError
 from django.forms.widgets import PasswordInput
 
 from users.models import User, get_list_year
+from users.utils import get_lifecycle_users
 
 
 class UserCreationCustomForm(forms.Form):
@@ -135,6 +137,84 @@ class UserSearchForm(forms.Form):
         self.fields['year'].choices = YEAR_CHOICES
 
 
+class UserLifecycleForm(forms.Form):
+    """
+    Selection of users by promotion, campus, group and state, and the
+    operation to apply to all of them.
+    """
+    ACTION_CHOICES = (
+        ('deactivate', 'Désactiver'),
+        ('reactivate', 'Réactiver'),
+        ('reassign_groups', 'Changer de groupes'),
+        ('reset_theme', 'Réinitialiser le thème')
+    )
+
+    year = forms.ChoiceField(label="Prom'ss", required=False)
+    campus = forms.ChoiceField(label="Tabagn'ss",
+                               choices=(('all', 'Toutes'),) + User.CAMPUS_CHOICES,
+                               required=False)
+    group = forms.ModelChoiceField(label='Groupe', queryset=Group.objects.all(),
+                                   empty_label='Tous', required=False)
+    state = forms.ChoiceField(label='Etat', choices=(('', "Selon l'opération"),
+                                                     ('active', 'Actifs'),
+                                                     ('unactive', 'Désactivés'),
+                                                     ('all', 'Tous')),
+                              required=False)
+    action = forms.ChoiceField(label='Opération', choices=ACTION_CHOICES)
+
+    def __init__(self, *args, **kwargs):
+        possible_groups = kwargs.pop('possible_groups')
+        super().__init__(*args, **kwargs)
+
+        # Every year, the deactivated promotions included.
+        self.fields['year'].choices = [('all', 'Toutes')] + list(reversed(User.YEAR_CHOICES))
+        self.fields['groups_added'] = forms.ModelMultipleChoiceField(
+            label='Groupes ajoutés',
+            queryset=possible_groups,
+            widget=forms.SelectMultiple(attrs={'class': 'selectpicker'}),
+            required=False)
+        self.fields['groups_removed'] = forms.ModelMultipleChoiceField(
+            label='Groupes retirés',
+            queryset=possible_groups,
+            widget=forms.SelectMultiple(attrs={'class': 'selectpicker'}),
+            required=False)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if (cleaned_data.get('year') in (None, '', 'all') and cleaned_data.get('campus') in (None, '', 'all')
+                and cleaned_data.get('group') is None):
+            raise ValidationError("Sélectionnez une prom's, une tabagn's ou un groupe.")
+        if (cleaned_data.get('action'), cleaned_data.get('state')) in (('deactivate', 'unactive'),
+                                                                        ('reactivate', 'active')):
+            raise ValidationError("Cet état ne correspond pas à l'opération.")
+        if cleaned_data.get('action') == 'reassign_groups':
+            if not cleaned_data.get('groups_added') and not cleaned_data.get('groups_removed'):
+                raise ValidationError('Sélectionnez les groupes ajoutés ou retirés.')
+            if set(cleaned_data.get('groups_added', [])) & set(cleaned_data.get('groups_removed', [])):
+                raise ValidationError('Un groupe ne peut pas être à la fois ajouté et retiré.')
+        return cleaned_data
+
+    def get_users(self, operator):
+        """
+        Return the users selected, see get_lifecycle_users.
+
+        Without a state, the reactivation selects the deactivated users and the
+        other operations the active ones.
+
+        :param operator: User applying the operation, never selected.
+        """
+        year = self.cleaned_data.get('year')
+        campus = self.cleaned_data.get('campus')
+        state = self.cleaned_data.get('state')
+        if not state:
+            state = 'unactive' if self.cleaned_data.get('action') == 'reactivate' else 'active'
+        return get_lifecycle_users(
+            year=None if year in ('', 'all') else year,
+            campus=None if campus in ('', 'all') else campus,
+            group=self.cleaned_data.get('group'),
+            is_active=None if state == 'all' else state == 'active').exclude(pk=operator.pk)
+
+
 class UserQuickSearchForm(forms.Form):
     search = forms.CharField(
         max_length=255,
@@ -0,0 +1,36 @@
+from django.contrib.auth.models import AnonymousUser
+
+from users.backends import TokenBackend
+from users.tokens import get_request_token
+
+TOKEN_BACKEND = 'users.backends.TokenBackend'
+
+
+class TokenAuthenticationMiddleware:
+    """
+    Authenticate the requests with a token in the Authorization header,
+    instead of the session.
+
+    Must be placed after AuthenticationMiddleware. The session isn't read, and
+    an invalid token gives an anonymous user rather than the user of the
+    session. Requests authenticated by token aren't checked against CSRF:
+    the token isn't sent automatically by the browser like a cookie.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.backend = TokenBackend()
+
+    def __call__(self, request):
+        token = get_request_token(request)
+        if token is not None:
+            # The backend is called directly, not through authenticate, so that
+            # an invalid token doesn't fall back to the password backends.
+            user = self.backend.authenticate(request, token=token)
+            if user is None:
+                request.user = AnonymousUser()
+            else:
+                user.backend = TOKEN_BACKEND
+                request.user = user
+                request._dont_enforce_csrf_checks = True
+        return self.get_response(request)
@@ -3,13 +3,19 @@ import decimal
 import itertools
 
 from django.contrib.auth.models import AbstractUser
+from django.core.cache import cache
 from django.core.validators import RegexValidator
 from django.db import models
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.utils import timezone
 
 from borgia.utils import (PRESIDENTS_GROUP_NAME, VICE_PRESIDENTS_GROUP_NAME, TREASURERS_GROUP_NAME,
                           INTERNALS_GROUP_NAME, EXTERNALS_GROUP_NAME)
 
+LIST_YEAR_CACHE_KEY = 'users:list_year'
+LIST_YEAR_CACHE_TIMEOUT = 300
+
 
 class User(AbstractUser):
     """
@@ -203,7 +209,7 @@ class User(AbstractUser):
             raise ValueError('The amount must be positive')
 
         self.balance += amount
-        self.save()
+        self.save(update_fields=['balance'])
 
     def debit(self, amount):
         """
@@ -224,7 +230,15 @@ class User(AbstractUser):
             raise ValueError('The amount must be strictly positive')
 
         self.balance -= amount
-        self.save()
+        self.save(update_fields=['balance'])
+
+    def revoke_tokens(self):
+        """
+        Revoke all the authentication tokens of the user, see users.tokens.
+        Tokens issued before jwt_iat are refused.
+        """
+        self.jwt_iat = timezone.now()
+        self.save(update_fields=['jwt_iat'])
 
     def list_transaction(self):
         """
@@ -255,12 +269,25 @@ def get_list_year():
     """
     Return the list of current used years in all the users.
 
+    The list is computed with a single query, and cached until a user changes.
+
     :returns: list of integer years used by users, by decreasing dates.
     """
-    list_year = []
-    # For each user except admin
-    for user in User.objects.filter(is_active=True).exclude(pk=1):
-        if user.year not in list_year:
-            if user.year is not None:  # year is not mandatory
-                list_year.append(user.year)
-    return sorted(list_year, reverse=True)
+    list_year = cache.get(LIST_YEAR_CACHE_KEY)
+    if list_year is None:
+        # For each user except admin, year is not mandatory
+        list_year = list(User.objects.filter(is_active=True, year__isnull=False).exclude(pk=1)
+                         .order_by('-year').values_list('year', flat=True).distinct())
+        cache.set(LIST_YEAR_CACHE_KEY, list_year, LIST_YEAR_CACHE_TIMEOUT)
+    return list_year
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_list_year(update_fields=None, **kwargs):
+    """
+    Invalidate the cached list of years when the year or the state of a user
+    may have changed.
+    """
+    if update_fields is None or {'year', 'is_active'} & set(update_fields):
+        cache.delete(LIST_YEAR_CACHE_KEY)
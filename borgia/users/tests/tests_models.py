@@ -1,3 +1,4 @@
+from django.core.cache import cache
 from django.test import TestCase
 
 from users.models import User, get_list_year
@@ -121,6 +122,24 @@ class ListYearTest(TestCase):
         self.user2 = User.objects.create(username='user2', year=2011)
         self.user3 = User.objects.create(username='user3', year=2016)
         self.user4 = User.objects.create(username='user4', year=1901)
+        cache.clear()
 
     def test_list_year(self):
         self.assertListEqual(get_list_year(), [2016, 2011, 1901])
+
+    def test_list_year_cached(self):
+        get_list_year()
+        with self.assertNumQueries(0):
+            self.assertListEqual(get_list_year(), [2016, 2011, 1901])
+
+        User.objects.create(username='user5', year=2016)
+        self.user2.is_active = False
+        self.user2.save()
+        self.assertListEqual(get_list_year(), [2016, 1901])
+
+    def test_list_year_kept_on_balance_change(self):
+        get_list_year()
+        self.user3.credit(10)
+        self.user3.debit(5)
+        with self.assertNumQueries(0):
+            self.assertListEqual(get_list_year(), [2016, 2011, 1901])
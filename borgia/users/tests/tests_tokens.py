@@ -0,0 +1,75 @@
+import json
+
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from borgia.tests.tests_views import BaseBorgiaViewsTestCase
+from users.backends import TokenBackend
+from users.tokens import make_token
+
+
+class TokenAuthenticationTestCase(BaseBorgiaViewsTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.token = make_token(self.user1)
+        self.balance_url = reverse('url_balance_from_username') + '?username=user2'
+
+    def get_with_token(self, url, token):
+        return Client().get(url, HTTP_AUTHORIZATION='Bearer ' + token)
+
+    def test_backend(self):
+        self.assertEqual(TokenBackend().authenticate(None, token=self.token), self.user1)
+        self.assertIsNone(TokenBackend().authenticate(None, token=self.token + 'a'))
+        self.assertIsNone(TokenBackend().authenticate(None, token=None))
+
+    def test_obtain(self):
+        self.user1.set_password('password')
+        self.user1.save()
+        response = Client().post(reverse('url_token_obtain'),
+                                 {'username': 'user1', 'password': 'password'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(TokenBackend().authenticate(None, token=response.json()['token']), self.user1)
+
+        response = Client().post(reverse('url_token_obtain'),
+                                 {'username': 'user1', 'password': 'wrong'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_request_without_session(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.get_with_token(self.balance_url, self.token)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content), '144.00')
+        self.assertFalse([query for query in context.captured_queries if 'django_session' in query['sql']])
+
+    def test_revoke(self):
+        self.user1.revoke_tokens()
+        response = self.get_with_token(self.balance_url, self.token)
+        self.assertEqual(response.status_code, 302)
+
+        response = self.get_with_token(self.balance_url, make_token(self.user1))
+        self.assertEqual(response.status_code, 200)
+
+    def test_revoke_view(self):
+        # Authenticated by token, the CSRF token isn't needed.
+        response = Client(enforce_csrf_checks=True).post(
+            reverse('url_token_revoke'), HTTP_AUTHORIZATION='Bearer ' + self.token)
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(TokenBackend().authenticate(None, token=self.token))
+
+    def test_invalid_token_ignores_session(self):
+        response = self.client1.get(self.balance_url, HTTP_AUTHORIZATION='Bearer invalid')
+        self.assertEqual(response.status_code, 302)
+
+    def test_inactive_user(self):
+        self.user1.is_active = False
+        self.user1.save()
+        self.assertIsNone(TokenBackend().authenticate(None, token=self.token))
+        with self.settings(TOKEN_CHECK_ACTIVE_USER=False):
+            self.assertEqual(TokenBackend().authenticate(None, token=self.token), self.user1)
+
+    @override_settings(TOKEN_TIMEOUT_DAYS=-1)
+    def test_expired(self):
+        self.assertIsNone(TokenBackend().authenticate(None, token=self.token))
@@ -1,9 +1,13 @@
+from django.contrib.auth.models import Group, Permission
 from django.test import Client
 from django.urls import reverse
 
 from borgia.tests.utils import get_login_url_redirected
 from borgia.tests.tests_views import BaseBorgiaViewsTestCase
-from borgia.utils import get_members_group
+from borgia.utils import (PERMISSIONS_VERSION, PRESIDENTS_GROUP_NAME,
+                          VICE_PRESIDENTS_GROUP_NAME, get_data_version,
+                          get_members_group, human_unused_permissions)
+from events.models import Event
 from users.models import User
 
 
@@ -175,6 +179,19 @@ class UserDeactivateViewTestCase(BaseFocusUserViewsTestCase):
     def test_offline_user_redirection(self):
         super().offline_user_redirection()
 
+    def test_deactivate_post(self):
+        user = User.objects.create(username='member')
+        user.groups.add(get_members_group(), Group.objects.get(name=PRESIDENTS_GROUP_NAME))
+        response = self.client1.post(self.get_url(user.pk))
+        self.assertEqual(response.status_code, 302)
+        user.refresh_from_db()
+        self.assertFalse(user.is_active)
+        self.assertEqual(list(user.groups.all()), [get_members_group()])
+
+        response = self.client1.post(self.get_url(user.pk))
+        user.refresh_from_db()
+        self.assertTrue(user.is_active)
+
 
 class UpdateGroupViewTestCase(BaseBorgiaViewsTestCase):
     url_view = 'url_group_update'
@@ -188,6 +205,28 @@ class UpdateGroupViewTestCase(BaseBorgiaViewsTestCase):
                 self.get_url(group_pk))
             self.assertEqual(response_client1.status_code, 200)
 
+    def test_allowed_user_post(self):
+        group = get_members_group()
+        group.permissions.set(Permission.objects.filter(codename__in=['view_user', 'add_user']))
+        version = get_data_version(PERMISSIONS_VERSION)
+        new_permissions = Permission.objects.filter(codename__in=['view_user', 'view_shop'])
+
+        response = self.client1.post(self.get_url(group.pk), {
+            'members': [self.user1.pk, self.user3.pk],
+            'permissions': [permission.pk for permission in new_permissions]})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(set(group.user_set.all()), {self.user1, self.user3})
+        self.assertEqual(set(group.permissions.all()), set(new_permissions))
+        # The other groups of the members are kept.
+        self.assertTrue(self.user1.groups.filter(name='presidents').exists())
+        self.assertGreater(get_data_version(PERMISSIONS_VERSION), version)
+
+    def test_unused_permissions_not_proposed(self):
+        response = self.client1.get(self.get_url(get_members_group().pk))
+        proposed = {int(value) for value, label in response.context['form'].fields['permissions'].choices}
+        self.assertTrue(human_unused_permissions())
+        self.assertFalse(proposed & set(human_unused_permissions()))
+
     def test_not_existing_focus_get(self):
         response_client1 = self.client1.get(
             self.get_url(5353))
@@ -203,3 +242,97 @@ class UpdateGroupViewTestCase(BaseBorgiaViewsTestCase):
             self.get_url(1))
         self.assertEqual(response_offline_user.status_code, 302)
         self.assertRedirects(response_offline_user, get_login_url_redirected(self.get_url(1)))
+
+
+class UserLifecycleViewTestCase(BaseGeneralUserViewsTestCase):
+    url_view = 'url_user_lifecycle'
+
+    def setUp(self):
+        super().setUp()
+        self.promo = [User.objects.create(username='promo' + str(i), year=2019, campus='ME', theme='dark')
+                      for i in range(3)]
+        for user in self.promo:
+            user.groups.add(get_members_group())
+        self.promo[0].groups.add(Group.objects.get(name=PRESIDENTS_GROUP_NAME))
+        self.other = User.objects.create(username='other', year=2020, campus='ME')
+
+    def post(self, action, apply=True, **data):
+        data = dict({'year': 2019, 'state': 'active', 'action': action}, **data)
+        if apply:
+            data['apply'] = ''
+        return self.client1.post(self.get_url(), data)
+
+    def test_allowed_user_get(self):
+        super().allowed_user_get()
+
+    def test_not_allowed_user_get(self):
+        super().not_allowed_user_get()
+
+    def test_offline_user_redirection(self):
+        super().offline_user_redirection()
+
+    def test_preview(self):
+        response = self.post('deactivate', apply=False)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['user_count'], 3)
+        self.assertEqual(User.objects.filter(year=2019, is_active=True).count(), 3)
+
+    def test_selection_required(self):
+        response = self.client1.post(self.get_url(), {'year': 'all', 'campus': 'all', 'action': 'reset_theme',
+                                                      'apply': ''})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['form'].non_field_errors())
+
+    def test_deactivate(self):
+        response = self.post('deactivate')
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(User.objects.filter(year=2019, is_active=True).exists())
+        self.assertEqual(list(self.promo[0].groups.all()), [get_members_group()])
+        self.assertTrue(User.objects.get(pk=self.other.pk).is_active)
+
+        response = self.post('reactivate', state='unactive')
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(User.objects.filter(year=2019, is_active=True).count(), 3)
+
+    def test_reactivate_default_state(self):
+        self.post('deactivate')
+        response = self.post('reactivate', state='')
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(User.objects.filter(year=2019, is_active=True).count(), 3)
+
+        response = self.post('reactivate', apply=False)
+        self.assertTrue(response.context['form'].non_field_errors())
+
+    def test_operator_and_association_excluded(self):
+        presidents_group = Group.objects.get(name=PRESIDENTS_GROUP_NAME)
+        User.objects.get(pk=1).groups.add(presidents_group)
+        User.objects.filter(pk__in=[1, self.user1.pk]).update(year=2019)
+        response = self.post('deactivate', group=presidents_group.pk)
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(User.objects.get(pk=1).is_active)
+        self.assertTrue(User.objects.get(pk=self.user1.pk).is_active)
+        self.assertFalse(User.objects.get(pk=self.promo[0].pk).is_active)
+        self.assertTrue(User.objects.get(pk=self.promo[1].pk).is_active)
+
+    def test_deactivate_open_event(self):
+        Event.objects.create(description='Event', manager=self.promo[1])
+        response = self.post('deactivate')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([event.manager for event in response.context['events']], [self.promo[1]])
+        self.assertEqual(User.objects.filter(year=2019, is_active=True).count(), 3)
+
+    def test_reassign_groups(self):
+        vice_presidents_group = Group.objects.get(name=VICE_PRESIDENTS_GROUP_NAME)
+        presidents_group = Group.objects.get(name=PRESIDENTS_GROUP_NAME)
+        version = get_data_version(PERMISSIONS_VERSION)
+        response = self.post('reassign_groups', groups_added=[vice_presidents_group.pk],
+                             groups_removed=[presidents_group.pk])
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(vice_presidents_group.user_set.filter(year=2019).count(), 3)
+        self.assertFalse(presidents_group.user_set.filter(year=2019).exists())
+        self.assertNotEqual(get_data_version(PERMISSIONS_VERSION), version)
+
+    def test_reset_theme(self):
+        response = self.post('reset_theme', campus='ME')
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(User.objects.filter(year=2019, theme__isnull=False).exists())
@@ -0,0 +1,53 @@
+"""
+Signed authentication tokens, for kiosks and operator terminals.
+
+A token holds the pk of the user and its date of issue, signed with
+SECRET_KEY. It's sent in the header "Authorization: Bearer <token>" and
+authenticates the request without reading the session. Tokens issued before
+User.jwt_iat are refused: User.revoke_tokens revokes all the tokens of a user.
+"""
+import datetime
+import time
+
+from django.conf import settings
+from django.core import signing
+
+TOKEN_SALT = 'users.tokens'
+TOKEN_PREFIX = 'Bearer '
+
+
+def get_token_timeout():
+    """
+    Return the validity of a token, in seconds.
+    """
+    return datetime.timedelta(days=getattr(settings, 'TOKEN_TIMEOUT_DAYS', 7)).total_seconds()
+
+
+def make_token(user):
+    """
+    Return a new token for the user.
+    """
+    return signing.dumps({'id': user.pk, 'iat': time.time()}, salt=TOKEN_SALT)
+
+
+def read_token(token):
+    """
+    Return the payload of a token, None if it's altered or expired.
+    """
+    try:
+        payload = signing.loads(token, salt=TOKEN_SALT, max_age=get_token_timeout())
+    except signing.BadSignature:
+        return None
+    if not isinstance(payload, dict) or 'id' not in payload or 'iat' not in payload:
+        return None
+    return payload
+
+
+def get_request_token(request):
+    """
+    Return the token of the Authorization header, None if there is none.
+    """
+    header = request.META.get('HTTP_AUTHORIZATION', '')
+    if not header.startswith(TOKEN_PREFIX):
+        return None
+    return header[len(TOKEN_PREFIX):].strip()
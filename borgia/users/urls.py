@@ -1,15 +1,18 @@
 from django.urls import include, path
 
 from users.views import (GroupUpdateView, UserAddByListXlsxDownload,
-                         UserCreateView, UserDeactivateView, UserListView,
+                         UserCreateView, UserDeactivateView, UserLifecycleView,
+                         UserListView,
                          UserRetrieveView, UserUpdateView,
                          UserUploadXlsxView, balance_from_username,
+                         token_obtain, token_revoke,
                          username_from_username_part)
 
 users_patterns = [
     path('users/', include([
         path('', UserListView.as_view(), name='url_user_list'),
         path('create/', UserCreateView.as_view(), name='url_user_create'),
+        path('lifecycle/', UserLifecycleView.as_view(), name='url_user_lifecycle'),
         path('<int:user_pk>/', include([
             path('', UserRetrieveView.as_view(), name='url_user_retrieve'),
             path('update/', UserUpdateView.as_view(), name='url_user_update'),
@@ -21,5 +24,7 @@ users_patterns = [
     ])),
     path('groups/<int:group_pk>/update/', GroupUpdateView.as_view(), name='url_group_update'),
     path('ajax/username_from_username_part/', username_from_username_part, name='url_ajax_username_from_username_part'),
-    path('ajax/balance_from_username/', balance_from_username, name='url_balance_from_username')
+    path('ajax/balance_from_username/', balance_from_username, name='url_balance_from_username'),
+    path('auth/token/', token_obtain, name='url_token_obtain'),
+    path('auth/token/revoke/', token_revoke, name='url_token_revoke')
 ]
@@ -0,0 +1,105 @@
+"""
+Lifecycle operations on a set of users, selected by promotion, campus or
+group: deactivation, reactivation, change of groups and reset of the theme.
+
+Each operation is a few set-based queries in a single transaction, whatever
+the number of users.
+"""
+from django.core.cache import cache
+from django.db import transaction
+
+from borgia.utils import PERMISSIONS_VERSION, bump_data_version, get_members_group
+from events.models import Event
+from finances.utils import ASSOCIATION_USER_PK
+from users.models import LIST_YEAR_CACHE_KEY, User
+
+
+def get_lifecycle_users(year=None, campus=None, group=None, is_active=None):
+    """
+    Return the users matching all the given criteria, None meaning any.
+
+    The association account, recipient of the sales, and the superusers are
+    never selected.
+
+    :param year: promotion of the users.
+    :param campus: campus of the users.
+    :param group: Group the users belong to.
+    :param is_active: state of the users.
+    """
+    users = User.objects.exclude(pk=ASSOCIATION_USER_PK).exclude(is_superuser=True)
+    if year is not None:
+        users = users.filter(year=year)
+    if campus is not None:
+        users = users.filter(campus=campus)
+    if group is not None:
+        users = users.filter(groups=group)
+    if is_active is not None:
+        users = users.filter(is_active=is_active)
+    return users
+
+
+def get_open_managed_events(user_pks):
+    """
+    Return the events not done managed by the users, in a single query.
+
+    A user managing such an event can't be deactivated, the management must be
+    given to another user first.
+    """
+    return Event.objects.filter(manager_id__in=user_pks, done=False).select_related(
+        'manager').order_by('manager__username', 'date')
+
+
+def deactivate_users(user_pks):
+    """
+    Deactivate the users. The internal members lose every other group,
+    special members keep theirs.
+
+    The open managed events must have been checked before, see
+    get_open_managed_events.
+    """
+    members_group = get_members_group()
+    through = User.groups.through
+    with transaction.atomic():
+        User.objects.filter(pk__in=user_pks).update(is_active=False)
+        through.objects.filter(
+            user_id__in=through.objects.filter(user_id__in=user_pks, group=members_group).values('user_id')
+        ).exclude(group=members_group).delete()
+    cache.delete(LIST_YEAR_CACHE_KEY)
+    bump_data_version(PERMISSIONS_VERSION)
+
+
+def reactivate_users(user_pks):
+    """
+    Reactivate the users, their groups are unchanged.
+    """
+    User.objects.filter(pk__in=user_pks).update(is_active=True)
+    cache.delete(LIST_YEAR_CACHE_KEY)
+
+
+def reassign_users_groups(user_pks, groups_added, groups_removed):
+    """
+    Add the users to some groups and remove them from others, by difference
+    with the current links, in a single transaction.
+
+    :param groups_added: groups the users must belong to.
+    :param groups_removed: groups the users must leave.
+    """
+    through = User.groups.through
+    with transaction.atomic():
+        through.objects.filter(user_id__in=user_pks,
+                               group__in=[group.pk for group in groups_removed]).delete()
+        existing = set(through.objects.filter(
+            user_id__in=user_pks, group__in=[group.pk for group in groups_added]
+        ).values_list('user_id', 'group_id'))
+        through.objects.bulk_create(
+            through(user_id=user_pk, group_id=group.pk)
+            for user_pk in user_pks for group in groups_added
+            if (user_pk, group.pk) not in existing)
+    bump_data_version(PERMISSIONS_VERSION)
+
+
+def reset_users_theme(user_pks):
+    """
+    Reset the theme of the users to the default one.
+    """
+    User.objects.filter(pk__in=user_pks).update(theme=None)
@@ -6,25 +6,33 @@ import string
 
 import openpyxl
 from django.contrib import messages
+from django.contrib.auth import authenticate
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import (LoginRequiredMixin,
                                         PermissionRequiredMixin)
 from django.contrib.auth.models import Group, Permission
 from django.core.exceptions import ObjectDoesNotExist, PermissionDenied
 from django.db.models import Q
-from django.http import Http404, HttpResponseBadRequest
+from django.http import Http404, HttpResponseBadRequest, JsonResponse
 from django.shortcuts import HttpResponse, redirect, render
 from django.urls import reverse
 from django.utils.encoding import force_text
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 
 from borgia.utils import (get_members_group, human_unused_permissions,
-                          get_permission_name_group_managing)
+                          get_permission_name_group_managing, update_group)
 from borgia.views import BorgiaFormView, BorgiaView
 from configurations.utils import configuration_get
 from users.forms import (GroupUpdateForm, UserCreationCustomForm, UserDownloadXlsxForm,
-                         UserSearchForm, UserUpdateForm, UserUploadXlsxForm)
+                         UserLifecycleForm, UserSearchForm, UserUpdateForm,
+                         UserUploadXlsxForm)
 from users.mixins import GroupMixin, UserMixin
 from users.models import User
+from users.tokens import make_token
+from users.utils import (deactivate_users, get_open_managed_events,
+                         reactivate_users, reassign_users_groups,
+                         reset_users_theme)
 
 
 class UserListView(LoginRequiredMixin, PermissionRequiredMixin, BorgiaFormView):
@@ -291,21 +299,19 @@ class UserDeactivateView(UserMixin, BorgiaView):
     def post(self, request, *args, **kwargs):
         deactivated = False
         if self.user.is_active is True:
-            events = self.user.manager.filter(done=False)
-            if events.count() > 0:
+            events = list(get_open_managed_events([self.user.pk]))
+            if events:
                 for event in events:
                     self.error_event_message += "\n - " + event.description
                 messages.warning(request, self.error_event_message)
             else:
                 deactivated = True
-                self.user.is_active = False
                 # si c'est un gadz. Special members can't be added to other groups
-                if get_members_group() in self.user.groups.all():
-                    self.user.groups.set([get_members_group(), ])
-                self.user.save()
+                deactivate_users([self.user.pk])
+                self.user.is_active = False
         else:
             self.user.is_active = True
-        self.user.save()
+            self.user.save()
 
         if self.user.is_active:
             self.success_message += 'activé'
@@ -327,6 +333,61 @@ class UserDeactivateView(UserMixin, BorgiaView):
         return redirect(force_text(success_url))
 
 
+class UserLifecycleView(LoginRequiredMixin, PermissionRequiredMixin, BorgiaFormView):
+    """
+    Apply an operation to all the users of a promotion, a campus or a group.
+
+    The form is first previewed with the number of users concerned, and the
+    open events managed by them for a deactivation, then applied in a single
+    transaction.
+    """
+    permission_required = ('users.change_user', 'users.delete_user')
+    menu_type = 'managers'
+    lm_active = 'lm_user_list'
+    template_name = 'users/user_lifecycle.html'
+    form_class = UserLifecycleForm
+    error_event_message = "Veuillez attribuer la gestion des évènements suivants à un autre utilisateur avant de désactiver les comptes."
+
+    def get_form_kwargs(self):
+        """
+        Add the groups the user can manage, the only ones which can be
+        reassigned.
+        """
+        kwargs = super().get_form_kwargs()
+        permissions = self.request.user.get_all_permissions()
+        kwargs['possible_groups'] = Group.objects.filter(pk__in=[
+            group.pk for group in Group.objects.all()
+            if get_permission_name_group_managing(group) in permissions])
+        return kwargs
+
+    def form_valid(self, form):
+        user_pks = list(form.get_users(self.request.user).values_list('pk', flat=True))
+        action = form.cleaned_data['action']
+        events = []
+        if action == 'deactivate':
+            events = list(get_open_managed_events(user_pks))
+
+        if 'apply' not in self.request.POST or events or not user_pks:
+            if events:
+                messages.warning(self.request, self.error_event_message)
+            return self.render_to_response(self.get_context_data(
+                form=form, preview=True, user_count=len(user_pks), events=events))
+
+        if action == 'deactivate':
+            deactivate_users(user_pks)
+        elif action == 'reactivate':
+            reactivate_users(user_pks)
+        elif action == 'reassign_groups':
+            reassign_users_groups(user_pks, form.cleaned_data['groups_added'],
+                                  form.cleaned_data['groups_removed'])
+        elif action == 'reset_theme':
+            reset_users_theme(user_pks)
+
+        messages.success(self.request, '%s : %d utilisateurs mis à jour.' % (
+            dict(form.ACTION_CHOICES)[action], len(user_pks)))
+        return redirect(reverse('url_user_lifecycle'))
+
+
 class GroupUpdateView(GroupMixin, BorgiaFormView):
     menu_type = 'managers'
     template_name = 'users/group_update.html'
@@ -367,46 +428,26 @@ class GroupUpdateView(GroupMixin, BorgiaFormView):
         else:
             query = Permission.objects.all()
 
+        # The label of a permission shows its content type.
         kwargs['possible_permissions'] = query.exclude(
-            pk__in=human_unused_permissions())
+            pk__in=human_unused_permissions()).select_related('content_type')
         kwargs['possible_members'] = User.objects.filter(is_active=True).exclude(
             groups=get_members_group(is_externals=True))
         return kwargs
 
     def get_initial(self):
         initial = super().get_initial()
-        initial['members'] = self.group.user_set.all()
-        initial['permissions'] = self.group.permissions.all()
+        initial['members'] = self.group.user_set.values_list('pk', flat=True)
+        initial['permissions'] = self.group.permissions.values_list('pk', flat=True)
         return initial
 
     def form_valid(self, form):
         """
         Update permissions and members of the group updated.
         """
-        old_members = self.group.user_set.all()
-        new_members = form.cleaned_data['members']
-        old_permissions = self.group.permissions.all()
-        new_permissions = form.cleaned_data['permissions']
-
-        # Modification des membres
-        for member in old_members:
-            if member not in new_members:
-                member.groups.remove(self.group)
-                member.save()
-        for member in new_members:
-            if member not in old_members:
-                member.groups.add(self.group)
-                member.save()
-
-        # Modification des permissions
-        for perm in old_permissions:
-            if perm not in new_permissions:
-                self.group.permissions.remove(perm)
-        for perm in new_permissions:
-            if perm not in old_permissions:
-                self.group.permissions.add(perm)
-        self.group.save()
-
+        update_group(self.group,
+                     form.cleaned_data['members'].values_list('pk', flat=True),
+                     form.cleaned_data['permissions'].values_list('pk', flat=True))
         return super().form_valid(form)
 
     def get_success_message(self, cleaned_data):
@@ -672,3 +713,27 @@ def balance_from_username(request):
             return HttpResponseBadRequest()
     else:
         raise PermissionDenied
+
+
+@csrf_exempt
+@require_POST
+def token_obtain(request):
+    """
+    Return a new authentication token for the username and password posted,
+    see users.tokens.
+    """
+    user = authenticate(request, username=request.POST.get('username'),
+                        password=request.POST.get('password'))
+    if user is None or not user.is_active:
+        return JsonResponse({'errors': {'__all__': ['Identifiants invalides.']}}, status=400)
+    return JsonResponse({'token': make_token(user)})
+
+
+@login_required
+@require_POST
+def token_revoke(request):
+    """
+    Revoke all the authentication tokens of the user.
+    """
+    request.user.revoke_tokens()
+    return JsonResponse({})
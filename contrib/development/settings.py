@@ -43,6 +43,7 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'bootstrapform',
     'static_precompiler',
+    'borgia',
     'configurations',
     'users',
     'shops',
@@ -54,13 +55,17 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Uncomment to record performances, shown to managers
+    # 'borgia.middleware.PerformanceMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'users.middleware.TokenAuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
-    'django.middleware.clickjacking.XFrameOptionsMiddleware'
+    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'borgia.middleware.ReplicaStickinessMiddleware'
 ]
 
 ROOT_URLCONF = 'borgia.urls'
@@ -89,17 +94,30 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+    },
+    # Stands in for a replica in the tests, see borgia.routers
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'TEST': {'MIRROR': 'default'},
     }
 }
 
+DATABASE_ROUTERS = ['borgia.routers.ReplicaRouter']
+# Alias of the replica, None to read everything from the primary
+REPLICA_DATABASE = None
+# Seconds a client reads from the primary after a write
+REPLICA_STICKY_SECONDS = 10
+
 # Password validation
 AUTHENTICATION_BACKENDS = [
+    'users.backends.TokenBackend',
     'django.contrib.auth.backends.ModelBackend'
 ]
 
-# Token auth backend
-#TOKEN_CHECK_ACTIVE_USER = True
-#TOKEN_TIMEOUT_DAYS = 7
+# Token auth backend, see users.tokens
+TOKEN_CHECK_ACTIVE_USER = True
+TOKEN_TIMEOUT_DAYS = 7
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -168,3 +186,8 @@ SESSION_COOKIE_AGE = 7200
 
 
 DEFAULT_TEMPLATE = "light"  # Default template, en minuscule
+
+
+# Performance records, when borgia.middleware.PerformanceMiddleware is enabled
+PERFORMANCE_RECORDS_SIZE = 1000  # Number of last requests kept, per process
+PERFORMANCE_SLOW_REQUEST_MS = 500  # Requests slower are logged with their queries
@@ -43,6 +43,7 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'bootstrapform',
     'static_precompiler',
+    'borgia',
     'configurations',
     'users',
     'shops',
@@ -54,13 +55,17 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Uncomment to record performances, shown to managers
+    # 'borgia.middleware.PerformanceMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'users.middleware.TokenAuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
-    'django.middleware.clickjacking.XFrameOptionsMiddleware'
+    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'borgia.middleware.ReplicaStickinessMiddleware'
 ]
 
 ROOT_URLCONF = 'borgia.urls'
@@ -93,17 +98,52 @@ DATABASES = {
         'PASSWORD': 'TO BE CHANGED',
         'HOST': 'localhost',
         'PORT': '5432',
+    },
+    # Uncomment to send the reads of the reporting views to a replica, see
+    # borgia.routers
+    # 'replica': {
+    #     'ENGINE': 'django.db.backends.postgresql_psycopg2',
+    #     'NAME': 'TO BE CHANGED',
+    #     'USER': 'TO BE CHANGED',
+    #     'PASSWORD': 'TO BE CHANGED',
+    #     'HOST': 'TO BE CHANGED',
+    #     'PORT': '5432',
+    # }
+}
+
+DATABASE_ROUTERS = ['borgia.routers.ReplicaRouter']
+# Alias of the replica, None to read everything from the primary
+# REPLICA_DATABASE = 'replica'
+# Seconds a client reads from the primary after a write
+REPLICA_STICKY_SECONDS = 10
+
+# Cache, shared by the processes so that invalidations reach all of them:
+# the cached fragments, the directory of the modules and the lists are
+# invalidated in the cache, see borgia.checks.
+# The table is created with: python manage.py createcachetable
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'borgia_cache',
     }
 }
+# Or, with a memcached server and python-memcached installed:
+# CACHES = {
+#     'default': {
+#         'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+#         'LOCATION': '127.0.0.1:11211',
+#     }
+# }
 
 # Password validation
 AUTHENTICATION_BACKENDS = [
+    'users.backends.TokenBackend',
     'django.contrib.auth.backends.ModelBackend'
 ]
 
-# Token auth backend
-#TOKEN_CHECK_ACTIVE_USER = True
-#TOKEN_TIMEOUT_DAYS = 7
+# Token auth backend, see users.tokens
+TOKEN_CHECK_ACTIVE_USER = True
+TOKEN_TIMEOUT_DAYS = 7
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -172,3 +212,8 @@ SESSION_COOKIE_AGE = 7200
 
 
 DEFAULT_TEMPLATE = "light"  # Default template, en minuscule
+
+
+# Performance records, when borgia.middleware.PerformanceMiddleware is enabled
+PERFORMANCE_RECORDS_SIZE = 1000  # Number of last requests kept, per process
+PERFORMANCE_SLOW_REQUEST_MS = 500  # Requests slower are logged with their queries